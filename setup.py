@@ -23,4 +23,10 @@ setuptools.setup(
     install_requires=[
         "requests>=2.24.0",
     ],
+    extras_require={
+        "async": ["httpx"],
+        "fast": ["orjson"],
+        "numpy": ["numpy"],
+        "parquet": ["pyarrow"],
+    },
 )
\ No newline at end of file
@@ -1,14 +1,66 @@
+import array
+import asyncio
+import atexit
+import collections
+import copy
 import datetime
+import email.utils
+import gzip
+import hashlib
 import json
 import logging
+import math
+import mimetypes
 import os
+import queue
+import random
+import re
+import sqlite3
 import sys
+import threading
 import time
-from logging.handlers import TimedRotatingFileHandler
+import uuid
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
 import csv
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from urllib.parse import parse_qsl, urlencode, urlsplit
+from xml.etree import ElementTree
 
 import requests
 from requests import HTTPError
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+# Optional, only needed by AsyncAuth_Helper and AsyncBb_Requests.
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+# Optional, used by Date_Converter to convert whole columns and by
+# Gradebook_Matrix to hold the grades when installed.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Optional, used by Gradebook_Matrix.write_parquet.
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# Optional, faster JSON parsers used by Json_Codec when they are installed.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ujson
+except ImportError:
+    ujson = None
 
 logger = logging.getLogger('Bb_rest_helper')
 logger.propagate = False
@@ -59,6 +111,392 @@ class Get_Config():
     def get_client_id(self):
         return self.data["client_id"]
 
+# Json_Codec
+# Parses the response bodies and serializes the payloads of all the requests.
+# It uses orjson if installed, then ujson, and the json module otherwise; name
+# ('orjson', 'ujson' or 'json') forces one of them. loads takes the raw bytes
+# of the body (r.content), so the body is not decoded to a str first, and dumps
+# returns compact UTF-8 bytes ready to be sent. The module wide json_codec is
+# the one used by default, install orjson with "pip install orjson".
+
+
+class Json_Codec():
+
+    logger = logging.getLogger('Bb_rest_helper')
+    logger.propagate = False
+
+    def __init__(self, name: str = None):
+        if name is None:
+            name = 'orjson' if orjson else 'ujson' if ujson else 'json'
+        if name == 'orjson' and orjson is None or name == 'ujson' and ujson is None:
+            raise ImportError(f'{name} is not installed, install it with "pip install {name}"')
+        if name not in ('orjson', 'ujson', 'json'):
+            raise ValueError(f'Unknown JSON codec: {name}')
+        self.name = name
+        if name == 'orjson':
+            self.loads = orjson.loads
+        elif name == 'ujson':
+            self.loads = ujson.loads
+
+    # Parses a JSON document from bytes or str. Raises ValueError if it is not
+    # valid JSON, whatever the parser. __init__ replaces it with orjson.loads or
+    # ujson.loads, so they are called without any extra step.
+    def loads(self, data):
+        return json.loads(data)
+
+    # Serializes an object to compact JSON, as UTF-8 bytes.
+    def dumps(self, obj):
+        if self.name == 'orjson':
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+        if self.name == 'ujson':
+            return ujson.dumps(obj, ensure_ascii=False).encode('utf-8')
+        return json.dumps(obj, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+json_codec = Json_Codec()
+
+# Bb_Session
+# A wrapper around requests.Session that keeps a pool of keep-alive connections
+# to the Learn server, so consecutive calls reuse an open TCP/TLS connection instead
+# of doing a new handshake every time. pool_connections is the number of hosts
+# to keep a pool for, pool_maxsize the number of connections kept open per host
+# (match it to the number of threads sharing the session) and pool_block makes
+# threads wait for a free connection instead of opening extra ones. timeout is the
+# default (connect, read) timeout in seconds for every request, None waits forever.
+# A Bb_Session can be shared by several Bb_Requests and Auth_Helper instances and
+# by several threads, and can be used as a context manager to close the pool.
+
+
+class Bb_Session():
+
+    logger = logging.getLogger('Bb_rest_helper')
+    logger.propagate = False
+
+    def __init__(
+            self,
+            pool_connections: int = 10,
+            pool_maxsize: int = 10,
+            pool_block: bool = False,
+            timeout=None):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.adapter = HTTPAdapter(
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+            pool_block=self.pool_block)
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+        self.closed = False
+        self._lock = threading.Lock()
+
+    # Sends a request through the pooled session, applying the default timeout
+    # unless one is given for this call. Takes the same arguments as requests.request.
+    def request(self, method: str, url: str, **kwargs):
+        if self.closed:
+            raise RuntimeError('The session has been closed')
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.request(method, url, **kwargs)
+
+    # Closes every pooled connection. The session can not be used afterwards.
+    def close(self):
+        with self._lock:
+            if not self.closed:
+                self.session.close()
+                self.closed = True
+                logger.debug('Session closed')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+# Rate_Limiter
+# Paces requests using the X-Rate-Limit-Limit, X-Rate-Limit-Remaining and
+# X-Rate-Limit-Reset headers returned by Learn. One instance can be shared by
+# several Bb_Requests/AsyncBb_Requests instances and threads, so they all draw from
+# the same budget. While more than throttle_below (a fraction of the limit) calls
+# remain, requests are sent at full speed. Below that, the remaining calls minus
+# reserve are spread evenly until the reset, and once only reserve calls are left
+# requests are paused until the reset. A 429 response pauses requests for the time
+# given in Retry-After (or until the reset). budget() returns the current state so
+# schedulers can check it before sending.
+
+
+class Rate_Limiter():
+
+    logger = logging.getLogger('Bb_rest_helper')
+    logger.propagate = False
+
+    def __init__(self, throttle_below: float = 0.2, reserve: int = 0):
+        self.throttle_below = throttle_below
+        self.reserve = reserve
+        self.limit = None
+        self.remaining = None
+        self.reset_at = None
+        self.paused_until = 0.0
+        self.throttled_time = 0.0
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    # Reads the rate limit headers (and the status code) of a response. Works with
+    # the headers of requests and httpx responses.
+    def update(self, headers, status_code: int = None):
+        now = time.monotonic()
+        with self._lock:
+            try:
+                if headers.get('X-Rate-Limit-Limit') is not None:
+                    self.limit = int(headers['X-Rate-Limit-Limit'])
+                if headers.get('X-Rate-Limit-Remaining') is not None:
+                    self.remaining = int(headers['X-Rate-Limit-Remaining'])
+                if headers.get('X-Rate-Limit-Reset') is not None:
+                    self.reset_at = now + float(headers['X-Rate-Limit-Reset'])
+            except ValueError:
+                logger.warning('Rate limit headers could not be read')
+            if status_code == 429:
+                retry_after = _retry_after_seconds(headers)
+                if retry_after is None and self.reset_at:
+                    retry_after = self.reset_at - now
+                self.paused_until = max(self.paused_until, now + (retry_after or 1))
+                logger.warning(
+                    f'Rate limit reached, pausing requests for {self.paused_until - now:.1f} seconds')
+
+    # Returns the number of seconds to wait between requests for the current budget.
+    def _interval(self, now: float):
+        if self.remaining is None or self.limit is None or self.reset_at is None:
+            return 0.0
+        reset_in = max(self.reset_at - now, 0.0)
+        if reset_in == 0.0 or self.remaining > self.limit * self.throttle_below:
+            return 0.0
+        usable = self.remaining - self.reserve
+        if usable <= 0:
+            return None
+        return reset_in / usable
+
+    # Reserves the next slot to send a request and returns the seconds to wait for it.
+    def _reserve(self):
+        with self._lock:
+            now = time.monotonic()
+            interval = self._interval(now)
+            slot = max(now, self._next_slot, self.paused_until)
+            if interval is None:
+                # Budget exhausted, wait until the reset.
+                slot = max(slot, self.reset_at)
+                interval = 0.0
+                self.remaining = None
+            self._next_slot = slot + interval
+            if self.remaining is not None:
+                self.remaining -= 1
+            if slot > now:
+                self.throttled_time += slot - now
+            return slot - now
+
+    # Blocks until a request can be sent. Called before every request. Returns
+    # the seconds waited.
+    def acquire(self):
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return max(wait, 0.0)
+
+    # Same as acquire, for coroutines.
+    async def acquire_async(self):
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return max(wait, 0.0)
+
+    # Returns the current budget: limit, remaining calls, seconds to the reset,
+    # the allowed request rate (calls per second, None if not throttled) and the
+    # seconds requests are paused for.
+    def budget(self):
+        with self._lock:
+            now = time.monotonic()
+            interval = self._interval(now)
+            return {
+                'limit': self.limit,
+                'remaining': self.remaining,
+                'reset_in': max(self.reset_at - now, 0.0) if self.reset_at else None,
+                'rate': None if not interval else 1 / interval,
+                'paused_for': max(self.paused_until - now, 0.0),
+                'throttled_time': self.throttled_time
+            }
+
+
+# Returns the seconds given in the Retry-After header of a response, that can be
+# a number of seconds or an HTTP date, or None if there is no such header.
+def _retry_after_seconds(headers):
+    value = headers.get('Retry-After')
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        try:
+            date = email.utils.parsedate_to_datetime(value)
+            return max((date - datetime.datetime.now(date.tzinfo)).total_seconds(), 0.0)
+        except (TypeError, ValueError):
+            return None
+
+# Retry_Policy
+# Retries requests that fail with a transient error. A request is retried when
+# the response status is in retry_statuses (429 and 5xx gateway errors by default)
+# or when it raises one of retry_exceptions (connection errors and timeouts of
+# requests and httpx by default), up to
+# max_attempts attempts in total. Waits between attempts grow exponentially from
+# backoff_factor seconds up to max_backoff, with full jitter so threads that failed
+# together do not retry together. The Retry-After header of the response is used
+# instead when present, capped at max_retry_after seconds. Only the methods in
+# retry_methods (the idempotent ones) are retried, POST requests are retried only
+# if retry_post is True. The counters returned by stats() show the attempts,
+# retries, requests given up and seconds spent waiting to retry.
+# One instance can be shared by several Bb_Requests/Auth_Helper instances and threads.
+
+
+class Retry_Policy():
+
+    logger = logging.getLogger('Bb_rest_helper')
+    logger.propagate = False
+
+    def __init__(
+            self,
+            max_attempts: int = 3,
+            backoff_factor: float = 0.5,
+            max_backoff: float = 30,
+            jitter: bool = True,
+            retry_statuses=(429, 500, 502, 503, 504),
+            retry_exceptions=None,
+            retry_methods=('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'),
+            retry_post: bool = False,
+            max_retry_after: float = 120):
+        self.max_attempts = max_attempts
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.retry_statuses = set(retry_statuses)
+        if retry_exceptions is None:
+            retry_exceptions = [requests.exceptions.ConnectionError,
+                                requests.exceptions.Timeout]
+            if httpx is not None:
+                retry_exceptions.append(httpx.TransportError)
+        self.retry_exceptions = tuple(retry_exceptions)
+        self.retry_methods = {m.upper() for m in retry_methods}
+        self.retry_post = retry_post
+        self.max_retry_after = max_retry_after
+        self.attempts = 0
+        self.retries = 0
+        self.gave_up = 0
+        self.retry_time = 0.0
+        self.retries_by_status = {}
+        self._lock = threading.Lock()
+
+    # Returns True if requests with this method can be retried. idempotent
+    # overrides the method rules for a single call (i.e. token requests).
+    def can_retry(self, method: str, idempotent: bool = None):
+        if idempotent is not None:
+            return idempotent
+        method = method.upper()
+        if method == 'POST':
+            return self.retry_post
+        return method in self.retry_methods
+
+    # Returns the seconds to wait before the given retry (1 for the first one).
+    def backoff(self, retry: int):
+        delay = min(self.max_backoff, self.backoff_factor * 2 ** (retry - 1))
+        if self.jitter:
+            delay = random.uniform(0, delay)
+        return delay
+
+    # Returns the seconds to wait before retrying after an attempt, or None if the
+    # attempt should not be retried. Takes the response, or the exception raised.
+    def _retry_delay(self, attempt: int, method: str, idempotent, response=None, error=None):
+        with self._lock:
+            self.attempts += 1
+        if error is not None:
+            if not isinstance(error, self.retry_exceptions):
+                return None
+            reason = type(error).__name__
+        elif response.status_code in self.retry_statuses:
+            reason = response.status_code
+        else:
+            return None
+        if not self.can_retry(method, idempotent):
+            return None
+        if attempt >= self.max_attempts:
+            with self._lock:
+                self.gave_up += 1
+            logger.error(f'{method} request failed after {attempt} attempts ({reason})')
+            return None
+        delay = None
+        if response is not None:
+            delay = _retry_after_seconds(response.headers)
+        if delay is None:
+            delay = self.backoff(attempt)
+        else:
+            delay = min(delay, self.max_retry_after)
+        with self._lock:
+            self.retries += 1
+            self.retry_time += delay
+            self.retries_by_status[reason] = self.retries_by_status.get(reason, 0) + 1
+        logger.warning(
+            f'{method} request failed ({reason}), retrying in {delay:.2f} seconds '
+            f'(attempt {attempt} of {self.max_attempts})')
+        return delay
+
+    # Calls send, a function that sends the request and returns the response,
+    # retrying it as set by the policy. Returns the last response, or raises the
+    # last exception. on_retry, if given, is called with the delay before each retry.
+    def call(self, method: str, send, idempotent: bool = None, on_retry=None):
+        attempt = 1
+        while True:
+            try:
+                r = send()
+            except Exception as e:
+                delay = self._retry_delay(attempt, method, idempotent, error=e)
+                if delay is None:
+                    raise
+            else:
+                delay = self._retry_delay(attempt, method, idempotent, response=r)
+                if delay is None:
+                    return r
+            if on_retry is not None:
+                on_retry(delay)
+            time.sleep(delay)
+            attempt += 1
+
+    # Same as call, for coroutines. send must return an awaitable.
+    async def call_async(self, method: str, send, idempotent: bool = None, on_retry=None):
+        attempt = 1
+        while True:
+            try:
+                r = await send()
+            except Exception as e:
+                delay = self._retry_delay(attempt, method, idempotent, error=e)
+                if delay is None:
+                    raise
+            else:
+                delay = self._retry_delay(attempt, method, idempotent, response=r)
+                if delay is None:
+                    return r
+            if on_retry is not None:
+                on_retry(delay)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    # Returns the retry counters.
+    def stats(self):
+        with self._lock:
+            return {
+                'attempts': self.attempts,
+                'retries': self.retries,
+                'gave_up': self.gave_up,
+                'retry_time': self.retry_time,
+                'retries_by_status': dict(self.retries_by_status)
+            }
+
 # Auth_Helper
 # A class to simplify REST API authentication for the Blackboard API.
 
@@ -69,12 +507,58 @@ class Auth_Helper():
     logger.propagate = False
 
     # Initializes the auth helper by taking the target system url,
-    # PI key and secret as arguments.
-    def __init__(self, url: str, key: str, secret: str):
+    # PI key and secret as arguments. Optionally takes a Bb_Session to share
+    # pooled connections with Bb_Requests, a private one is created otherwise (and
+    # closed by close(), or on leaving a with block), a Retry_Policy to retry failed
+    # token requests and a Metrics_Collector.
+    def __init__(
+            self,
+            url: str,
+            key: str,
+            secret: str,
+            session: Bb_Session = None,
+            retry_policy: Retry_Policy = None,
+            metrics: 'Metrics_Collector' = None):
         self.url = url
         self.key = key
         self.secret = secret
         self.learn_token = None
+        self.owns_session = session is None
+        self.session = session if session else Bb_Session(pool_maxsize=1)
+        self.retry_policy = retry_policy
+        self.metrics = metrics
+
+    # Closes the session, only if it was created by this instance.
+    def close(self):
+        if self.owns_session:
+            self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # Sends the token request, retrying it if a Retry_Policy was given. Token
+    # requests are always safe to retry, even if they are POST requests.
+    def _request(self, method: str, url: str, **kwargs):
+        if self.retry_policy is None:
+            return self._send(method, url, **kwargs)
+        return self.retry_policy.call(
+            method, lambda: self._send(method, url, **kwargs), idempotent=True)
+
+    # Sends a single token request, recording it in the metrics, if any.
+    def _send(self, method: str, url: str, **kwargs):
+        if self.metrics is None:
+            return self.session.request(method, url, **kwargs)
+        started = time.perf_counter()
+        try:
+            r = self.session.request(method, url, **kwargs)
+        except Exception:
+            self.metrics.record_request(method, url, None, time.perf_counter() - started)
+            raise
+        self.metrics.record_response(method, url, r, started)
+        return r
 
     # Method that returns True when the token expires. Used by the learn_auth() method.
     def token_is_expired(self, expiration_datetime):
@@ -82,332 +566,3349 @@ class Auth_Helper():
         self.time_left = (self.expiration_datetime -
                           datetime.datetime.now()).total_seconds()
         if self.time_left < 1:
-            time.sleep(1)
             return True
         else:
             return False
 
-    # Returns the authentication token for Blackboard Learn.
-    def learn_auth(self):
-        self.endpoint = "/learn/api/public/v1/oauth2/token"
-        self.params = {"grant_type": "client_credentials"}
-        self.headers = {
-            'Content-Type': "application/x-www-form-urlencoded"}
+    # Returns the authentication token for Blackboard Learn. The token is requested
+    # on the first call and then returned until it expires, when a new one is
+    # requested. force requests a new token even if the current one is valid.
+    def learn_auth(self, force: bool = False):
+        self.endpoint = "/learn/api/public/v1/oauth2/token"
+        self.params = {"grant_type": "client_credentials"}
+        self.headers = {
+            'Content-Type': "application/x-www-form-urlencoded"}
+
+        try:
+            if self.learn_token is not None and not force:
+                if not self.token_is_expired(self.expires_at):
+                    return self.learn_token
+                logger.info('refresh token')
+
+            r = self._request(
+                "POST",
+                self.url +
+                self.endpoint,
+                headers=self.headers,
+                params=self.params,
+                auth=(
+                    self.key,
+                    self.secret))
+            r.raise_for_status()
+            self.data = json_codec.loads(r.content)
+            self.learn_token = self.data["access_token"]
+            self.expires = self.data["expires_in"]
+            m, s = divmod(self.expires, 60)
+            self.now = datetime.datetime.now()
+            self.expires_at = self.now + \
+                datetime.timedelta(seconds=s, minutes=m)
+            logger.info("Learn Authentication successful")
+            logger.info("Token expires at: " + str(self.expires_at))
+            return self.learn_token
+
+        except requests.exceptions.HTTPError as e:
+            data = json_codec.loads(r.content)
+            logger.error(data["error_description"])
+
+# Token_Manager
+# Provides the Learn token to many threads. get_token() returns the current token
+# without locking while it is valid for more than skew seconds. Otherwise the first
+# caller refreshes it through the Auth_Helper, and the callers arriving meanwhile
+# wait for that single refresh. If background is True, a timer thread refreshes the
+# token skew seconds before it expires, so callers never wait for it. A Token_Manager
+# can be passed to Bb_Requests methods instead of the token string, the token is
+# then read on every request. Call stop() or close() (or use it as a context
+# manager) to end the background refresh.
+
+
+class Token_Manager():
+
+    logger = logging.getLogger('Bb_rest_helper')
+    logger.propagate = False
+
+    def __init__(self, auth: Auth_Helper, skew: int = 60, background: bool = True):
+        self.auth = auth
+        self.skew = skew
+        self.background = background
+        self.refreshes = 0
+        # (token, monotonic time at which it has to be refreshed), replaced as a
+        # whole so readers never see a token with the wrong expiry.
+        self._state = (None, 0.0)
+        self._lock = threading.Lock()
+        self._timer = None
+        self._stopped = False
+
+    # Returns a valid token, refreshing it first if needed.
+    def get_token(self):
+        token, refresh_at = self._state
+        if token is not None and time.monotonic() < refresh_at:
+            return token
+        return self.refresh(refresh_at)
+
+    # Requests a new token. Callers that saw the same expired state wait for
+    # a single refresh, given by seen (the refresh time they read).
+    def refresh(self, seen: float = None):
+        with self._lock:
+            token, refresh_at = self._state
+            if token is not None and seen is not None and refresh_at != seen:
+                # Refreshed by another thread while waiting for the lock.
+                return token
+            started = time.monotonic()
+            new_token = self.auth.learn_auth(force=True)
+            if new_token is None:
+                logger.error('The token could not be refreshed')
+                self._schedule(30)
+                return token
+            lifetime = self.auth.expires
+            self._state = (new_token, started + max(lifetime - self.skew, 0))
+            self.refreshes += 1
+            self._schedule(max(lifetime - self.skew, 1))
+            return new_token
+
+    # Schedules the background refresh in delay seconds.
+    def _schedule(self, delay: float):
+        if not self.background or self._stopped:
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = threading.Timer(delay, self._background_refresh)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _background_refresh(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            logger.error(f'Background token refresh failed: {e}')
+            self._schedule(30)
+
+    # Stops the background refresh.
+    def stop(self):
+        self._stopped = True
+        if self._timer is not None:
+            self._timer.cancel()
+
+    def close(self):
+        self.stop()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+# Response_Cache
+# A cache for the responses of GET requests, used by Bb_Requests when given. Keeps
+# up to max_entries responses in memory (least recently used are evicted first)
+# and, if a path is given, up to max_disk_entries in a sqlite file, so they are
+# kept between runs. A response is fresh for default_ttl seconds, ttls can map an
+# endpoint prefix (i.e. '/learn/api/public/v1/terms') to a different value, the
+# longest matching prefix wins. A ttl of 0 disables caching for that endpoint.
+# When a stale response has an ETag, it is revalidated with If-None-Match and a
+# 304 answer reuses the stored body. Successful POST, PATCH, PUT and DELETE requests
+# through Bb_Requests invalidate the cached responses under the written path and
+# its parent collection. stats() returns hits, misses, revalidations, stores,
+# evictions and invalidations. One instance can be shared by several threads.
+
+
+class Response_Cache():
+
+    logger = logging.getLogger('Bb_rest_helper')
+    logger.propagate = False
+
+    def __init__(
+            self,
+            path: str = None,
+            default_ttl: float = 300,
+            ttls: dict = None,
+            max_entries: int = 1000,
+            max_disk_entries: int = 100000):
+        self.path = path
+        self.default_ttl = default_ttl
+        self.ttls = ttls if ttls else {}
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.memory = collections.OrderedDict()
+        self.counters = {
+            'hits': 0,
+            'misses': 0,
+            'revalidated': 0,
+            'stores': 0,
+            'evictions': 0,
+            'invalidations': 0
+        }
+        self._lock = threading.RLock()
+        self.db = None
+        if self.path:
+            self.db = sqlite3.connect(self.path, check_same_thread=False)
+            self.db.execute(
+                'CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, path TEXT, '
+                'status INTEGER, headers TEXT, content BLOB, etag TEXT, expires_at REAL, '
+                'used_at REAL)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS responses_path ON responses (path)')
+            self.db.commit()
+
+    # Returns the cache key of a GET request.
+    def key(self, url: str, params: dict = None):
+        if params:
+            query = urlencode(sorted((str(k), str(v)) for k, v in params.items()))
+            separator = '&' if urlsplit(url).query else '?'
+            url = f'{url}{separator}{query}'
+        return f'GET {url}'
+
+    # Returns the time to live, in seconds, for the responses of an endpoint path.
+    def ttl_for(self, path: str):
+        match = None
+        for prefix in self.ttls:
+            if path.startswith(prefix) and (match is None or len(prefix) > len(match)):
+                match = prefix
+        return self.default_ttl if match is None else self.ttls[match]
+
+    # Returns the cached entry for a key, fresh or stale, or None.
+    def get(self, key: str):
+        with self._lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                self.memory.move_to_end(key)
+                return entry
+            if self.db is None:
+                return None
+            row = self.db.execute(
+                'SELECT path, status, headers, content, etag, expires_at FROM responses '
+                'WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            self.db.execute(
+                'UPDATE responses SET used_at = ? WHERE key = ?', (time.time(), key))
+            entry = {
+                'path': row[0],
+                'status': row[1],
+                'headers': json.loads(row[2]),
+                'content': row[3],
+                'etag': row[4],
+                'expires_at': row[5]
+            }
+            self._remember(key, entry)
+            return entry
+
+    # Returns True if the entry is still fresh.
+    def is_fresh(self, entry: dict):
+        return entry['expires_at'] > time.time()
+
+    # Stores a response. Only 200 responses of endpoints with a ttl, or with an
+    # ETag to revalidate them, are stored.
+    def store(self, key: str, path: str, r):
+        ttl = self.ttl_for(path)
+        etag = r.headers.get('ETag')
+        if r.status_code != 200 or (ttl <= 0 and not etag):
+            return
+        entry = {
+            'path': path,
+            'status': r.status_code,
+            'headers': dict(r.headers),
+            'content': r.content,
+            'etag': etag,
+            'expires_at': time.time() + max(ttl, 0)
+        }
+        with self._lock:
+            self.counters['stores'] += 1
+            self._remember(key, entry)
+            if self.db is not None:
+                self.db.execute(
+                    'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (key, path, entry['status'], json.dumps(entry['headers']),
+                     entry['content'], etag, entry['expires_at'], time.time()))
+                self._evict_disk()
+                self.db.commit()
+
+    # Marks a stale entry as fresh again after a 304 response.
+    def refresh(self, key: str, entry: dict):
+        with self._lock:
+            self.counters['revalidated'] += 1
+            entry['expires_at'] = time.time() + max(self.ttl_for(entry['path']), 0)
+            if self.db is not None:
+                self.db.execute(
+                    'UPDATE responses SET expires_at = ?, used_at = ? WHERE key = ?',
+                    (entry['expires_at'], time.time(), key))
+                self.db.commit()
+
+    # Adds an entry to the memory cache, evicting the least recently used ones.
+    def _remember(self, key: str, entry: dict):
+        self.memory[key] = entry
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+            self.counters['evictions'] += 1
+
+    # Removes the least recently used entries over max_disk_entries from sqlite.
+    def _evict_disk(self):
+        count = self.db.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+        if count > self.max_disk_entries:
+            self.db.execute(
+                'DELETE FROM responses WHERE key IN (SELECT key FROM responses '
+                'ORDER BY used_at LIMIT ?)', (count - self.max_disk_entries,))
+            self.counters['evictions'] += count - self.max_disk_entries
+
+    # Removes the entries under a path (i.e. /learn/api/public/v3/courses/_1_1) and
+    # the ones for its parent collection (/learn/api/public/v3/courses).
+    def invalidate(self, path: str):
+        path = path.rstrip('/')
+        parent = path.rsplit('/', 1)[0]
+        with self._lock:
+            keys = [k for k, entry in self.memory.items()
+                    if entry['path'] == parent or entry['path'] == path
+                    or entry['path'].startswith(path + '/')]
+            for k in keys:
+                del self.memory[k]
+            removed = len(keys)
+            if self.db is not None:
+                pattern = path.replace('\\', '\\\\').replace(
+                    '%', '\\%').replace('_', '\\_') + '/%'
+                cursor = self.db.execute(
+                    "DELETE FROM responses WHERE path = ? OR path = ? OR path LIKE ? ESCAPE '\\'",
+                    (parent, path, pattern))
+                removed = max(removed, cursor.rowcount)
+                self.db.commit()
+            self.counters['invalidations'] += removed
+
+    # Removes every entry.
+    def clear(self):
+        with self._lock:
+            self.memory.clear()
+            if self.db is not None:
+                self.db.execute('DELETE FROM responses')
+                self.db.commit()
+
+    # Adds one to a counter.
+    def count(self, counter: str):
+        with self._lock:
+            self.counters[counter] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['entries'] = len(self.memory)
+            return stats
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+# Metrics_Collector
+# Collects request metrics from Bb_Requests, AsyncBb_Requests and Auth_Helper when
+# given to them as metrics. Metrics are kept per method and endpoint template,
+# the url path with the ids replaced by {id} (i.e. /learn/api/public/v3/courses/{id}/users),
+# and include the request count, a histogram of status codes, latency percentiles
+# (ttfb, the time to the response headers, and total, including the body), bytes
+# received and sent, retries, time spent waiting for the rate limiter and pages
+# read per paginated GET. requests does not expose the time spent connecting, as
+# connections are reused from the pool it is part of the first ttfb of each one.
+# Latencies are kept for the last max_samples requests of each endpoint. callback,
+# if given, is called with a dict for every request. snapshot() returns the metrics
+# as a dict, to_prometheus() in Prometheus text format, that can also be written to
+# a file with write_prometheus() or served over http with serve_prometheus().
+
+
+class Metrics_Collector():
+
+    logger = logging.getLogger('Bb_rest_helper')
+    logger.propagate = False
+
+    # Path segments replaced by {id} in endpoint templates: Learn ids (_123_1),
+    # uuids, numbers and key:value ids (i.e. externalId:ABC).
+    id_pattern = re.compile(
+        r'^(_\d+_\d+|[0-9a-fA-F]{32}|[0-9a-fA-F-]{36}|\d+|'
+        r'(externalId|courseId|userName|uuid|primaryId):.+)$')
+
+    def __init__(self, callback=None, max_samples: int = 10000):
+        self.callback = callback
+        self.max_samples = max_samples
+        self.endpoints = {}
+        self.throttled_time = 0.0
+        self._lock = threading.Lock()
+        self._server = None
+
+    # Returns the endpoint template of a url.
+    def template(self, url: str):
+        path = urlsplit(url).path
+        return '/'.join(
+            '{id}' if self.id_pattern.match(segment) else segment
+            for segment in path.split('/'))
+
+    # Returns the metrics of an endpoint, creating them on first use.
+    def _endpoint(self, method: str, template: str):
+        key = (method, template)
+        metrics = self.endpoints.get(key)
+        if metrics is None:
+            metrics = {
+                'count': 0,
+                'statuses': collections.Counter(),
+                'ttfb': collections.deque(maxlen=self.max_samples),
+                'total': collections.deque(maxlen=self.max_samples),
+                'total_sum': 0.0,
+                'bytes_in': 0,
+                'bytes_out': 0,
+                'retries': 0,
+                'pages': collections.deque(maxlen=self.max_samples)
+            }
+            self.endpoints[key] = metrics
+        return metrics
+
+    # Records a request. status is None when the request raised an exception.
+    def record_request(
+            self,
+            method: str,
+            url: str,
+            status: int,
+            total: float,
+            ttfb: float = None,
+            bytes_in: int = 0,
+            bytes_out: int = 0):
+        template = self.template(url)
+        with self._lock:
+            metrics = self._endpoint(method, template)
+            metrics['count'] += 1
+            metrics['statuses'][status if status is not None else 'error'] += 1
+            metrics['total'].append(total)
+            metrics['total_sum'] += total
+            if ttfb is not None:
+                metrics['ttfb'].append(ttfb)
+            metrics['bytes_in'] += bytes_in
+            metrics['bytes_out'] += bytes_out
+        if self.callback is not None:
+            self.callback({
+                'event': 'request',
+                'method': method,
+                'endpoint': template,
+                'status': status,
+                'total': total,
+                'ttfb': ttfb,
+                'bytes_in': bytes_in,
+                'bytes_out': bytes_out
+            })
+
+    # Records the response of a requests (or httpx) request sent at started.
+    def record_response(self, method: str, url: str, r, started: float):
+        # The request size is read from its Content-Length, the body of a streamed
+        # httpx request can not be read once sent.
+        length = r.request.headers.get('Content-Length', '')
+        if length.isdigit():
+            sent = int(length)
+        else:
+            body = getattr(r.request, 'body', None)
+            sent = len(body) if hasattr(body, '__len__') else 0
+        self.record_request(
+            method, url, r.status_code,
+            time.perf_counter() - started,
+            r.elapsed.total_seconds() if r.elapsed is not None else None,
+            len(r.content),
+            sent)
+
+    def record_retry(self, method: str, url: str, delay: float):
+        with self._lock:
+            self._endpoint(method, self.template(url))['retries'] += 1
+        if self.callback is not None:
+            self.callback({'event': 'retry', 'method': method,
+                           'endpoint': self.template(url), 'delay': delay})
+
+    def record_throttle(self, seconds: float):
+        with self._lock:
+            self.throttled_time += seconds
+        if self.callback is not None:
+            self.callback({'event': 'throttle', 'seconds': seconds})
+
+    # Records the number of pages read by a paginated GET.
+    def record_pages(self, url: str, pages: int):
+        with self._lock:
+            self._endpoint('GET', self.template(url))['pages'].append(pages)
+        if self.callback is not None:
+            self.callback({'event': 'pages', 'endpoint': self.template(url), 'pages': pages})
+
+    # Returns the given percentiles (0-100) of a list of samples.
+    def _percentiles(self, samples, percentiles=(50, 90, 99)):
+        if not samples:
+            return {p: None for p in percentiles}
+        ordered = sorted(samples)
+        return {p: ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+                for p in percentiles}
+
+    # Returns all the metrics as a dict.
+    def snapshot(self):
+        with self._lock:
+            endpoints = [(key, dict(m, ttfb=list(m['ttfb']), total=list(m['total']),
+                                    pages=list(m['pages']), statuses=dict(m['statuses'])))
+                         for key, m in self.endpoints.items()]
+            throttled_time = self.throttled_time
+        snapshot = {'throttled_time': throttled_time, 'endpoints': []}
+        for (method, template), m in endpoints:
+            snapshot['endpoints'].append({
+                'method': method,
+                'endpoint': template,
+                'count': m['count'],
+                'statuses': m['statuses'],
+                'ttfb': self._percentiles(m['ttfb']),
+                'total': self._percentiles(m['total']),
+                'total_sum': m['total_sum'],
+                'bytes_in': m['bytes_in'],
+                'bytes_out': m['bytes_out'],
+                'retries': m['retries'],
+                'pages': self._percentiles(m['pages'])
+            })
+        return snapshot
+
+    # Escapes a Prometheus label value.
+    def _label(self, value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    # Returns the metrics in Prometheus text format.
+    def to_prometheus(self):
+        snapshot = self.snapshot()
+        lines = [
+            '# TYPE bb_requests_total counter',
+            '# TYPE bb_request_seconds summary',
+            '# TYPE bb_request_ttfb_seconds summary',
+            '# TYPE bb_bytes_received_total counter',
+            '# TYPE bb_bytes_sent_total counter',
+            '# TYPE bb_retries_total counter',
+            '# TYPE bb_get_pages summary',
+            '# TYPE bb_throttled_seconds_total counter',
+            f'bb_throttled_seconds_total {snapshot["throttled_time"]}'
+        ]
+        for e in snapshot['endpoints']:
+            labels = f'method="{self._label(e["method"])}",endpoint="{self._label(e["endpoint"])}"'
+            for status, count in sorted(e['statuses'].items(), key=str):
+                lines.append(f'bb_requests_total{{{labels},status="{status}"}} {count}')
+            for name, key in (('bb_request_seconds', 'total'),
+                              ('bb_request_ttfb_seconds', 'ttfb'),
+                              ('bb_get_pages', 'pages')):
+                for p, value in e[key].items():
+                    if value is not None:
+                        lines.append(f'{name}{{{labels},quantile="{p / 100}"}} {value}')
+            lines.append(f'bb_request_seconds_sum{{{labels}}} {e["total_sum"]}')
+            lines.append(f'bb_request_seconds_count{{{labels}}} {e["count"]}')
+            lines.append(f'bb_bytes_received_total{{{labels}}} {e["bytes_in"]}')
+            lines.append(f'bb_bytes_sent_total{{{labels}}} {e["bytes_out"]}')
+            lines.append(f'bb_retries_total{{{labels}}} {e["retries"]}')
+        return '\n'.join(lines) + '\n'
+
+    # Writes the metrics in Prometheus text format to a file (i.e. for the
+    # node_exporter textfile collector). The file is replaced atomically.
+    def write_prometheus(self, path: str):
+        temp_path = f'{path}.tmp'
+        with open(temp_path, 'w') as f:
+            f.write(self.to_prometheus())
+        os.replace(temp_path, path)
+
+    # Serves the metrics in Prometheus text format over http from a background
+    # thread. Returns the server, call shutdown() on it to stop serving.
+    def serve_prometheus(self, port: int = 9108, host: str = '0.0.0.0'):
+        collector = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = collector.to_prometheus().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        logger.info(f'Serving metrics on port {port}')
+        return self._server
+
+# Single_Flight
+# Deduplicates identical calls running at the same time. The first thread calling
+# do() with a key runs the function, threads calling it with the same key while it
+# runs wait for it and get its result (or its exception) instead of running it
+# again. Each caller gets its own deep copy of the result, so callers can not
+# change each other's data (the first one gets the original if nobody waited).
+# Used by Bb_Requests to coalesce identical GET requests, shared counts the calls
+# answered by another call.
+
+
+class Single_Flight():
+
+    logger = logging.getLogger('Bb_rest_helper')
+    logger.propagate = False
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.shared = 0
+
+    def do(self, key, function):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {'future': Future(), 'waiters': 0}
+            else:
+                call['waiters'] += 1
+                self.shared += 1
+        if not leader:
+            return copy.deepcopy(call['future'].result())
+        try:
+            result = function()
+        except BaseException as e:
+            with self._lock:
+                del self._calls[key]
+            call['future'].set_exception(e)
+            raise
+        with self._lock:
+            del self._calls[key]
+            waiters = call['waiters']
+        call['future'].set_result(result)
+        return copy.deepcopy(result) if waiters else result
+
+# Multipart_Encoder
+# A multipart/form-data body with a single file, read from disk in chunks of
+# chunk_size bytes while it is being sent, so the file is never loaded in memory
+# whatever its size. Used by Bb_Requests.Bb_POST_file, pass it as the data of a
+# request with content_type as its Content-Type header. Its length is known in
+# advance, so it is sent with a Content-Length instead of chunked encoding.
+# callback, if given, is called with (file_path, bytes_sent, total_bytes) every
+# time a chunk is read. seek(0) rewinds it to send it again (i.e. on a retry),
+# the file is opened on the first read and closed by close() or the context manager.
+
+
+class Multipart_Encoder():
+
+    logger = logging.getLogger('Bb_rest_helper')
+    logger.propagate = False
+
+    def __init__(
+            self,
+            file_path: str,
+            field: str = 'file',
+            chunk_size: int = 65536,
+            callback=None):
+        self.file_path = file_path
+        self.chunk_size = chunk_size
+        self.callback = callback
+        self.boundary = uuid.uuid4().hex
+        self.content_type = f'multipart/form-data; boundary={self.boundary}'
+        filename = os.path.basename(file_path).replace('"', '%22')
+        file_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        self.head = (
+            f'--{self.boundary}\r\n'
+            f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+            f'Content-Type: {file_type}\r\n\r\n').encode('utf-8')
+        self.tail = f'\r\n--{self.boundary}--\r\n'.encode('utf-8')
+        self.file_size = os.path.getsize(file_path)
+        self.total = len(self.head) + self.file_size + len(self.tail)
+        self.position = 0
+        self.file = None
+
+    def __len__(self):
+        return self.total
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(self.chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # Reads up to size bytes of the body, all the rest if size is negative.
+    def read(self, size: int = -1):
+        if size is None or size < 0:
+            size = self.total - self.position
+        chunks = []
+        while size > 0 and self.position < self.total:
+            file_end = len(self.head) + self.file_size
+            if self.position < len(self.head):
+                chunk = self.head[self.position:self.position + size]
+            elif self.position < file_end:
+                if self.file is None:
+                    self.file = open(self.file_path, 'rb')
+                    self.file.seek(self.position - len(self.head))
+                chunk = self.file.read(min(size, self.chunk_size, file_end - self.position))
+                if not chunk:
+                    raise IOError(f'{self.file_path} changed while it was being uploaded')
+            else:
+                chunk = self.tail[self.position - file_end:self.position - file_end + size]
+            chunks.append(chunk)
+            self.position += len(chunk)
+            size -= len(chunk)
+        if chunks and self.callback is not None:
+            self.callback(self.file_path, self.position, self.total)
+        return b''.join(chunks)
+
+    def tell(self):
+        return self.position
+
+    # Moves to a position of the body, only offsets from the start are supported.
+    def seek(self, offset: int, whence: int = 0):
+        if whence != 0:
+            raise ValueError('Multipart_Encoder only seeks from the start')
+        self.position = offset
+        if self.file is not None:
+            self.file.seek(max(0, offset - len(self.head)))
+        return self.position
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+# Rate_Limit_Log
+# Logs the rate limit headers of the responses (limit, remaining calls and time to
+# reset), as Bb_Requests and AsyncBb_Requests do after every call. With interval
+# set (in seconds, see Bb_Utils.set_logging) one line is logged at most every
+# interval seconds, with the latest values and the number of responses it stands
+# for, so the log does not grow with the number of calls. Nothing is done when INFO
+# messages are not logged. The module wide rate_limit_log is the one used.
+
+
+class Rate_Limit_Log():
+
+    def __init__(self, interval: float = None):
+        self.interval = interval
+        self.count = 0
+        self.last = 0.0
+        self._lock = threading.Lock()
+
+    def log(self, headers):
+        if not logger.isEnabledFor(logging.INFO):
+            return
+        if self.interval is None:
+            logger.info('API limit: %s', headers.get('X-Rate-Limit-Limit'))
+            logger.info('Remaining API calls: %s', headers.get('X-Rate-Limit-Remaining'))
+            logger.info('Time to reset API limit: %s', headers.get('X-Rate-Limit-reset'))
+            return
+        with self._lock:
+            self.count += 1
+            now = time.monotonic()
+            if now - self.last < self.interval:
+                return
+            count, self.count, self.last = self.count, 0, now
+        logger.info(
+            'API limit: %s, remaining API calls: %s, time to reset API limit: %s (%d responses)',
+            headers.get('X-Rate-Limit-Limit'), headers.get('X-Rate-Limit-Remaining'),
+            headers.get('X-Rate-Limit-reset'), count)
+
+
+rate_limit_log = Rate_Limit_Log()
+
+# Bb_Requests
+# A class to simplify API calls to Blackboard REST APIs, provides functions
+# for GET, POST, PUT, PATCH and DELETE. All the calls go through a pooled
+# Bb_Session, so the connection to Learn is reused between calls. The session
+# can be passed in to share it with other instances (or Auth_Helper), otherwise
+# one is created using the pool arguments given (see Bb_Session). A Bb_Requests
+# instance can be shared between threads and used as a context manager.
+# Optionally takes a Rate_Limiter, that paces the calls using the rate limit
+# headers returned by Learn, a Retry_Policy to retry transient errors and a
+# Response_Cache for GET requests and a Metrics_Collector. The token argument of
+# every method can be a token string or a Token_Manager. codec is the Json_Codec
+# used for bodies, and coalesce=True makes identical Bb_GET calls running at the
+# same time share a single request (see Single_Flight).
+
+
+class Bb_Requests():
+
+    logger = logging.getLogger('Bb_rest_helper')
+    logger.propagate = False
+
+    def __init__(
+            self,
+            session: Bb_Session = None,
+            rate_limiter: Rate_Limiter = None,
+            retry_policy: Retry_Policy = None,
+            cache: Response_Cache = None,
+            metrics: Metrics_Collector = None,
+            codec: Json_Codec = None,
+            coalesce: bool = False,
+            **session_args):
+        self.owns_session = session is None
+        self.session = session if session else Bb_Session(**session_args)
+        self.rate_limiter = rate_limiter
+        self.retry_policy = retry_policy
+        self.cache = cache
+        self.metrics = metrics
+        self.codec = codec if codec else json_codec
+        self.single_flight = Single_Flight() if coalesce else None
+
+    # Closes the session, only if it was created by this instance.
+    def close(self):
+        if self.owns_session:
+            self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # Sends a request through the pooled session. Used by all the methods below.
+    # GET requests are answered from the cache, if any, and successful writes
+    # invalidate the cached responses of the written path.
+    def _request(self, method: str, url: str, idempotent: bool = None, **kwargs):
+        if self.cache is None:
+            return self._retried(method, url, idempotent, **kwargs)
+        if method.upper() == 'GET':
+            return self._cached_get(url, **kwargs)
+        r = self._retried(method, url, idempotent, **kwargs)
+        if r.status_code < 400:
+            self.cache.invalidate(urlsplit(url).path)
+        return r
+
+    # Answers a GET request from the cache. A stale response with an ETag is
+    # revalidated, anything else is requested and stored.
+    def _cached_get(self, url: str, **kwargs):
+        key = self.cache.key(url, kwargs.get('params'))
+        entry = self.cache.get(key)
+        if entry is not None and self.cache.is_fresh(entry):
+            self.cache.count('hits')
+            return self._cached_response(url, entry)
+        self.cache.count('misses')
+        if entry is not None and entry['etag']:
+            kwargs['headers'] = dict(kwargs.get('headers') or {}, **{'If-None-Match': entry['etag']})
+        r = self._retried('GET', url, **kwargs)
+        if r.status_code == 304 and entry is not None:
+            self.cache.refresh(key, entry)
+            return self._cached_response(url, entry)
+        self.cache.store(key, urlsplit(url).path, r)
+        return r
+
+    # Builds a response object from a cache entry.
+    def _cached_response(self, url: str, entry: dict):
+        r = requests.Response()
+        r.status_code = entry['status']
+        r.headers = CaseInsensitiveDict(entry['headers'])
+        r._content = entry['content']
+        r.encoding = 'utf-8'
+        r.url = url
+        return r
+
+    # Sends a request, retrying it as set by the retry policy, if any. idempotent
+    # overrides the retry policy for that request (see Retry_Policy.can_retry).
+    def _retried(self, method: str, url: str, idempotent: bool = None, **kwargs):
+        if self.retry_policy is None:
+            return self._send(method, url, **kwargs)
+        on_retry = None if self.metrics is None else (
+            lambda delay: self.metrics.record_retry(method, url, delay))
+        return self.retry_policy.call(
+            method, lambda: self._send(method, url, **kwargs), idempotent, on_retry)
+
+    # Sends a single request. Waits for the rate limiter, if any, and feeds it
+    # the response headers. Records the request in the metrics, if any. A
+    # Multipart_Encoder body is rewound first, so a retry sends it from the start.
+    def _send(self, method: str, url: str, **kwargs):
+        if isinstance(kwargs.get('data'), Multipart_Encoder):
+            kwargs['data'].seek(0)
+        if self.rate_limiter is not None:
+            waited = self.rate_limiter.acquire()
+            if waited and self.metrics is not None:
+                self.metrics.record_throttle(waited)
+        if self.metrics is None:
+            r = self.session.request(method, url, **kwargs)
+        else:
+            started = time.perf_counter()
+            try:
+                r = self.session.request(method, url, **kwargs)
+            except Exception:
+                self.metrics.record_request(method, url, None, time.perf_counter() - started)
+                raise
+            self.metrics.record_response(method, url, r, started)
+        if self.rate_limiter is not None:
+            self.rate_limiter.update(r.headers, r.status_code)
+        return r
+
+    # Returns the authorization headers for a given token, that can also be a
+    # Token_Manager, then the current token is used.
+    def _headers(self, token, content_type: bool = True):
+        if isinstance(token, Token_Manager):
+            token = token.get_token()
+        headers = {'Authorization': f'Bearer {token}'}
+        if content_type:
+            headers['Content-Type'] = "Application/json"
+        return headers
+
+    # Logs the rate limit information returned by Learn in the response headers.
+    def _log_rate_limit(self, r):
+        rate_limit_log.log(r.headers)
+
+    # GET request. It takes a GET endpoint from the API, the authentication
+    # token and a list of parameters as arguments. This request has been updated
+    # to support pagination. Note this is currently a heavy method, use parameters
+    # limit responses if needed.
+    # Pages are requested one after another by default. If prefetch is set to a
+    # number greater than 1, once the first page shows the page size the next
+    # prefetch pages are requested at the same time (see _prefetch_pages).
+    # With coalesce=True, identical Bb_GET calls (same url, params and token) made
+    # while one of them is running share its result, see Single_Flight.
+
+    def Bb_GET(
+            self,
+            base_url: str,
+            endpoint: str,
+            token: str,
+            params: dict = {},
+            prefetch: int = 0):
+        headers = self._headers(token)
+        if self.single_flight is None:
+            return self._get_all(base_url, endpoint, token, headers, params, prefetch)
+        key = (f'{base_url}{endpoint}', tuple(sorted((k, str(v)) for k, v in params.items())),
+               headers['Authorization'], prefetch)
+        return self.single_flight.do(
+            key, lambda: self._get_all(base_url, endpoint, token, headers, params, prefetch))
+
+    # Reads all the pages of a GET request, used by Bb_GET.
+    def _get_all(
+            self,
+            base_url: str,
+            endpoint: str,
+            token: str,
+            headers: dict,
+            params: dict,
+            prefetch: int):
+        request_url = f'{base_url}{endpoint}'
+        data_from_pages = []
+        pages = 0
+        r = None
+        try:
+
+            r = self._request('GET', request_url,
+                              headers=headers, params=params)
+            pages += 1
+
+            data = self.codec.loads(r.content)
+            r.raise_for_status()
+
+            for d in data['results']:
+                data_from_pages.append(d)
+
+            next_page = data.get('paging', {}).get('nextPage')
+            if next_page and prefetch > 1 and self._page_offset(next_page):
+                first_offset = int(params.get('offset', 0))
+                r, prefetched = self._prefetch_pages(
+                    base_url, next_page, first_offset, token, prefetch, data_from_pages)
+                pages += prefetched
+                next_page = None
+
+            while next_page:
+                offset_url = f'{base_url}{next_page}'
+                r = self._request(
+                    'GET', offset_url, headers=self._headers(token, False))
+                pages += 1
+                data = self.codec.loads(r.content)
+                for d in data['results']:
+                    data_from_pages.append(d)
+                next_page = data.get('paging', {}).get('nextPage')
+
+        except requests.exceptions.HTTPError as e:
+            logger.error(data["message"])
+            return None
+
+        except Exception as e:
+            # A page that can not be read ends the pagination, the pages read
+            # so far are returned, or None if not even the first one was.
+            logger.error(f'GET Request to {request_url} failed after {pages} pages: {e!r}')
+            if r is None:
+                return None
+
+        # returns data from Learn REST API, all pages
+        if self.metrics is not None:
+            self.metrics.record_pages(request_url, pages)
+        logger.info("GET Request completed")
+        self._log_rate_limit(r)
+        return data_from_pages
+
+    # Returns the offset and the query of a nextPage link, or None if the link
+    # does not page by offset.
+    def _page_offset(self, next_page: str):
+        query = parse_qsl(urlsplit(next_page).query, keep_blank_values=True)
+        for key, value in query:
+            if key == 'offset' and value.isdigit():
+                return int(value), query
+        return None
+
+    # Requests the pages after the first one concurrently, used by Bb_GET when
+    # prefetch is set. The page size is taken from how far the nextPage link moves
+    # the offset (or from the size of the first page), not from its limit, as Learn
+    # can send fewer records than the limit asked for. The next prefetch offsets are
+    # requested at once through a pool of prefetch threads. The pages are added
+    # to data_from_pages in offset order, the first page without a nextPage link
+    # (or without results) ends the pagination and the pages requested beyond it
+    # are dropped. Records with an id already seen are skipped, as Learn can shift
+    # records between pages when data changes while paging. Records without an id
+    # (i.e. projected with fields) are all kept, like in a sequential read. Returns
+    # the last response read and the number of pages read.
+    def _prefetch_pages(
+            self,
+            base_url: str,
+            next_page: str,
+            first_offset: int,
+            token: str,
+            prefetch: int,
+            data_from_pages: list):
+        offset, query = self._page_offset(next_page)
+        query = dict(query)
+        page_size = offset - first_offset
+        if page_size <= 0:
+            page_size = len(data_from_pages)
+        path = urlsplit(next_page).path
+        seen = {d['id'] for d in data_from_pages if isinstance(d, dict) and 'id' in d}
+
+        def get_page(page_offset):
+            page_query = dict(query, offset=str(page_offset))
+            return self._request(
+                'GET', f'{base_url}{path}?{urlencode(page_query)}',
+                headers=self._headers(token, False))
+
+        last = None
+        pages = 0
+        with ThreadPoolExecutor(max_workers=prefetch) as pool:
+            while True:
+                offsets = [offset + i * page_size for i in range(prefetch)]
+                for r in pool.map(get_page, offsets):
+                    last = r
+                    pages += 1
+                    if not r.ok:
+                        logger.error(
+                            f'Page request failed with status {r.status_code}')
+                        return last, pages
+                    data = self.codec.loads(r.content)
+                    for d in data.get('results', []):
+                        if isinstance(d, dict) and 'id' in d:
+                            if d['id'] in seen:
+                                continue
+                            seen.add(d['id'])
+                        data_from_pages.append(d)
+                    if not data.get('results') or not data.get(
+                            'paging', {}).get('nextPage'):
+                        return last, pages
+                offset += prefetch * page_size
+
+    # Streaming variant of Bb_GET. Takes the same arguments and returns a Bb_Pager,
+    # that yields the records (or the whole pages if pages is True) as each page
+    # arrives instead of returning a list with all of them. A cursor saved from a
+    # previous Bb_Pager can be given to continue from the page where it stopped, or
+    # a Checkpoint_Store that saves the cursor as checkpoint_name (the endpoint by
+    # default) and continues from the saved one.
+    def Bb_GET_iter(
+            self,
+            base_url: str,
+            endpoint: str,
+            token: str,
+            params: dict = {},
+            pages: bool = False,
+            cursor: str = None,
+            checkpoint: 'Checkpoint_Store' = None,
+            checkpoint_name: str = None):
+        return Bb_Pager(
+            self, base_url, endpoint, token, params, pages, cursor, checkpoint, checkpoint_name)
+
+    # GET request that keeps only the given fields of each record. Adds them as the
+    # fields parameter of the request, so Learn sends nothing else, and returns a
+    # Bb_Records with the records of all the pages (see Bb_Records), or None if the
+    # first page could not be read. Pages are read one at a time and only the
+    # projected values are kept.
+    def Bb_GET_records(
+            self,
+            base_url: str,
+            endpoint: str,
+            token: str,
+            fields: list,
+            params: dict = {},
+            columns: bool = False):
+        records = Bb_Records(fields, columns)
+        pager = self.Bb_GET_iter(
+            base_url, endpoint, token, dict(params, fields=','.join(fields)), pages=True)
+        for page in pager:
+            records.extend(page)
+        if pager.pages_read == 0:
+            return None
+        return records
+
+    # POST request. It takes a POST endpoint from the API, the authentication token,
+    # a list of parameters, and a json payload as arguments.
+
+    def Bb_POST(
+            self,
+            base_url: str,
+            endpoint: str,
+            token: str,
+            payload: dict,
+            params: dict = {}):
+        request_url = f'{base_url}{endpoint}'
+        headers = self._headers(token)
+        try:
+            r = self._request(
+                'POST',
+                request_url,
+                headers=headers,
+                params=params,
+                data=self.codec.dumps(payload))
+            data = self.codec.loads(r.content)
+            r.raise_for_status()
+            self._log_rate_limit(r)
+            logger.info("POST Request completed")
+            return data
+        except requests.exceptions.HTTPError as e:
+            logger.error(data["message"])
+
+    # Uploads a file to the Blacboard Learn Api uploads endpoint, getting the path to the file and the auth header
+    # arguments, it returns the file id that will be used in other calls to
+    # the API (i.e. Creating content)
+    # The file is streamed in chunks of chunk_size bytes by a Multipart_Encoder and
+    # closed once sent. callback is called with (file_path, bytes_sent, total_bytes)
+    # as it is sent. Failed uploads are retried from the start by the retry policy.
+
+    def Bb_POST_file(
+            self,
+            base_url: str,
+            token: str,
+            file_path: str,
+            chunk_size: int = 65536,
+            callback=None):
+        headers = self._headers(token, False)
+        uploads_url = f'{base_url}/learn/api/public/v1/uploads'
+        try:
+            with Multipart_Encoder(file_path, chunk_size=chunk_size, callback=callback) as body:
+                headers['Content-Type'] = body.content_type
+                r = self._request(
+                    'POST',
+                    uploads_url,
+                    idempotent=True,
+                    data=body,
+                    headers=headers)
+            data = self.codec.loads(r.content)
+            r.raise_for_status()
+            logger.info(
+                'File uploaded to temporary storage, returning id')
+            logger.info("GET Request completed")
+            self._log_rate_limit(r)
+            return data['id']
+        except requests.exceptions.HTTPError as e:
+            logger.error(data["message"])
+
+    # Uploads many files concurrently, at most max_workers at a time, and returns
+    # the list of their ids in the same order, None for the files that failed.
+    # callback is called by each upload as in Bb_POST_file.
+    def Bb_POST_files(
+            self,
+            base_url: str,
+            token: str,
+            file_paths: list,
+            max_workers: int = 4,
+            chunk_size: int = 65536,
+            callback=None):
+        def upload(file_path):
+            try:
+                return self.Bb_POST_file(base_url, token, file_path, chunk_size, callback)
+            except Exception as e:
+                logger.error(f'Upload of {file_path} failed: {e}')
+                return None
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            return list(pool.map(upload, file_paths))
+
+    # PATCH request. It takes a PATCH endpoint from the API, the authentication token,
+    # a list of parameters, and a json payload as arguments. A PATCH requests allows
+    # to update a record partially.
+
+    def Bb_PATCH(
+            self,
+            base_url: str,
+            endpoint: str,
+            token: str,
+            payload: dict,
+            params: dict = {}):
+        request_url = f'{base_url}{endpoint}'
+        headers = self._headers(token)
+        try:
+            r = self._request(
+                'PATCH',
+                request_url,
+                headers=headers,
+                params=params,
+                data=self.codec.dumps(payload))
+            data = self.codec.loads(r.content)
+            r.raise_for_status()
+            self._log_rate_limit(r)
+            logger.info("PATCH Request completed")
+            return data
+        except requests.exceptions.HTTPError as e:
+            logger.error(data["message"])
+
+    # PUT request. It takes a PUT endpoint from the API, the authentication token,
+    # a list of parameters, and a json payload as arguments. A PUT request is meant
+    # to update a record entirely.
+    def Bb_PUT(
+            self,
+            base_url: str,
+            endpoint: str,
+            token: str,
+            payload: dict,
+            params: dict = {}):
+        request_url = f'{base_url}{endpoint}'
+        headers = self._headers(token)
+        try:
+            r = self._request(
+                'PUT',
+                request_url,
+                headers=headers,
+                params=params,
+                data=self.codec.dumps(payload))
+            data = self.codec.loads(r.content)
+            r.raise_for_status()
+            self._log_rate_limit(r)
+            logger.info("PUT Request completed")
+            return data
+        except requests.exceptions.HTTPError as e:
+            logger.error(data["message"])
+        except ValueError as e:
+            pass
+                
+    # DELETE request. It takes a DELETE endpoint from the API, the authentication token
+    # and a list of parameters as arguments.
+    def Bb_DELETE(
+            self,
+            base_url: str,
+            endpoint: str,
+            token: str,
+            params: dict = {}):
+        request_url = f'{base_url}{endpoint}'
+        headers = self._headers(token)
+        try:
+            r = self._request(
+                'DELETE',
+                request_url,
+                headers=headers,
+                params=params)
+            # A successful DELETE request returns a 204 code meaning that the server has
+            # fulfilled the request but that there is no content to return.
+            r.raise_for_status()
+            self._log_rate_limit(r)
+            logger.info("DELETE Request completed")
+        except KeyError:
+            # Collaborate does not provide rate limit information, so just
+            # logging the request status and returning the data
+            logger.info("DELETE Request completed")
+        except requests.exceptions.HTTPError as e:
+            logger.error('The resource could not be deleted')
+
+# Bb_Pager
+# Iterates over the results of a paginated GET request, returned by
+# Bb_Requests.Bb_GET_iter. A page is requested and parsed only when the records
+# of the previous one have been consumed, so only one page is held in memory and
+# breaking out of the loop stops any further request. The cursor attribute holds
+# the nextPage link of the page being consumed (None while on the first page), it
+# only moves on once the whole page has been consumed. Save it and pass it back to
+# Bb_GET_iter to continue a job from that page after a crash, records of that page
+# may be yielded again. finished is True once the last page has been consumed.
+# With a Checkpoint_Store the cursor is saved every time it moves, and read from
+# it when no cursor is given.
+
+
+class Bb_Pager():
+
+    logger = logging.getLogger('Bb_rest_helper')
+    logger.propagate = False
+
+    def __init__(
+            self,
+            reqs: Bb_Requests,
+            base_url: str,
+            endpoint: str,
+            token: str,
+            params: dict = {},
+            pages: bool = False,
+            cursor: str = None,
+            checkpoint: 'Checkpoint_Store' = None,
+            checkpoint_name: str = None):
+        self.reqs = reqs
+        self.base_url = base_url
+        self.endpoint = endpoint
+        self.token = token
+        self.params = params
+        self.pages = pages
+        self.checkpoint = checkpoint
+        self.checkpoint_name = checkpoint_name if checkpoint_name else endpoint
+        if cursor is None and checkpoint is not None:
+            cursor = checkpoint.get_cursor(self.checkpoint_name)
+        self.cursor = cursor
+        self.pages_read = 0
+        self.finished = False
+
+    def __iter__(self):
+        if self.pages:
+            return self._iter_pages()
+        return self._iter_records()
+
+    # Yields the records of every page, one by one.
+    def _iter_records(self):
+        for page in self._iter_pages():
+            yield from page
+
+    # Yields the results of every page as a list.
+    def _iter_pages(self):
+        if self.finished:
+            return
+        r = None
+        while True:
+            if self.cursor:
+                r = self.reqs._request(
+                    'GET', f'{self.base_url}{self.cursor}',
+                    headers=self.reqs._headers(self.token, False))
+            else:
+                r = self.reqs._request(
+                    'GET', f'{self.base_url}{self.endpoint}',
+                    headers=self.reqs._headers(self.token), params=self.params)
+            try:
+                data = self.reqs.codec.loads(r.content)
+                r.raise_for_status()
+            except (requests.exceptions.HTTPError, ValueError):
+                logger.error(
+                    f'GET Request failed with status {r.status_code}, cursor: {self.cursor}')
+                return
+            self.pages_read += 1
+            yield data.get('results', [])
+            next_page = data.get('paging', {}).get('nextPage')
+            if not next_page:
+                self.finished = True
+                self.cursor = None
+                self._save_cursor()
+                if self.reqs.metrics is not None:
+                    self.reqs.metrics.record_pages(
+                        f'{self.base_url}{self.endpoint}', self.pages_read)
+                logger.info("GET Request completed")
+                self.reqs._log_rate_limit(r)
+                return
+            self.cursor = next_page
+            self._save_cursor()
+
+    # Saves the cursor in the checkpoint, if any. A finished pager saves an
+    # empty cursor, so the next run starts from the first page again.
+    def _save_cursor(self):
+        if self.checkpoint is not None:
+            self.checkpoint.set_cursor(self.checkpoint_name, self.cursor)
+
+# Bb_Records
+# Compact results of a GET request, returned by Bb_Requests.Bb_GET_records. Only
+# the given fields are kept, so when few fields of a large collection are needed
+# (i.e. id and externalId of every user) the full dicts are never held in memory.
+# Fields use the Learn notation, nested ones with a dot ('name.given'). Records
+# are namedtuples (Bb_Record, no per record dict) whose attributes are the field
+# names with the dots replaced by underscores, missing fields are None. With
+# columns=True the values are kept instead in one list per field, which is even
+# smaller, column(field) returns one of them. Records are read by index or by
+# iterating, and to_dict / to_dicts convert them back to nested dicts.
+
+
+class Bb_Records():
+
+    logger = logging.getLogger('Bb_rest_helper')
+    logger.propagate = False
+
+    def __init__(self, fields: list, columns: bool = False):
+        self.fields = list(fields)
+        self.paths = [tuple(f.split('.')) for f in self.fields]
+        self.record_type = collections.namedtuple(
+            'Bb_Record', [f.replace('.', '_') for f in self.fields])
+        self.columns = {f: [] for f in self.fields} if columns else None
+        self.records = None if columns else []
+
+    def __len__(self):
+        if self.columns is not None:
+            return len(self.columns[self.fields[0]]) if self.fields else 0
+        return len(self.records)
+
+    def __getitem__(self, index: int):
+        if self.columns is not None:
+            return self.record_type(*(self.columns[f][index] for f in self.fields))
+        return self.records[index]
+
+    def __iter__(self):
+        if self.columns is not None:
+            return map(self.record_type._make, zip(*(self.columns[f] for f in self.fields)))
+        return iter(self.records)
+
+    # Returns the value of a field of a record as returned by the API.
+    def _value(self, record: dict, path: tuple):
+        for key in path:
+            if not isinstance(record, dict):
+                return None
+            record = record.get(key)
+        return record
+
+    # Adds the records of a page of results, keeping only the fields.
+    def extend(self, results: list):
+        if self.columns is not None:
+            for field, path in zip(self.fields, self.paths):
+                self.columns[field].extend(self._value(d, path) for d in results)
+        else:
+            make = self.record_type._make
+            self.records.extend(
+                make([self._value(d, path) for path in self.paths]) for d in results)
+
+    # Returns the list of values of a field, in record order.
+    def column(self, field: str):
+        if self.columns is not None:
+            return self.columns[field]
+        index = self.fields.index(field)
+        return [record[index] for record in self.records]
+
+    # Converts a record back to a dict shaped like the API response.
+    def to_dict(self, record):
+        data = {}
+        for path, value in zip(self.paths, record):
+            target = data
+            for key in path[:-1]:
+                target = target.setdefault(key, {})
+            target[path[-1]] = value
+        return data
+
+    # Returns all the records as a list of dicts.
+    def to_dicts(self):
+        return [self.to_dict(record) for record in self]
+
+# AsyncAuth_Helper
+# asyncio version of Auth_Helper, needs httpx installed. learn_auth is a coroutine
+# that returns the cached token while it is valid and requests a new one when it
+# is about to expire. Concurrent coroutines asking for a token while it is being
+# refreshed wait for that single refresh instead of requesting one each.
+# An AsyncAuth_Helper can be passed to AsyncBb_Requests methods instead of the token.
+
+
+class AsyncAuth_Helper():
+
+    logger = logging.getLogger('Bb_rest_helper')
+    logger.propagate = False
+
+    # Initializes the auth helper by taking the target system url, API key and
+    # secret as arguments. Optionally takes an httpx.AsyncClient to share its
+    # connection pool, a private one is created otherwise. skew is the number of
+    # seconds before expiry at which the token is refreshed. A Retry_Policy can be
+    # given to retry failed token requests.
+    def __init__(
+            self,
+            url: str,
+            key: str,
+            secret: str,
+            client=None,
+            skew: int = 30,
+            retry_policy: Retry_Policy = None):
+        if httpx is None:
+            raise ImportError('AsyncAuth_Helper needs httpx, install it with "pip install httpx"')
+        self.retry_policy = retry_policy
+        self.url = url
+        self.key = key
+        self.secret = secret
+        self.skew = skew
+        self.owns_client = client is None
+        self.client = client if client else httpx.AsyncClient()
+        self.learn_token = None
+        self.expires_at = None
+        self._lock = None
+
+    # Returns True if there is no token or it expires within skew seconds.
+    def token_is_expired(self):
+        if self.learn_token is None:
+            return True
+        return (self.expires_at - datetime.datetime.now()).total_seconds() < self.skew
+
+    # Returns the authentication token for Blackboard Learn, refreshing it if needed.
+    async def learn_auth(self):
+        if not self.token_is_expired():
+            return self.learn_token
+        # The lock is created here so it belongs to the running event loop.
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            # Another coroutine may have refreshed the token while waiting.
+            if not self.token_is_expired():
+                return self.learn_token
+            def send():
+                return self.client.post(
+                    f'{self.url}/learn/api/public/v1/oauth2/token',
+                    headers={'Content-Type': "application/x-www-form-urlencoded"},
+                    params={"grant_type": "client_credentials"},
+                    auth=(self.key, self.secret))
+            if self.retry_policy is None:
+                r = await send()
+            else:
+                r = await self.retry_policy.call_async('POST', send, idempotent=True)
+            try:
+                r.raise_for_status()
+            except httpx.HTTPStatusError:
+                logger.error(json_codec.loads(r.content)["error_description"])
+                return None
+            data = json_codec.loads(r.content)
+            self.learn_token = data["access_token"]
+            self.expires_at = datetime.datetime.now() + \
+                datetime.timedelta(seconds=data["expires_in"])
+            logger.info("Learn Authentication successful")
+            logger.info("Token expires at: " + str(self.expires_at))
+            return self.learn_token
+
+    async def aclose(self):
+        if self.owns_client:
+            await self.client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
+# AsyncBb_Requests
+# asyncio version of Bb_Requests, needs httpx installed. Provides the same methods
+# as coroutines, plus Bb_GET_iter, an async generator over paginated results.
+# All the calls share the connection pool of one httpx.AsyncClient, created with
+# the given limits unless a client is passed in. max_connections bounds the number
+# of requests in flight, further requests wait for a free connection. The token
+# argument of every method can be a token string or an AsyncAuth_Helper.
+# Optionally takes a Rate_Limiter, a Retry_Policy and a Metrics_Collector, that can
+# be shared with Bb_Requests instances.
+
+
+class AsyncBb_Requests():
+
+    logger = logging.getLogger('Bb_rest_helper')
+    logger.propagate = False
+
+    def __init__(
+            self,
+            client=None,
+            max_connections: int = 100,
+            max_keepalive_connections: int = 20,
+            timeout=None,
+            rate_limiter: Rate_Limiter = None,
+            retry_policy: Retry_Policy = None,
+            metrics: Metrics_Collector = None,
+            codec: Json_Codec = None):
+        if httpx is None:
+            raise ImportError('AsyncBb_Requests needs httpx, install it with "pip install httpx"')
+        self.owns_client = client is None
+        if client:
+            self.client = client
+        else:
+            self.client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=max_connections,
+                    max_keepalive_connections=max_keepalive_connections),
+                timeout=httpx.Timeout(timeout))
+        self.rate_limiter = rate_limiter
+        self.retry_policy = retry_policy
+        self.metrics = metrics
+        self.codec = codec if codec else json_codec
+
+    async def aclose(self):
+        if self.owns_client:
+            await self.client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
+    # Returns the authorization headers, getting the token from an
+    # AsyncAuth_Helper if one is given.
+    async def _headers(self, token, content_type: bool = True):
+        if isinstance(token, AsyncAuth_Helper):
+            token = await token.learn_auth()
+        headers = {'Authorization': f'Bearer {token}'}
+        if content_type:
+            headers['Content-Type'] = "Application/json"
+        return headers
+
+    # Sends a request and returns the response, or None after logging the error
+    # message if the request failed.
+    async def _send(self, method: str, url: str, token, content_type: bool = True, **kwargs):
+        r = await self._request(method, url, token, content_type, **kwargs)
+        try:
+            r.raise_for_status()
+        except httpx.HTTPStatusError:
+            try:
+                logger.error(self.codec.loads(r.content)["message"])
+            except (ValueError, KeyError):
+                logger.error(f'{method} Request failed with status {r.status_code}')
+            return None
+        return r
+
+    # Sends a request and returns the response whatever its status. Retries it
+    # as set by the retry policy, if any.
+    async def _request(self, method: str, url: str, token, content_type: bool = True, **kwargs):
+        headers = await self._headers(token, content_type)
+        if self.retry_policy is None:
+            return await self._send_once(method, url, headers, **kwargs)
+        on_retry = None if self.metrics is None else (
+            lambda delay: self.metrics.record_retry(method, url, delay))
+        return await self.retry_policy.call_async(
+            method, lambda: self._send_once(method, url, headers, **kwargs), on_retry=on_retry)
+
+    # Sends a single request. Waits for the rate limiter, if any, and feeds it
+    # the response headers.
+    async def _send_once(self, method: str, url: str, headers: dict, **kwargs):
+        if self.rate_limiter is not None:
+            waited = await self.rate_limiter.acquire_async()
+            if waited and self.metrics is not None:
+                self.metrics.record_throttle(waited)
+        if self.metrics is None:
+            r = await self.client.request(method, url, headers=headers, **kwargs)
+        else:
+            started = time.perf_counter()
+            try:
+                r = await self.client.request(method, url, headers=headers, **kwargs)
+            except Exception:
+                self.metrics.record_request(method, url, None, time.perf_counter() - started)
+                raise
+            self.metrics.record_response(method, url, r, started)
+        if self.rate_limiter is not None:
+            self.rate_limiter.update(r.headers, r.status_code)
+        return r
+
+    # Logs the rate limit information returned by Learn in the response headers.
+    def _log_rate_limit(self, r):
+        rate_limit_log.log(r.headers)
+
+    # Async generator over the pages of a paginated GET request, starting from
+    # the response to the first page.
+    async def _iter_pages(self, base_url: str, r, token):
+        while r is not None:
+            data = self.codec.loads(r.content)
+            yield data.get('results', [])
+            next_page = data.get('paging', {}).get('nextPage')
+            if not next_page:
+                logger.info("GET Request completed")
+                self._log_rate_limit(r)
+                return
+            r = await self._send('GET', f'{base_url}{next_page}', token, False)
+
+    # Async generator over the results of a paginated GET request. Yields records,
+    # or whole pages if pages is True, as each page arrives. Stopping the loop
+    # stops any further request.
+    async def Bb_GET_iter(
+            self,
+            base_url: str,
+            endpoint: str,
+            token,
+            params: dict = {},
+            pages: bool = False):
+        r = await self._send('GET', f'{base_url}{endpoint}', token, params=params)
+        async for page in self._iter_pages(base_url, r, token):
+            if pages:
+                yield page
+            else:
+                for d in page:
+                    yield d
+
+    # GET request, returns the records from all the pages as a list, or None if
+    # the first page could not be read.
+    async def Bb_GET(
+            self,
+            base_url: str,
+            endpoint: str,
+            token,
+            params: dict = {}):
+        r = await self._send('GET', f'{base_url}{endpoint}', token, params=params)
+        if r is None:
+            return None
+        data_from_pages = []
+        async for page in self._iter_pages(base_url, r, token):
+            data_from_pages.extend(page)
+        return data_from_pages
+
+    # Same as Bb_Requests.Bb_GET_records, returns a Bb_Records or None if the first
+    # page could not be read.
+    async def Bb_GET_records(
+            self,
+            base_url: str,
+            endpoint: str,
+            token,
+            fields: list,
+            params: dict = {},
+            columns: bool = False):
+        r = await self._send(
+            'GET', f'{base_url}{endpoint}', token, params=dict(params, fields=','.join(fields)))
+        if r is None:
+            return None
+        records = Bb_Records(fields, columns)
+        async for page in self._iter_pages(base_url, r, token):
+            records.extend(page)
+        return records
+
+    async def Bb_POST(
+            self,
+            base_url: str,
+            endpoint: str,
+            token,
+            payload: dict,
+            params: dict = {}):
+        r = await self._send(
+            'POST', f'{base_url}{endpoint}', token, params=params,
+            content=self.codec.dumps(payload))
+        if r is not None:
+            self._log_rate_limit(r)
+            logger.info("POST Request completed")
+            return self.codec.loads(r.content)
+
+    # Uploads a file to the Learn uploads endpoint and returns its id.
+    async def Bb_POST_file(self, base_url: str, token, file_path: str):
+        with open(file_path, 'rb') as f:
+            r = await self._send(
+                'POST', f'{base_url}/learn/api/public/v1/uploads', token, False,
+                files={'file': f})
+        if r is not None:
+            logger.info('File uploaded to temporary storage, returning id')
+            self._log_rate_limit(r)
+            return self.codec.loads(r.content)['id']
+
+    async def Bb_PATCH(
+            self,
+            base_url: str,
+            endpoint: str,
+            token,
+            payload: dict,
+            params: dict = {}):
+        r = await self._send(
+            'PATCH', f'{base_url}{endpoint}', token, params=params,
+            content=self.codec.dumps(payload))
+        if r is not None:
+            self._log_rate_limit(r)
+            logger.info("PATCH Request completed")
+            return self.codec.loads(r.content)
+
+    async def Bb_PUT(
+            self,
+            base_url: str,
+            endpoint: str,
+            token,
+            payload: dict,
+            params: dict = {}):
+        r = await self._send(
+            'PUT', f'{base_url}{endpoint}', token, params=params,
+            content=self.codec.dumps(payload))
+        if r is not None:
+            self._log_rate_limit(r)
+            logger.info("PUT Request completed")
+            try:
+                return self.codec.loads(r.content)
+            except ValueError:
+                pass
+
+    async def Bb_DELETE(
+            self,
+            base_url: str,
+            endpoint: str,
+            token,
+            params: dict = {}):
+        r = await self._send('DELETE', f'{base_url}{endpoint}', token, params=params)
+        if r is not None:
+            self._log_rate_limit(r)
+            logger.info("DELETE Request completed")
+
+# Checkpoint_Store
+# Records the progress of a long running job in a sqlite file, so a job that
+# stops can continue where it was instead of starting again. Each item of the job
+# is identified by a key, mark_done() records it as completed (with the id of the
+# record created, if any) and is_done() tells if it can be skipped on restart.
+# Cursors (i.e. the cursor of a Bb_Pager) can be saved by name with set_cursor().
+# Item updates are kept in memory and written in one transaction every batch_size
+# updates or flush_interval seconds, and on flush() and close(), so items completed
+# after the last write may be sent again if the process dies. Several jobs can share
+# a file, job names the one used. Bb_Batch and Bb_GET_iter accept a Checkpoint_Store.
+
+
+class Checkpoint_Store():
+
+    logger = logging.getLogger('Bb_rest_helper')
+    logger.propagate = False
+
+    def __init__(
+            self,
+            path: str,
+            job: str = 'default',
+            batch_size: int = 500,
+            flush_interval: float = 5.0):
+        self.path = path
+        self.job = job
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS items (job TEXT, key TEXT, status TEXT, '
+            'response_id TEXT, error TEXT, updated_at REAL, PRIMARY KEY (job, key))')
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS cursors (job TEXT, name TEXT, cursor TEXT, '
+            'updated_at REAL, PRIMARY KEY (job, name))')
+        self.db.commit()
+        self.done = {
+            key: response_id for key, response_id in self.db.execute(
+                "SELECT key, response_id FROM items WHERE job = ? AND status = 'done'",
+                (self.job,))}
+        self.pending = []
+        self.last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        logger.info(f'Checkpoint loaded, {len(self.done)} items already done')
+
+    # Returns True if the item was completed in this or a previous run.
+    def is_done(self, key):
+        return str(key) in self.done
+
+    # Returns the response id recorded for a completed item, or None.
+    def response_id(self, key):
+        return self.done.get(str(key))
+
+    # Records an item as completed.
+    def mark_done(self, key, response_id=None):
+        key = str(key)
+        response_id = None if response_id is None else str(response_id)
+        with self._lock:
+            self.done[key] = response_id
+            self.pending.append((self.job, key, 'done', response_id, None, time.time()))
+            self._maybe_flush()
+
+    # Records an item as failed, it will be run again on restart.
+    def mark_failed(self, key, error: str = None):
+        key = str(key)
+        with self._lock:
+            self.done.pop(key, None)
+            self.pending.append((self.job, key, 'failed', None, error, time.time()))
+            self._maybe_flush()
+
+    def _maybe_flush(self):
+        if len(self.pending) >= self.batch_size or \
+                time.monotonic() - self.last_flush >= self.flush_interval:
+            self._flush()
+
+    def _flush(self):
+        if self.pending:
+            self.db.executemany(
+                'INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?, ?, ?)', self.pending)
+            self.db.commit()
+            self.pending = []
+        self.last_flush = time.monotonic()
+
+    # Writes the pending item updates to the file.
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    # Saves a cursor by name. Cursors are written straight away.
+    def set_cursor(self, name: str, cursor):
+        with self._lock:
+            self.db.execute(
+                'INSERT OR REPLACE INTO cursors VALUES (?, ?, ?, ?)',
+                (self.job, name, cursor, time.time()))
+            self.db.commit()
+
+    # Returns a cursor saved by name, or None.
+    def get_cursor(self, name: str):
+        with self._lock:
+            row = self.db.execute(
+                'SELECT cursor FROM cursors WHERE job = ? AND name = ?',
+                (self.job, name)).fetchone()
+        return row[0] if row else None
+
+    # Removes every item and cursor of the job, to start it again from scratch.
+    def reset(self):
+        with self._lock:
+            self.pending = []
+            self.done = {}
+            self.db.execute('DELETE FROM items WHERE job = ?', (self.job,))
+            self.db.execute('DELETE FROM cursors WHERE job = ?', (self.job,))
+            self.db.commit()
+
+    def close(self):
+        with self._lock:
+            if self.db is not None:
+                self._flush()
+                self.db.close()
+                self.db = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+# Bb_Batch
+# Runs many write requests (or GETs) concurrently. Takes a Bb_Requests (or an
+# AsyncBb_Requests for run_async), the server url and the token (a string, a
+# Token_Manager or an AsyncAuth_Helper). run() takes an iterable of jobs, each
+# one a (verb, endpoint, payload) or (verb, endpoint, payload, params) tuple, with
+# payload None for GET and DELETE, and yields a result for every job in input order.
+# The jobs go through max_workers threads (or coroutines), so they share the rate
+# limiter and retry policy of the Bb_Requests. Jobs are read from the iterable only
+# as results are consumed, at most max_pending ahead, so a large CSV can be streamed
+# without reading it all into memory. A failed job does not stop the batch, each
+# result is a dict with the keys index, verb, endpoint, status, data, error (None
+# when the job succeeded) and skipped. With a Checkpoint_Store, completed jobs are
+# recorded and skipped when the batch is run again (their result has skipped True
+# and data holds the recorded id). Jobs are identified by their position in the
+# input, or by the value returned by key(job) if a key function is given.
+
+
+class Bb_Batch():
+
+    logger = logging.getLogger('Bb_rest_helper')
+    logger.propagate = False
+
+    def __init__(
+            self,
+            reqs,
+            base_url: str,
+            token,
+            max_workers: int = 8,
+            max_pending: int = None,
+            checkpoint: Checkpoint_Store = None,
+            key=None):
+        self.reqs = reqs
+        self.base_url = base_url
+        self.token = token
+        self.max_workers = max_workers
+        self.max_pending = max_pending if max_pending else max_workers * 2
+        self.checkpoint = checkpoint
+        self.key = key
+        self.skipped = 0
+        self.succeeded = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+
+    # Returns verb, endpoint, payload and params of a job.
+    def _unpack(self, job):
+        verb, endpoint, payload = job[0].upper(), job[1], job[2]
+        params = job[3] if len(job) > 3 and job[3] else {}
+        return verb, endpoint, payload, params
+
+    # Builds the result of a job from its response, or from the exception raised.
+    def _result(self, index: int, verb: str, endpoint: str, r=None, error=None):
+        result = {
+            'index': index,
+            'verb': verb,
+            'endpoint': endpoint,
+            'status': None,
+            'data': None,
+            'error': None,
+            'skipped': False
+        }
+        if error is not None:
+            result['error'] = str(error) or type(error).__name__
+        else:
+            result['status'] = r.status_code
+            try:
+                result['data'] = self.reqs.codec.loads(r.content) if r.content else None
+            except ValueError:
+                result['data'] = r.text
+            if r.status_code >= 400:
+                data = result['data']
+                result['error'] = data.get('message', r.text) if isinstance(data, dict) else r.text
+        with self._lock:
+            if result['error'] is None:
+                self.succeeded += 1
+            else:
+                self.failed += 1
+        if result['error'] is not None:
+            logger.error(f'{verb} {endpoint} failed: {result["error"]}')
+        return result
+
+    # Returns the checkpoint key of a job.
+    def _job_key(self, index: int, job):
+        return self.key(job) if self.key else index
+
+    # Returns the result of a job completed in a previous run, or None if the
+    # job has to run.
+    def _skipped_result(self, index: int, job):
+        if self.checkpoint is None:
+            return None
+        key = self._job_key(index, job)
+        if not self.checkpoint.is_done(key):
+            return None
+        with self._lock:
+            self.skipped += 1
+        verb, endpoint, payload, params = self._unpack(job)
+        return {
+            'index': index,
+            'verb': verb,
+            'endpoint': endpoint,
+            'status': None,
+            'data': self.checkpoint.response_id(key),
+            'error': None,
+            'skipped': True
+        }
+
+    # Records the result of a job in the checkpoint, if any.
+    def _record(self, index: int, job, result: dict):
+        if self.checkpoint is None:
+            return
+        key = self._job_key(index, job)
+        if result['error'] is None:
+            data = result['data']
+            self.checkpoint.mark_done(key, data.get('id') if isinstance(data, dict) else None)
+        else:
+            self.checkpoint.mark_failed(key, result['error'])
+
+    # Serializes the payload of a job with the codec of the requests instance.
+    def _encode(self, payload):
+        return None if payload is None else self.reqs.codec.dumps(payload)
+
+    # Runs a job in a worker thread.
+    def _run_job(self, index: int, job):
+        verb, endpoint, payload, params = self._unpack(job)
+        try:
+            r = self.reqs._request(
+                verb, f'{self.base_url}{endpoint}',
+                headers=self.reqs._headers(self.token),
+                params=params,
+                data=self._encode(payload))
+            result = self._result(index, verb, endpoint, r)
+        except Exception as e:
+            result = self._result(index, verb, endpoint, error=e)
+        self._record(index, job, result)
+        return result
+
+    # Runs the jobs and yields their results in input order.
+    def run(self, jobs):
+        pending = collections.deque()
+        jobs = iter(jobs)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            for index, job in enumerate(jobs):
+                skipped = self._skipped_result(index, job)
+                if skipped is not None:
+                    future = Future()
+                    future.set_result(skipped)
+                    pending.append(future)
+                else:
+                    pending.append(pool.submit(self._run_job, index, job))
+                if len(pending) >= self.max_pending:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        if self.checkpoint is not None:
+            self.checkpoint.flush()
+        logger.info(
+            f'Batch completed, {self.succeeded} succeeded, {self.failed} failed, '
+            f'{self.skipped} skipped')
+
+    # Runs a job as a coroutine, used by run_async.
+    async def _run_job_async(self, index: int, job, semaphore):
+        skipped = self._skipped_result(index, job)
+        if skipped is not None:
+            return skipped
+        verb, endpoint, payload, params = self._unpack(job)
+        async with semaphore:
+            try:
+                r = await self.reqs._request(
+                    verb, f'{self.base_url}{endpoint}', self.token,
+                    params=params,
+                    content=self._encode(payload))
+                result = self._result(index, verb, endpoint, r)
+            except Exception as e:
+                result = self._result(index, verb, endpoint, error=e)
+        self._record(index, job, result)
+        return result
+
+    # Same as run, for an AsyncBb_Requests. An async generator that yields the
+    # results in input order, jobs can be a regular or an async iterable.
+    async def run_async(self, jobs):
+        semaphore = asyncio.Semaphore(self.max_workers)
+        pending = collections.deque()
+        index = 0
+        if hasattr(jobs, '__aiter__'):
+            iterator = jobs.__aiter__()
+        else:
+            iterator = None
+            jobs = iter(jobs)
+        try:
+            while True:
+                try:
+                    job = await iterator.__anext__() if iterator else next(jobs)
+                except (StopIteration, StopAsyncIteration):
+                    break
+                pending.append(asyncio.ensure_future(
+                    self._run_job_async(index, job, semaphore)))
+                index += 1
+                if len(pending) >= self.max_pending:
+                    yield await pending.popleft()
+            while pending:
+                yield await pending.popleft()
+        finally:
+            for task in pending:
+                task.cancel()
+        if self.checkpoint is not None:
+            self.checkpoint.flush()
+        logger.info(
+            f'Batch completed, {self.succeeded} succeeded, {self.failed} failed, '
+            f'{self.skipped} skipped')
+
+# Id_Resolver
+# Resolves external ids (or other unique keys) to Learn ids without one GET per
+# lookup. build() reads every course (or user) in one paginated sweep asking only
+# for the fields needed, and indexes them by each key in keys. refresh() then only
+# reads the records modified since the last sweep. lookup() answers from the index
+# and only goes to the network for values not found there, adding the result to
+# the index. The index can be saved to and loaded from a json file, so it does not
+# have to be built on every run. Note that records deleted in Learn are only
+# removed from the index by a new build(). kind is 'courses' or 'users'.
+
+
+class Id_Resolver():
+
+    logger = logging.getLogger('Bb_rest_helper')
+    logger.propagate = False
+
+    kinds = {
+        'courses': {
+            'endpoint': '/learn/api/public/v3/courses',
+            'fields': ['id', 'externalId', 'courseId', 'uuid', 'modified'],
+            'keys': ['externalId', 'courseId']
+        },
+        'users': {
+            'endpoint': '/learn/api/public/v1/users',
+            'fields': ['id', 'externalId', 'userName', 'uuid', 'modified'],
+            'keys': ['externalId', 'userName']
+        }
+    }
+
+    def __init__(
+            self,
+            reqs: Bb_Requests,
+            base_url: str,
+            token,
+            kind: str = 'courses',
+            page_size: int = 100):
+        if kind not in self.kinds:
+            raise ValueError(f'kind must be one of {list(self.kinds)}')
+        self.reqs = reqs
+        self.base_url = base_url
+        self.token = token
+        self.kind = kind
+        self.page_size = page_size
+        self.endpoint = self.kinds[kind]['endpoint']
+        self.fields = self.kinds[kind]['fields']
+        self.keys = self.kinds[kind]['keys']
+        self.records = {}
+        self.index = {key: {} for key in self.keys}
+        self.last_modified = None
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    # Adds or replaces a record in the index.
+    def _add(self, record: dict):
+        with self._lock:
+            old = self.records.get(record.get('id'))
+            if old is not None:
+                for key in self.keys:
+                    if old.get(key) is not None:
+                        self.index[key].pop(old[key], None)
+            self.records[record['id']] = record
+            for key in self.keys:
+                if record.get(key) is not None:
+                    self.index[key][record[key]] = record
+            modified = record.get('modified')
+            if modified and (self.last_modified is None or modified > self.last_modified):
+                self.last_modified = modified
+
+    # Reads the records with the given extra params and adds them to the index.
+    def _sweep(self, params: dict):
+        params = dict(params, fields=','.join(self.fields), limit=str(self.page_size))
+        count = 0
+        for record in self.reqs.Bb_GET_iter(self.base_url, self.endpoint, self.token, params):
+            self._add(record)
+            count += 1
+        return count
+
+    # Builds the index from scratch with every record in Learn.
+    def build(self):
+        with self._lock:
+            self.records = {}
+            self.index = {key: {} for key in self.keys}
+            self.last_modified = None
+        count = self._sweep({})
+        logger.info(f'{count} {self.kind} indexed')
+        return count
+
+    # Updates the index with the records modified since the last build or refresh.
+    def refresh(self):
+        if self.last_modified is None:
+            return self.build()
+        count = self._sweep({
+            'modified': self.last_modified,
+            'modifiedCompare': 'greaterOrEqual'
+        })
+        logger.info(f'{count} {self.kind} updated in the index')
+        return count
+
+    # Returns the record whose key (externalId by default) matches the value, or
+    # None. Values not in the index are requested to Learn.
+    def lookup(self, value: str, key: str = 'externalId'):
+        record = self.index.get(key, {}).get(value)
+        if record is not None:
+            self.hits += 1
+            return record
+        self.misses += 1
+        # Learn matches these filters partially, only exact matches are kept.
+        params = {key: value, 'fields': ','.join(self.fields)}
+        data = self.reqs.Bb_GET(self.base_url, self.endpoint, self.token, params) or []
+        for d in data:
+            if d.get(key) == value:
+                self._add(d)
+                return d
+        return None
+
+    # Returns the record with a Learn id (i.e. _12_1), or None. Ids not in the
+    # index are requested to Learn.
+    def get(self, record_id: str):
+        record = self.records.get(record_id)
+        if record is not None:
+            self.hits += 1
+            return record
+        self.misses += 1
+        r = self.reqs._request(
+            'GET', f'{self.base_url}{self.endpoint}/{record_id}',
+            headers=self.reqs._headers(self.token), params={'fields': ','.join(self.fields)})
+        if not r.ok:
+            return None
+        record = self.reqs.codec.loads(r.content)
+        self._add(record)
+        return record
+
+    # Returns a field (id by default) of the record matching the value, or None.
+    def resolve(self, value: str, key: str = 'externalId', field: str = 'id'):
+        record = self.lookup(value, key)
+        return record.get(field) if record else None
+
+    # Saves the index to a json file.
+    def save(self, path: str):
+        with self._lock:
+            data = {
+                'kind': self.kind,
+                'last_modified': self.last_modified,
+                'records': list(self.records.values())
+            }
+        with open(path, 'w') as f:
+            json.dump(data, f)
+        logger.info(f'Index saved to {path}')
+
+    # Loads an index saved with save(). Returns False if the file does not exist.
+    def load(self, path: str):
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            logger.warning(f'No index found at {path}')
+            return False
+        if data.get('kind') != self.kind:
+            raise ValueError(f'{path} is an index of {data.get("kind")}, not {self.kind}')
+        for record in data['records']:
+            self._add(record)
+        self.last_modified = data.get('last_modified') or self.last_modified
+        logger.info(f'Index loaded from {path}')
+        return True
+
+# Csv_Writer
+# Writes rows (dicts) to a csv file keeping the file open, instead of opening it
+# for every row like Bb_Utils.write_csv. Rows are buffered and written every
+# flush_rows rows, or when a write comes flush_interval seconds after the last
+# flush, and always on close. The header is written once, only if the file is new
+# or empty. Rows are appended to an existing file, use mode 'w' to overwrite it.
+# Use it as a context manager, or call close() when done.
+
+
+class Csv_Writer():
+
+    logger = logging.getLogger('Bb_rest_helper')
+    logger.propagate = False
+
+    def __init__(
+            self,
+            path: str,
+            headers: list,
+            delimiter: str = ',',
+            flush_rows: int = 1000,
+            flush_interval: float = 5.0,
+            mode: str = 'a'):
+        self.path = path
+        self.headers = headers
+        self.delimiter = delimiter
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.rows_written = 0
+        self.buffer = []
+        self.csvfile = open(self.path, mode, newline='')
+        self.writer = csv.DictWriter(
+            self.csvfile, fieldnames=self.headers, delimiter=self.delimiter)
+        if self.csvfile.tell() == 0:
+            self.writer.writeheader()
+        self.last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    # Adds a row to the buffer.
+    def writerow(self, row: dict):
+        with self._lock:
+            self.buffer.append(row)
+            self._maybe_flush()
+
+    # Adds many rows to the buffer in one call. rows can be any iterable.
+    def writerows(self, rows):
+        with self._lock:
+            for row in rows:
+                self.buffer.append(row)
+                if len(self.buffer) >= self.flush_rows:
+                    self._flush()
+            self._maybe_flush()
+
+    def _maybe_flush(self):
+        if len(self.buffer) >= self.flush_rows or \
+                time.monotonic() - self.last_flush >= self.flush_interval:
+            self._flush()
+
+    def _flush(self):
+        self.writer.writerows(self.buffer)
+        self.csvfile.flush()
+        self.rows_written += len(self.buffer)
+        self.buffer = []
+        self.last_flush = time.monotonic()
+
+    # Writes the buffered rows to the file.
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        with self._lock:
+            if not self.csvfile.closed:
+                self._flush()
+                self.csvfile.close()
+                logger.info(f'{self.rows_written} rows written to {self.path}')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+# Delta_Sync
+# Keeps a local copy (a sqlite file) of Learn collections up to date reading only
+# what changed. For every endpoint synced it stores the records with a hash of
+# their content and a high-water mark, the latest modified date seen. The first
+# sync of an endpoint reads it all, later ones only ask for the records modified
+# since the mark (modified, modifiedCompare=greaterOrEqual and sort=modified, like
+# /learn/api/public/v3/courses and /learn/api/public/v1/users support) and merge
+# them into the copy. If Learn rejects those filters, the records have no modified
+# date, or full=True, it runs a full resync instead: every record is read and
+# compared to the copy by hash, and the records that are gone are deleted (deleted
+# records are only found by full syncs). sync() returns the count of records added,
+# updated, unchanged and deleted, or None if the endpoint could not be read. If
+# params include fields, include id and modified. Pages are written as they arrive,
+# records are read back with get() and records().
+
+
+class Delta_Sync():
+
+    logger = logging.getLogger('Bb_rest_helper')
+    logger.propagate = False
+
+    def __init__(
+            self,
+            reqs: Bb_Requests,
+            base_url: str,
+            token,
+            path: str,
+            id_field: str = 'id'):
+        self.reqs = reqs
+        self.base_url = base_url
+        self.token = token
+        self.path = path
+        self.id_field = id_field
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS records (endpoint TEXT, id TEXT, hash TEXT, '
+            'modified TEXT, data TEXT, PRIMARY KEY (endpoint, id))')
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS marks (endpoint TEXT PRIMARY KEY, modified TEXT, '
+            'synced_at REAL, full_sync_at REAL)')
+        self.db.commit()
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # Returns the high-water mark of an endpoint, None if it was never synced.
+    def mark(self, endpoint: str):
+        row = self.db.execute(
+            'SELECT modified FROM marks WHERE endpoint = ?', (endpoint,)).fetchone()
+        return row[0] if row else None
+
+    # Syncs an endpoint, incrementally if possible, and returns the counts.
+    def sync(self, endpoint: str, params: dict = {}, full: bool = False):
+        with self._lock:
+            mark = None if full else self.mark(endpoint)
+            if mark is not None:
+                counts = self._sync(endpoint, dict(
+                    params, modified=mark, modifiedCompare='greaterOrEqual', sort='modified'), mark)
+                if counts is not None:
+                    return counts
+                logger.warning(f'Incremental sync of {endpoint} failed, running a full resync')
+            return self._sync(endpoint, params)
+
+    # Returns the hash of a record, the same for equal records whatever the key order.
+    def _hash(self, record: dict):
+        return hashlib.blake2b(
+            json.dumps(record, sort_keys=True, separators=(',', ':')).encode('utf-8'),
+            digest_size=16).hexdigest()
+
+    # Reads the pages of an endpoint and merges them. A full sync (no mark) also
+    # deletes the records not found.
+    def _sync(self, endpoint: str, params: dict, mark: str = None):
+        full = mark is None
+        counts = collections.Counter(added=0, updated=0, unchanged=0, deleted=0)
+        high = mark
+        known = dict(self.db.execute(
+            'SELECT id, hash FROM records WHERE endpoint = ?', (endpoint,))) if full else None
+        seen = set()
+        pager = self.reqs.Bb_GET_iter(self.base_url, endpoint, self.token, params, pages=True)
+        for page in pager:
+            records = {str(r[self.id_field]): r for r in page if r.get(self.id_field) is not None}
+            if full:
+                hashes = known
+            else:
+                hashes = self._hashes(endpoint, list(records))
+            rows = []
+            for record_id, record in records.items():
+                seen.add(record_id)
+                modified = record.get('modified')
+                if modified and (high is None or modified > high):
+                    high = modified
+                digest = self._hash(record)
+                previous = hashes.get(record_id)
+                if previous == digest:
+                    counts['unchanged'] += 1
+                    continue
+                counts['added' if previous is None else 'updated'] += 1
+                if full:
+                    known[record_id] = digest
+                rows.append((endpoint, record_id, digest, modified,
+                             self.reqs.codec.dumps(record).decode('utf-8')))
+            self.db.executemany(
+                'INSERT OR REPLACE INTO records (endpoint, id, hash, modified, data) '
+                'VALUES (?, ?, ?, ?, ?)', rows)
+            self.db.commit()
+        if not pager.finished:
+            logger.error(f'Sync of {endpoint} stopped after {pager.pages_read} pages')
+            return None
+        if full:
+            gone = [(endpoint, record_id) for record_id in known if record_id not in seen]
+            self.db.executemany('DELETE FROM records WHERE endpoint = ? AND id = ?', gone)
+            counts['deleted'] = len(gone)
+        now = time.time()
+        self.db.execute(
+            'INSERT INTO marks (endpoint, modified, synced_at, full_sync_at) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT (endpoint) DO UPDATE SET modified = excluded.modified, '
+            'synced_at = excluded.synced_at, '
+            'full_sync_at = COALESCE(excluded.full_sync_at, full_sync_at)',
+            (endpoint, high, now, now if full else None))
+        self.db.commit()
+        counts = dict(counts, full=full)
+        logger.info(f'Sync of {endpoint} completed: {counts}')
+        return counts
 
-        try:
-            if self.learn_token == None:
-
-                r = requests.request(
-                    "POST",
-                    self.url +
-                    self.endpoint,
-                    headers=self.headers,
-                    params=self.params,
-                    auth=(
-                        self.key,
-                        self.secret))
-                r.raise_for_status()
-                self.data = json.loads(r.text)
-                self.learn_token = self.data["access_token"]
-                self.expires = self.data["expires_in"]
-                m, s = divmod(self.expires, 60)
-                self.now = datetime.datetime.now()
-                self.expires_at = self.now + \
-                    datetime.timedelta(seconds=s, minutes=m)
-                logger.info("Learn Authentication successful")
-                logger.info("Token expires at: " + str(self.expires_at))
-                return self.learn_token
+    # Returns the stored hashes of some records of an endpoint.
+    def _hashes(self, endpoint: str, ids: list):
+        hashes = {}
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            hashes.update(self.db.execute(
+                f'SELECT id, hash FROM records WHERE endpoint = ? AND id IN ({",".join("?" * len(chunk))})',
+                [endpoint] + chunk))
+        return hashes
 
-            elif self.token_is_expired(self.expires_at):
-                logger.info('refresh token')
-                r = requests.request(
-                    "POST",
-                    self.url +
-                    self.endpoint,
-                    headers=self.headers,
-                    params=self.params,
-                    auth=(
-                        self.conf.get_key(),
-                        self.conf.get_secret()))
-                r.raise_for_status()
-                self.data = json.loads(r.text)
-                self.learn_token = self.data["access_token"]
-                self.expires = self.data["expires_in"]
-                m, s = divmod(self.expires, 60)
-                self.now = datetime.datetime.now()
-                self.expires_at = self.now + \
-                    datetime.timedelta(seconds=s, minutes=m)
-                logger.info("Learn Authentication successful")
-                logger.info("Token expires at: " + str(self.expires_at))
-                return self.learn_token
+    # Returns a stored record, or None.
+    def get(self, endpoint: str, record_id: str):
+        row = self.db.execute(
+            'SELECT data FROM records WHERE endpoint = ? AND id = ?', (endpoint, str(record_id))).fetchone()
+        return self.reqs.codec.loads(row[0]) if row else None
 
-        except requests.exceptions.HTTPError as e:
-            data = json.loads(r.text)
-            logger.error(data["error_description"])
+    # Yields the stored records of an endpoint.
+    def records(self, endpoint: str):
+        for (data,) in self.db.execute(
+                'SELECT data FROM records WHERE endpoint = ? ORDER BY id', (endpoint,)):
+            yield self.reqs.codec.loads(data)
 
+    def count(self, endpoint: str):
+        return self.db.execute(
+            'SELECT COUNT(*) FROM records WHERE endpoint = ?', (endpoint,)).fetchone()[0]
 
-# Bb_Requests
-# A class to simplify API calls to Blackboard REST APIs, provides functions
-# for GET, POST, PUT, PATCH and DELETE
+    # Forgets the records and the mark of an endpoint, or of all of them.
+    def reset(self, endpoint: str = None):
+        with self._lock:
+            if endpoint is None:
+                self.db.execute('DELETE FROM records')
+                self.db.execute('DELETE FROM marks')
+            else:
+                self.db.execute('DELETE FROM records WHERE endpoint = ?', (endpoint,))
+                self.db.execute('DELETE FROM marks WHERE endpoint = ?', (endpoint,))
+            self.db.commit()
 
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+# Content_Crawler
+# Walks the content trees of courses breadth-first, instead of one Bb_GET after
+# the other. Every listing of contents (/courses/{courseId}/contents for the top
+# level, /courses/{courseId}/contents/{contentId}/children for a folder) is a job
+# of a pool of max_in_flight threads, and the folders found are added to the
+# frontier as their listing completes, so levels and courses are read at the same
+# time, with never more than max_in_flight requests in flight. Listings go through
+# Bb_Requests.Bb_GET, so they are paged and share the rate limiter, retry policy
+# and metrics of reqs. crawl() takes an iterable of course ids (i.e. _123_1 or
+# courseId:ABC), reads max_courses of them at a time, and yields a dict for every
+# content as soon as it is read, with the keys course, parent (the id of the
+# parent content, None at the top level), depth (0 at the top level) and content
+# (the record). max_depth is the deepest level read, expand the content handlers
+# (i.e. resource/x-bb-folder) whose children are read and handlers the ones of
+# the contents yielded, all of them when not given. fields limits the fields of
+# the records, as the Learn fields parameter. Listings that can not be read are
+# logged and added to errors, and do not stop the crawl.
 
-class Bb_Requests():
+
+class Content_Crawler():
 
     logger = logging.getLogger('Bb_rest_helper')
     logger.propagate = False
 
-    # GET request. It takes a GET endpoint from the API, the authentication
-    # token and a list of parameters as arguments. This request has been updated
-    # to support pagination. Note this is currently a heavy method, use parameters
-    # limit responses if needed.
+    contents_endpoint = '/learn/api/public/v1/courses/{course}/contents'
 
-    def Bb_GET(
+    def __init__(
             self,
+            reqs: Bb_Requests,
             base_url: str,
-            endpoint: str,
-            token: str,
+            token,
+            max_in_flight: int = 8,
+            max_courses: int = None,
+            max_depth: int = None,
+            expand: list = None,
+            handlers: list = None,
+            fields: list = None,
             params: dict = {}):
+        self.reqs = reqs
         self.base_url = base_url
-        self.endpoint = endpoint
         self.token = token
-        self.params = params
-        self.request_url = f'{self.base_url}{self.endpoint}'
-        self.headers = {
-            'Authorization': f'Bearer {self.token}',
-            'Content-Type': "Application/json"
-        }
-        data_from_pages = []
-        try:
+        self.max_in_flight = max_in_flight
+        self.max_courses = max_courses if max_courses else max_in_flight
+        self.max_depth = max_depth
+        self.expand = set(expand) if expand is not None else None
+        self.handlers = set(handlers) if handlers is not None else None
+        self.params = dict(params)
+        if fields:
+            # The crawl needs these to follow the tree.
+            needed = ['id', 'parentId', 'hasChildren', 'contentHandler.id']
+            self.params['fields'] = ','.join(dict.fromkeys(list(fields) + needed))
+        self.errors = []
+        self.listings = 0
+        self.contents = 0
 
-            r = requests.request('GET', self.request_url,
-                                 headers=self.headers, params=self.params)
+    # Returns the contents of a listing endpoint, all pages, or None.
+    def _list(self, endpoint: str):
+        return self.reqs.Bb_GET(self.base_url, endpoint, self.token, self.params)
 
-            data = json.loads(r.text)
-            r.raise_for_status()
+    def _handler(self, content: dict):
+        return (content.get('contentHandler') or {}).get('id')
 
-            for d in data['results']:
-                data_from_pages.append(d)
+    # Returns True if the children of a content at the given depth are read.
+    def _expands(self, content: dict, depth: int):
+        if not content.get('hasChildren'):
+            return False
+        if self.max_depth is not None and depth >= self.max_depth:
+            return False
+        return self.expand is None or self._handler(content) in self.expand
 
-            while data['paging']['nextPage']:
-                self.offset_url = f'{self.base_url}{data["paging"]["nextPage"]}'
-                r = requests.get(
-                    self.offset_url, headers={
-                        f'Authorization': f'Bearer {self.token}'})
-                data = json.loads(r.text)
-                for d in data['results']:
-                    data_from_pages.append(d)
+    # Crawls the courses and yields their contents, level by level.
+    def crawl(self, course_ids):
+        courses = iter(course_ids)
+        frontier = collections.deque()
+        pending = collections.Counter()
+        futures = {}
+        crawled = 0
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as pool:
+            while True:
+                while len(pending) < self.max_courses:
+                    course = next(courses, None)
+                    if course is None:
+                        break
+                    frontier.append((course, None, 0, self.contents_endpoint.format(course=course)))
+                    pending[course] += 1
+                while frontier and len(futures) < self.max_in_flight:
+                    job = frontier.popleft()
+                    futures[pool.submit(self._list, job[3])] = job
+                if not futures:
+                    break
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    course, parent, depth, endpoint = futures.pop(future)
+                    self.listings += 1
+                    try:
+                        contents = future.result()
+                    except Exception as e:
+                        logger.error(f'Contents of {endpoint} could not be read: {e}')
+                        contents = None
+                    if contents is None:
+                        self.errors.append(endpoint)
+                        contents = []
+                    for content in contents:
+                        self.contents += 1
+                        if self._expands(content, depth):
+                            frontier.append((
+                                course, content['id'], depth + 1,
+                                f'{self.contents_endpoint.format(course=course)}/{content["id"]}/children'))
+                            pending[course] += 1
+                        if self.handlers is None or self._handler(content) in self.handlers:
+                            yield {'course': course, 'parent': parent, 'depth': depth, 'content': content}
+                    pending[course] -= 1
+                    if not pending[course]:
+                        del pending[course]
+                        crawled += 1
+        logger.info(
+            f'Crawl completed, {crawled} courses, {self.contents} contents, '
+            f'{self.listings} listings, {len(self.errors)} errors')
 
-        except requests.exceptions.HTTPError as e:
-            data = json.loads(r.text)
-            logger.error(data["message"])
+# Gradebook_Matrix
+# The grades of a course as a dense matrix of users by gradebook columns, instead
+# of lists of grade dicts to pivot by hand. fetch() reads the gradebook columns and
+# the course memberships at the same time, then the grades of every column on a
+# pool of max_workers threads, through the Bb_Requests given, so they share its
+# rate limiter and retry policy. Only the userId and the value field (score by
+# default, nested fields with a dot, i.e. displayGrade.score) of the grades are
+# requested, and each page of grades is written straight into the matrix and
+# dropped. values is a NumPy float array of users x columns when NumPy is
+# installed, or an array.array('d') with the rows one after the other otherwise
+# (or with use_numpy=False), with NaN for missing or non numeric grades. user_ids
+# and column_ids are the ids of the rows and columns, user_index and column_index
+# the row and column of an id, and columns the column records. roles keeps only
+# the members with those course roles (i.e. Student), grades of other users are
+# counted in unknown_grades. Columns whose grades could not be read are added to
+# errors. write_csv() writes the matrix row by row and write_parquet() (needs
+# pyarrow) in row groups, without building another copy of it.
 
-        except BaseException:
-            # returns data from Learn REST API, all pages
-            logger.info("GET Request completed")
-            logger.info(f'API limit: {r.headers["X-Rate-Limit-Limit"]}')
-            logger.info(
-                f'Remaining API calls: {r.headers["X-Rate-Limit-Remaining"]}')
-            logger.info(
-                f'Time to reset API limit: {r.headers["X-Rate-Limit-reset"]}')
-            return data_from_pages
 
-    # POST request. It takes a POST endpoint from the API, the authentication token,
-    # a list of parameters, and a json payload as arguments.
+class Gradebook_Matrix():
 
-    def Bb_POST(
+    logger = logging.getLogger('Bb_rest_helper')
+    logger.propagate = False
+
+    columns_endpoint = '/learn/api/public/v2/courses/{course}/gradebook/columns'
+    grades_endpoint = '/learn/api/public/v2/courses/{course}/gradebook/columns/{column}/users'
+    memberships_endpoint = '/learn/api/public/v1/courses/{course}/users'
+
+    def __init__(
             self,
+            reqs: Bb_Requests,
             base_url: str,
-            endpoint: str,
-            token: str,
-            payload: dict,
-            params: dict = {}):
+            token,
+            course_id: str,
+            value: str = 'score',
+            roles: list = None,
+            max_workers: int = 8,
+            use_numpy: bool = None):
+        if use_numpy and numpy is None:
+            raise ImportError('NumPy is not installed, install it with "pip install numpy"')
+        self.reqs = reqs
         self.base_url = base_url
-        self.endpoint = endpoint
         self.token = token
-        self.params = params
-        self.payload = payload
-        self.request_url = f'{self.base_url}{self.endpoint}'
-        self.headers = {
-            'Authorization': f'Bearer {self.token}',
-            'Content-Type': "Application/json"
-        }
+        self.course_id = course_id
+        self.value = value
+        self.roles = set(roles) if roles is not None else None
+        self.max_workers = max_workers
+        self.use_numpy = numpy is not None if use_numpy is None else use_numpy
+        self.columns = []
+        self.column_ids = []
+        self.column_index = {}
+        self.user_ids = []
+        self.user_index = {}
+        self.values = None
+        self.unknown_grades = 0
+        self.errors = []
+        self._lock = threading.Lock()
+
+    # Returns the value of a grade as a float, NaN if missing or not a number.
+    def _number(self, grade: dict):
+        value = grade
+        for key in self.value.split('.'):
+            value = value.get(key) if isinstance(value, dict) else None
         try:
-            r = requests.request(
-                'POST',
-                self.request_url,
-                headers=self.headers,
-                params=self.params,
-                json=self.payload)
-            data = json.loads(r.text)
-            r.raise_for_status()
-            logger.info(f'API limit: {r.headers["X-Rate-Limit-Limit"]}')
-            logger.info(
-                f'Remaining API calls: {r.headers["X-Rate-Limit-Remaining"]}')
-            logger.info(
-                f'Time to reset API limit: {r.headers["X-Rate-Limit-reset"]}')
-            logger.info("POST Request completed")
-            return data
-        except requests.exceptions.HTTPError as e:
-            data = json.loads(r.text)
-            logger.error(data["message"])
+            return float(value)
+        except (TypeError, ValueError):
+            return math.nan
 
-    # Uploads a file to the Blacboard Learn Api uploads endpoint, getting the path to the file and the auth header
-    # arguments, it returns the file id that will be used in other calls to
-    # the API (i.e. Creating content)
+    # Reads the grades of a column into the matrix, returns False if they could
+    # not all be read.
+    def _fill_column(self, j: int):
+        pager = self.reqs.Bb_GET_iter(
+            self.base_url,
+            self.grades_endpoint.format(course=self.course_id, column=self.column_ids[j]),
+            self.token, {'fields': f'userId,{self.value}'}, pages=True)
+        width = len(self.column_ids)
+        unknown = 0
+        for page in pager:
+            rows = []
+            numbers = []
+            for grade in page:
+                row = self.user_index.get(grade.get('userId'))
+                if row is None:
+                    unknown += 1
+                    continue
+                rows.append(row)
+                numbers.append(self._number(grade))
+            if self.use_numpy:
+                self.values[rows, j] = numbers
+            else:
+                for row, number in zip(rows, numbers):
+                    self.values[row * width + j] = number
+        with self._lock:
+            self.unknown_grades += unknown
+        return pager.finished
 
-    def Bb_POST_file(self, base_url: str, token: str, file_path: str):
-        self.base_url = base_url
-        self.file_path = file_path
-        self.token = token
-        self.headers = {
-            "Authorization": f'Bearer {self.token}'
-        }
-        self.uploads_url = f'{self.base_url}/learn/api/public/v1/uploads'
-        self.files = {
-            'file': open(file_path, 'rb')
-        }
-        try:
-            r = requests.request(
-                'POST',
-                self.uploads_url,
-                files=self.files,
-                headers=self.headers)
-            r.raise_for_status()
-            data = json.loads(r.text)
-            logger.info(
-                'File uploaded to temporary storage, returning id')
-            logger.info("GET Request completed")
-            logger.info(f'API limit: {r.headers["X-Rate-Limit-Limit"]}')
-            logger.info(
-                f'Remaining API calls: {r.headers["X-Rate-Limit-Remaining"]}')
-            logger.info(
-                f'Time to reset API limit: {r.headers["X-Rate-Limit-reset"]}')
-            return data['id']
-        except requests.exceptions.HTTPError as e:
-            data = json.loads(r.text)
-            logger.error(data["message"])
+    # Reads the gradebook of the course, returns self or None if the columns or
+    # the memberships could not be read.
+    def fetch(self):
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            columns = pool.submit(
+                self.reqs.Bb_GET, self.base_url,
+                self.columns_endpoint.format(course=self.course_id), self.token)
+            members = pool.submit(
+                self.reqs.Bb_GET_records, self.base_url,
+                self.memberships_endpoint.format(course=self.course_id), self.token,
+                ['userId', 'courseRoleId'], {}, True)
+            columns, members = columns.result(), members.result()
+            if columns is None or members is None:
+                logger.error(f'Gradebook of {self.course_id} could not be read')
+                return None
+            self.columns = columns
+            self.column_ids = [column['id'] for column in columns]
+            self.column_index = {column_id: j for j, column_id in enumerate(self.column_ids)}
+            self.user_ids = [
+                user_id for user_id, role in zip(members.column('userId'), members.column('courseRoleId'))
+                if self.roles is None or role in self.roles]
+            self.user_index = {user_id: i for i, user_id in enumerate(self.user_ids)}
+            shape = (len(self.user_ids), len(self.column_ids))
+            if self.use_numpy:
+                self.values = numpy.full(shape, numpy.nan)
+            else:
+                self.values = array.array('d', [math.nan]) * (shape[0] * shape[1])
+            for column_id, finished in zip(self.column_ids, pool.map(self._fill_column, range(shape[1]))):
+                if not finished:
+                    self.errors.append(column_id)
+        logger.info(
+            f'Gradebook of {self.course_id} read, {shape[0]} users, {shape[1]} columns, '
+            f'{len(self.errors)} columns failed')
+        return self
 
-    # PATCH request. It takes a PATCH endpoint from the API, the authentication token,
-    # a list of parameters, and a json payload as arguments. A PATCH requests allows
-    # to update a record partially.
+    # Returns the grades of a row as a list, NaN where there is no grade.
+    def row(self, i: int):
+        if self.use_numpy:
+            return self.values[i].tolist()
+        width = len(self.column_ids)
+        return self.values[i * width:(i + 1) * width].tolist()
 
-    def Bb_PATCH(
-            self,
-            base_url: str,
-            endpoint: str,
-            token: str,
-            payload: dict,
-            params: dict = {}):
-        self.base_url = base_url
-        self.endpoint = endpoint
-        self.token = token
-        self.params = params
-        self.payload = payload
-        self.request_url = f'{self.base_url}{self.endpoint}'
-        self.headers = {
-            'Authorization': f'Bearer {self.token}',
-            'Content-Type': "Application/json"
+    # Returns the grade of a user in a column, NaN if there is none.
+    def grade(self, user_id: str, column_id: str):
+        i, j = self.user_index[user_id], self.column_index[column_id]
+        if self.use_numpy:
+            return float(self.values[i, j])
+        return self.values[i * len(self.column_ids) + j]
+
+    # Returns the column headers, the column names (made unique with their id
+    # when repeated) or, with header 'id', the column ids.
+    def _headers(self, header: str):
+        if header == 'id':
+            return list(self.column_ids)
+        names = [column.get('name', column['id']) for column in self.columns]
+        repeated = {name for name in names if names.count(name) > 1}
+        return [f'{name} ({column_id})' if name in repeated else name
+                for name, column_id in zip(names, self.column_ids)]
+
+    # Writes the matrix to a csv file, a userId column and one column per
+    # gradebook column, empty where there is no grade.
+    def write_csv(self, path: str, header: str = 'name', delimiter: str = ','):
+        with open(path, 'w', newline='') as csvfile:
+            writer = csv.writer(csvfile, delimiter=delimiter)
+            writer.writerow(['userId'] + self._headers(header))
+            for i, user_id in enumerate(self.user_ids):
+                writer.writerow([user_id] + ['' if math.isnan(v) else v for v in self.row(i)])
+        logger.info(f'Gradebook of {self.course_id} written to {path}')
+
+    # Writes the matrix to a Parquet file, in row groups of row_group_size users,
+    # with nulls where there is no grade.
+    def write_parquet(self, path: str, header: str = 'name', row_group_size: int = 10000):
+        if pyarrow is None:
+            raise ImportError('pyarrow is not installed, install it with "pip install pyarrow"')
+        schema = pyarrow.schema(
+            [('userId', pyarrow.string())] +
+            [(name, pyarrow.float64()) for name in self._headers(header)])
+        width = len(self.column_ids)
+        with pyarrow.parquet.ParquetWriter(path, schema) as writer:
+            for start in range(0, len(self.user_ids), row_group_size):
+                stop = min(start + row_group_size, len(self.user_ids))
+                if self.use_numpy:
+                    block = [self.values[start:stop, j] for j in range(width)]
+                else:
+                    block = [self.values[start * width + j:stop * width:width].tolist() for j in range(width)]
+                arrays = [pyarrow.array(self.user_ids[start:stop], pyarrow.string())]
+                arrays += [pyarrow.array(column, pyarrow.float64(), from_pandas=True) for column in block]
+                writer.write_table(pyarrow.Table.from_arrays(arrays, schema=schema))
+        logger.info(f'Gradebook of {self.course_id} written to {path}')
+
+# Flat_File_Feed
+# Loads records through the Learn SIS Framework snapshot flat file integration
+# instead of one REST call per record, for large loads of users, courses or
+# enrollments. It takes the same payloads given to Bb_POST (or, for memberships,
+# a payload with the courseId and userId external ids and the courseRoleId), turns
+# them into pipe delimited feed rows and sends them in files of batch_size rows, as
+# they are read, to the endpoint of the integration:
+#     {integration_url}/{feed}/{operation}
+# integration_url is the endpoint url shown in the integration settings, i.e.
+# https://learn/webapps/bb-data-integration-flatfile-BB5a998b8c44671/endpoint, and
+# username and password the ones of the integration. feed is person, course or
+# membership and operation store, refresh or delete. The columns are the ones
+# mapped from the keys of the first payload, or the fields given. With compress,
+# files are sent gzip encoded (Content-Encoding: gzip), only use it if the server
+# accepts it. submit() returns the reference code of every file sent, status()
+# reads the data set status of one and wait() polls them until all their records
+# are processed. Requests go through a Bb_Requests, so they share its session,
+# retry policy and metrics.
+# The feed needs the external keys of the data source and, in memberships, of the
+# course and the user, while REST records hold their Learn ids (i.e. _2_1). Values
+# given as externalId:key are written as key. Learn ids are resolved with the
+# Id_Resolver of courses and users given, and data source ids with data_sources (a
+# dict of Learn id: data source key) or, failing that, read from Learn through one
+# of the resolvers. A Learn id that can not be resolved raises a ValueError, it is
+# never written to the feed.
+
+
+class Flat_File_Feed():
+
+    logger = logging.getLogger('Bb_rest_helper')
+    logger.propagate = False
+
+    # Feed column: payload field (nested with a dot), for each feed type.
+    columns = {
+        'person': {
+            'external_person_key': 'externalId',
+            'user_id': 'userName',
+            'passwd': 'password',
+            'firstname': 'name.given',
+            'middlename': 'name.middle',
+            'lastname': 'name.family',
+            'email': 'contact.email',
+            'student_id': 'studentId',
+            'available_ind': 'availability.available',
+            'data_source_key': 'dataSourceId'
+        },
+        'course': {
+            'external_course_key': 'externalId',
+            'course_id': 'courseId',
+            'course_name': 'name',
+            'description': 'description',
+            'available_ind': 'availability.available',
+            'data_source_key': 'dataSourceId'
+        },
+        'membership': {
+            'external_course_key': 'courseId',
+            'external_person_key': 'userId',
+            'role': 'courseRoleId',
+            'available_ind': 'availability.available',
+            'data_source_key': 'dataSourceId'
         }
+    }
+
+    def __init__(
+            self,
+            integration_url: str,
+            username: str,
+            password: str,
+            feed: str = 'person',
+            operation: str = 'store',
+            reqs: Bb_Requests = None,
+            batch_size: int = 5000,
+            compress: bool = False,
+            fields: list = None,
+            courses: Id_Resolver = None,
+            users: Id_Resolver = None,
+            data_sources: dict = None):
+        if feed not in self.columns:
+            raise ValueError(f'Unknown feed {feed}, use one of {", ".join(self.columns)}')
+        self.integration_url = integration_url.rstrip('/')
+        self.username = username
+        self.password = password
+        self.feed = feed
+        self.operation = operation
+        self.reqs = reqs if reqs else Bb_Requests()
+        self.batch_size = batch_size
+        self.compress = compress
+        self.fields = fields
+        self.courses = courses
+        self.users = users
+        self.data_sources = dict(data_sources) if data_sources else {}
+        self.bad_rows = []
+        self.submitted = {}
+
+    # Returns the value of a feed column for a payload, as written in the feed.
+    def _value(self, payload: dict, field: str):
+        value = payload
+        for key in field.split('.'):
+            value = value.get(key) if isinstance(value, dict) else None
+        if value is None:
+            return ''
+        if isinstance(value, bool):
+            return 'Y' if value else 'N'
+        value = str(value)
+        if field == 'availability.available':
+            return {'Yes': 'Y', 'No': 'N', 'Disabled': 'N'}.get(value, value)
+        if field == 'courseRoleId':
+            return re.sub(r'(?<!^)(?=[A-Z])', '_', value).lower()
+        if field == 'dataSourceId' or (field in ('courseId', 'userId') and self.feed == 'membership'):
+            return self._external_key(field, value)
+        return value
+
+    # Returns the external key of a course, user or data source given by its Learn
+    # id, its external key or externalId:key.
+    def _external_key(self, field: str, value: str):
+        if value.startswith('externalId:'):
+            return value[len('externalId:'):]
+        if not re.fullmatch(r'_\d+_\d+', value):
+            return value
+        if field == 'dataSourceId':
+            key = self._data_source_key(value)
+        else:
+            resolver = self.courses if field == 'courseId' else self.users
+            record = resolver.get(value) if resolver is not None else None
+            key = record.get('externalId') if record else None
+        if key is None:
+            raise ValueError(
+                f'{field} {value} is a Learn id and its external key could not be found, '
+                f'give the external key or an Id_Resolver to resolve it')
+        return key
+
+    # Returns the key of a data source given by its Learn id, or None.
+    def _data_source_key(self, data_source_id: str):
+        if data_source_id not in self.data_sources:
+            resolver = self.courses or self.users
+            if resolver is None:
+                return None
+            r = resolver.reqs._request(
+                'GET', f'{resolver.base_url}/learn/api/public/v1/dataSources/{data_source_id}',
+                headers=resolver.reqs._headers(resolver.token), params={'fields': 'externalId'})
+            if not r.ok:
+                return None
+            self.data_sources[data_source_id] = resolver.reqs.codec.loads(r.content).get('externalId')
+        return self.data_sources[data_source_id]
+
+    # Returns the feed columns used for a payload.
+    def _columns(self, payload: dict):
+        if self.fields:
+            return list(self.fields)
+        return [column for column, field in self.columns[self.feed].items()
+                if self._value(payload, field) != '']
+
+    # Yields the feed files, as lists of rows, header first. Payloads that can not
+    # be written in a feed (a value with | or a line break) are skipped and their
+    # index added to bad_rows.
+    def files(self, payloads):
+        mapping = self.columns[self.feed]
+        header = None
+        rows = []
+        for index, payload in enumerate(payloads):
+            if header is None:
+                header = self._columns(payload)
+            values = [self._value(payload, mapping[column]) for column in header]
+            if any('|' in v or '\n' in v or '\r' in v for v in values):
+                self.bad_rows.append(index)
+                continue
+            rows.append('|'.join(values))
+            if len(rows) >= self.batch_size:
+                yield ['|'.join(header)] + rows
+                rows = []
+        if rows:
+            yield ['|'.join(header)] + rows
+
+    # Sends a feed file, returns its reference code or None.
+    def _send(self, rows: list):
+        body = ('\n'.join(rows) + '\n').encode('utf-8')
+        headers = {'Content-Type': 'text/plain; charset=utf-8'}
+        if self.compress:
+            body = gzip.compress(body, 6)
+            headers['Content-Encoding'] = 'gzip'
+        r = self.reqs._request(
+            'POST', f'{self.integration_url}/{self.feed}/{self.operation}',
+            idempotent=True, data=body, headers=headers, auth=(self.username, self.password))
+        match = re.search(r'reference code\s+([0-9A-Za-z-]+)', r.text)
+        if not r.ok or not match:
+            logger.error(f'Feed file not accepted ({r.status_code}): {r.text[:200]}')
+            return None
+        return match.group(1)
+
+    # Sends the payloads in feed files and returns the list of their reference
+    # codes (None for a file that was not accepted).
+    def submit(self, payloads):
+        references = []
+        for rows in self.files(payloads):
+            reference = self._send(rows)
+            if reference is not None:
+                self.submitted[reference] = len(rows) - 1
+            references.append(reference)
+            logger.info(f'{self.feed} feed file of {len(rows) - 1} rows sent, reference code {reference}')
+        if self.bad_rows:
+            logger.warning(f'{len(self.bad_rows)} payloads could not be written to the feed')
+        return references
+
+    # Returns the data set status of a reference code as a dict, with the
+    # completedCount, errorCount, warningCount and queuedCount counts, or None.
+    def status(self, reference: str):
+        # Not through the response cache, the status changes between polls.
+        r = self.reqs._retried(
+            'GET', f'{self.integration_url}/dataSetStatus/{reference}',
+            auth=(self.username, self.password))
         try:
-            r = requests.request(
-                'PATCH',
-                self.request_url,
-                headers=self.headers,
-                params=self.params,
-                json=self.payload)
-            data = json.loads(r.text)
             r.raise_for_status()
-            logger.info(f'API limit: {r.headers["X-Rate-Limit-Limit"]}')
-            logger.info(
-                f'Remaining API calls: {r.headers["X-Rate-Limit-Remaining"]}')
-            logger.info(
-                f'Time to reset API limit: {r.headers["X-Rate-Limit-reset"]}')
-            logger.info("PATCH Request completed")
-            return data
-        except requests.exceptions.HTTPError as e:
-            data = json.loads(r.text)
-            logger.error(data["message"])
+            root = ElementTree.fromstring(r.content)
+        except (requests.exceptions.HTTPError, ElementTree.ParseError):
+            logger.error(f'Data set status of {reference} could not be read ({r.status_code})')
+            return None
+        status = {child.tag: child.text for child in root}
+        for key, value in status.items():
+            if key.endswith('Count') and value is not None:
+                status[key] = int(value)
+        return status
 
-    # PUT request. It takes a PUT endpoint from the API, the authentication token,
-    # a list of parameters, and a json payload as arguments. A PUT request is meant
-    # to update a record entirely.
-    def Bb_PUT(
+    # Returns True if all the records of a data set have been processed.
+    def _processed(self, reference: str, status: dict):
+        done = status.get('completedCount', 0) + status.get('errorCount', 0)
+        return status.get('queuedCount', 0) == 0 and done >= self.submitted.get(reference, 0)
+
+    # Polls the status of the reference codes every poll_interval seconds until all
+    # of them are processed or timeout seconds have passed. Returns the last status
+    # of each one.
+    def wait(self, references: list, poll_interval: float = 10, timeout: float = 3600):
+        statuses = {}
+        pending = [reference for reference in references if reference is not None]
+        deadline = time.monotonic() + timeout
+        while pending:
+            for reference in list(pending):
+                status = self.status(reference)
+                if status is not None:
+                    statuses[reference] = status
+                    if self._processed(reference, status):
+                        pending.remove(reference)
+            if not pending or time.monotonic() + poll_interval > deadline:
+                break
+            time.sleep(poll_interval)
+        if pending:
+            logger.warning(f'{len(pending)} data sets still queued after {timeout} seconds')
+        errors = sum(s.get('errorCount', 0) for s in statuses.values())
+        logger.info(f'{len(statuses) - len(pending)} data sets processed, {errors} errors')
+        return statuses
+
+# Bb_Tenant
+# Everything needed to call one Learn instance: a pooled Bb_Session, a Rate_Limiter,
+# a Retry_Policy, an Auth_Helper and a Token_Manager, and a Bb_Requests using them.
+# The token is only requested on first use. Pass tenant.token as the token of any
+# Bb_Requests method, i.e. tenant.reqs.Bb_GET(tenant.url, endpoint, tenant.token).
+# Usually created by a Tenant_Registry.
+
+
+class Bb_Tenant():
+
+    logger = logging.getLogger('Bb_rest_helper')
+    logger.propagate = False
+
+    def __init__(
             self,
-            base_url: str,
-            endpoint: str,
-            token: str,
-            payload: dict,
-            params: dict = {}):
-        self.base_url = base_url
-        self.endpoint = endpoint
-        self.token = token
-        self.params = params
-        self.payload = payload
-        self.request_url = f'{self.base_url}{self.endpoint}'
-        self.headers = {
-            'Authorization': f'Bearer {self.token}',
-            'Content-Type': "Application/json"
-        }
+            name: str,
+            url: str,
+            key: str,
+            secret: str,
+            pool_maxsize: int = 10,
+            timeout=None,
+            throttle_below: float = 0.2,
+            max_attempts: int = 3,
+            skew: int = 60,
+            background: bool = True,
+            metrics: Metrics_Collector = None):
+        self.name = name
+        self.url = url.rstrip('/')
+        self.session = Bb_Session(pool_connections=1, pool_maxsize=pool_maxsize, timeout=timeout)
+        self.rate_limiter = Rate_Limiter(throttle_below=throttle_below)
+        self.retry_policy = Retry_Policy(max_attempts=max_attempts)
+        self.auth = Auth_Helper(self.url, key, secret, self.session, self.retry_policy, metrics)
+        self.token = Token_Manager(self.auth, skew, background)
+        self.reqs = Bb_Requests(
+            self.session, self.rate_limiter, self.retry_policy, metrics=metrics)
+
+    # Returns the current token of the tenant as a string.
+    def get_token(self):
+        return self.token.get_token()
+
+    def close(self):
+        self.token.stop()
+        self.session.close()
+
+# Tenant_Registry
+# Keeps a Bb_Tenant for each of many Learn instances, to work with all of them from
+# a single process. Tenants are loaded from:
+#  - a json file, either a Get_Config file (the tenant is named after the file),
+#    a list of {"name", "url", "key", "secret"} or a dict of name: {"url", "key", "secret"}.
+#  - a directory, every json file in it as above.
+#  - environment variables, <prefix><NAME>_URL, <prefix><NAME>_KEY and
+#    <prefix><NAME>_SECRET (i.e. BB_UNIV1_URL), the tenant is named name in lower case.
+# source, if given, is loaded as a file or a directory. Other keyword arguments are
+# passed to every Bb_Tenant (pool size, timeout, rate limit threshold...).
+# run() spreads jobs of many tenants over a thread pool fairly: tenants take turns
+# to start a job and each one has at most max_per_tenant jobs running, so a slow or
+# throttled tenant can not take all the workers while the others wait.
+
+
+class Tenant_Registry():
+
+    logger = logging.getLogger('Bb_rest_helper')
+    logger.propagate = False
+
+    def __init__(self, source: str = None, **tenant_args):
+        self.tenant_args = tenant_args
+        self.tenants = {}
+        if source is not None:
+            if os.path.isdir(source):
+                self.load_dir(source)
+            else:
+                self.load_file(source)
+
+    def __getitem__(self, name: str):
+        return self.tenants[name]
+
+    def __contains__(self, name: str):
+        return name in self.tenants
+
+    def __iter__(self):
+        return iter(self.tenants.values())
+
+    def __len__(self):
+        return len(self.tenants)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def names(self):
+        return list(self.tenants)
+
+    # Adds a tenant, replacing any tenant with the same name.
+    def add(self, name: str, url: str, key: str, secret: str):
+        if name in self.tenants:
+            self.tenants[name].close()
+        tenant = self.tenants[name] = Bb_Tenant(name, url, key, secret, **self.tenant_args)
+        return tenant
+
+    # Adds a tenant from a configuration dict, logs an error if a value is missing.
+    def _add_config(self, name: str, config: dict):
+        missing = [k for k in ('url', 'key', 'secret') if not config.get(k)]
+        if missing or not name:
+            logger.error(f'Tenant {name} skipped, missing {", ".join(missing) or "name"}')
+            return
+        self.add(name, config['url'], config['key'], config['secret'])
+
+    # Loads the tenants of a json file, returns the number of tenants loaded.
+    def load_file(self, file_path: str):
+        before = len(self.tenants)
         try:
-            r = requests.request(
-                'PUT',
-                self.request_url,
-                headers=self.headers,
-                params=self.params,
-                json=self.payload)
-            data = json.loads(r.text)
-            r.raise_for_status()
-            logger.info(f'API limit: {r.headers["X-Rate-Limit-Limit"]}')
-            logger.info(
-                f'Remaining API calls: {r.headers["X-Rate-Limit-Remaining"]}')
-            logger.info(
-                f'Time to reset API limit: {r.headers["X-Rate-Limit-reset"]}')
-            logger.info("PUT Request completed")
-            return data
-        except requests.exceptions.HTTPError as e:
-            data = json.loads(r.text)
-            logger.error(data["message"])
-        except json.decoder.JSONDecodeError as e:
-            pass
-                
-    # DELETE request. It takes a DELETE endpoint from the API, the authentication token
-    # and a list of parameters as arguments.
-    def Bb_DELETE(
+            with open(file_path) as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f'Tenants file {file_path} could not be read: {e}')
+            return 0
+        if isinstance(data, list):
+            for config in data:
+                self._add_config(config.get('name'), config)
+        elif 'url' in data:
+            self._add_config(os.path.splitext(os.path.basename(file_path))[0], data)
+        else:
+            for name, config in data.items():
+                self._add_config(name, config)
+        logger.info(f'{len(self.tenants) - before} tenants loaded from {file_path}')
+        return len(self.tenants) - before
+
+    # Loads the tenants of every json file in a directory.
+    def load_dir(self, dir_path: str):
+        return sum(self.load_file(os.path.join(dir_path, name))
+                   for name in sorted(os.listdir(dir_path)) if name.endswith('.json'))
+
+    # Loads the tenants set in environment variables.
+    def load_env(self, prefix: str = 'BB_'):
+        configs = collections.defaultdict(dict)
+        pattern = re.compile(f'^{re.escape(prefix)}(.+)_(URL|KEY|SECRET)$')
+        for variable, value in os.environ.items():
+            match = pattern.match(variable)
+            if match:
+                configs[match.group(1).lower()][match.group(2).lower()] = value
+        for name, config in sorted(configs.items()):
+            self._add_config(name, config)
+        return len(configs)
+
+    # Runs jobs for many tenants, work maps the tenant names to an iterable of
+    # functions, each one called with the Bb_Tenant. Yields a dict with the tenant
+    # name, the index of the job for that tenant, its result and the error raised,
+    # if any, as jobs complete. Jobs are read lazily.
+    def run(self, work: dict, max_workers: int = 8, max_per_tenant: int = 2):
+        # Checked here, not in the generator, so bad values fail on the call.
+        if max_workers < 1 or max_per_tenant < 1:
+            raise ValueError('max_workers and max_per_tenant must be at least 1')
+        return self._run(work, max_workers, max_per_tenant)
+
+    def _run(self, work: dict, max_workers: int, max_per_tenant: int):
+        end = object()
+        jobs = {name: enumerate(work[name]) for name in work if name in self.tenants}
+        for name in work:
+            if name not in self.tenants:
+                logger.error(f'Unknown tenant {name}, its jobs are skipped')
+        turns = collections.deque(jobs)
+        running = collections.Counter()
+        futures = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            while turns or futures:
+                waiting = 0
+                while turns and len(futures) < max_workers and waiting < len(turns):
+                    name = turns[0]
+                    turns.rotate(-1)
+                    if running[name] >= max_per_tenant:
+                        waiting += 1
+                        continue
+                    job = next(jobs[name], end)
+                    if job is end:
+                        turns.remove(name)
+                        continue
+                    waiting = 0
+                    index, function = job
+                    running[name] += 1
+                    futures[pool.submit(function, self.tenants[name])] = (name, index)
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name, index = futures.pop(future)
+                    running[name] -= 1
+                    error = future.exception()
+                    yield {
+                        'tenant': name,
+                        'index': index,
+                        'result': None if error else future.result(),
+                        'error': str(error) or type(error).__name__ if error else None
+                    }
+
+    def close(self):
+        for tenant in self.tenants.values():
+            tenant.close()
+
+# Date_Converter
+# Converts dates in DD/MM/YYYY, DD/MM/YYYY HH:MM or DD/MM/YYYY HH:MM:SS format (i.e.
+# exported from a spreadsheet) to the Learn format YYYY-MM-DDTHH:MM:SS.000Z, the
+# delimiters can be changed. Dates are parsed with a precompiled regular expression
+# and the result of the last cache_size distinct values is kept, as imports repeat
+# the same due dates many times. convert() converts a single value and returns None
+# if it is not a valid date. convert_column() takes a list, an iterator or a NumPy
+# array and returns the converted column (None in the bad rows) and the list of the
+# indices of the bad rows, so a file can be checked in one pass. NumPy arrays (or
+# any column, with use_numpy=True) are reduced to their distinct values with NumPy
+# first, so each one is parsed once and the results are spread back in C, and a
+# NumPy array is returned. use_numpy=False always converts them row by row.
+
+
+class Date_Converter():
+
+    logger = logging.getLogger('Bb_rest_helper')
+    logger.propagate = False
+
+    def __init__(
             self,
-            base_url: str,
-            endpoint: str,
-            token: str,
-            params: dict = {}):
-        self.base_url = base_url
-        self.endpoint = endpoint
-        self.token = token
-        self.params = params
-        self.request_url = f'{self.base_url}{self.endpoint}'
-        self.headers = {
-            'Authorization': f'Bearer {self.token}',
-            'Content-Type': "Application/json"
-        }
+            date_delimiter: str = '/',
+            hour_delimiter: str = ':',
+            cache_size: int = 65536,
+            use_numpy: bool = None):
+        d, h = re.escape(date_delimiter), re.escape(hour_delimiter)
+        self.pattern = re.compile(
+            rf'\s*(\d{{1,2}}){d}(\d{{1,2}}){d}(\d{{4}})(?:\s+(\d{{1,2}}){h}(\d{{1,2}})(?:{h}(\d{{1,2}}))?)?\s*')
+        self.cache_size = cache_size
+        self.use_numpy = use_numpy
+        if use_numpy and numpy is None:
+            raise ImportError('NumPy is not installed, install it with "pip install numpy"')
+        self.cache = {}
+
+    # Returns a date in the Learn format, or None if it is not valid.
+    def convert(self, value):
         try:
-            r = requests.request(
-                'DELETE',
-                self.request_url,
-                headers=self.headers,
-                params=self.params)
-            # A successful DELETE request returns a 204 code meaning that the server has
-            # fulfilled the request but that there is no content to return.
-            r.raise_for_status()
-            logger.info(f'API limit: {r.headers["X-Rate-Limit-Limit"]}')
-            logger.info(
-                f'Remaining API calls: {r.headers["X-Rate-Limit-Remaining"]}')
-            logger.info(
-                f'Time to reset API limit: {r.headers["X-Rate-Limit-reset"]}')
-            logger.info("DELETE Request completed")
+            return self.cache[value]
         except KeyError:
-            # Collaborate does not provide rate limit information, so just
-            # logging the request status and returning the data
-            logger.info("DELETE Request completed")
-        except requests.exceptions.HTTPError as e:
-            logger.error('The resource could not be deleted')
+            pass
+        except TypeError:
+            return None
+        match = self.pattern.fullmatch(value) if isinstance(value, str) else None
+        result = None
+        if match:
+            day, month, year, hour, minute, second = match.groups()
+            try:
+                moment = datetime.datetime(
+                    int(year), int(month), int(day), int(hour or 0), int(minute or 0), int(second or 0))
+                result = moment.strftime('%Y-%m-%dT%H:%M:%S.000Z')
+            except ValueError:
+                pass
+        if len(self.cache) >= self.cache_size:
+            self.cache.clear()
+        self.cache[value] = result
+        return result
+
+    # Converts a column of dates, returns the converted column and the indices of
+    # the rows that are not valid dates.
+    def convert_column(self, values):
+        if numpy is not None and (self.use_numpy or self.use_numpy is None and isinstance(values, numpy.ndarray)):
+            values = numpy.asarray(values if hasattr(values, '__len__') else list(values)).ravel()
+            if values.dtype.kind != 'U':
+                values = values.astype(str)
+            unique, inverse = numpy.unique(values, return_inverse=True)
+            results = [self.convert(v) for v in unique.tolist()]
+            bad = numpy.array([i for i, r in enumerate(results) if r is None], dtype=numpy.intp)
+            converted = numpy.array(results, dtype=object)[inverse]
+            return converted, numpy.flatnonzero(numpy.isin(inverse, bad)).tolist()
+        convert = self.convert
+        converted = [convert(v) for v in values]
+        return converted, [i for i, v in enumerate(converted) if v is None]
+
+# Handler, queue listener and arguments of the logging set by Bb_Utils.set_logging.
+_log_setup = {}
+
+
+# Removes the logging set by Bb_Utils.set_logging, if any.
+def _stop_logging():
+    listener = _log_setup.pop('listener', None)
+    if listener is not None:
+        listener.stop()
+    handler = _log_setup.pop('handler', None)
+    if handler is not None:
+        logger.removeHandler(handler)
+        _log_setup.pop('file_handler').close()
+    _log_setup.pop('config', None)
+
+
+atexit.register(_stop_logging)
 
 # A set of convenience functions (logging, printing, checking courses...),
 # this will be extended over time.
@@ -418,40 +3919,72 @@ class Bb_Utils():
     logger = logging.getLogger('Bb_rest_helper')
     logger.propagate = False
 
+    # Optionally takes a Bb_Requests instance, used by the methods that call the
+    # API, so they share its pooled session. One is created on first use otherwise.
+    def __init__(self, reqs: Bb_Requests = None):
+        self.reqs = reqs
+        self.date_converters = {}
+        self._lock = threading.Lock()
+
+    # Returns the Bb_Requests instance used by the methods in this class.
+    def _get_reqs(self):
+        with self._lock:
+            if self.reqs is None:
+                self.reqs = Bb_Requests()
+            return self.reqs
+
     # Sets logging with default path to ./logs and default level of DEBUG.
-    def set_logging(self, path: str = './logs', level=logging.DEBUG, when='h', interval=1):
+    # Calling it again replaces the handler set before, so handlers are never
+    # duplicated, and does nothing if the arguments are the same. With queued=True
+    # messages are built on the calling thread and written to the file by a
+    # background thread, through a QueueHandler and a QueueListener, and
+    # stop_logging() (also called at exit) writes the pending ones. rate_limit_interval
+    # logs the rate limit headers at most once every that many seconds instead of
+    # after every call (see Rate_Limit_Log).
+    def set_logging(
+            self,
+            path: str = './logs',
+            level=logging.DEBUG,
+            when='h',
+            interval=1,
+            queued: bool = False,
+            rate_limit_interval: float = None):
         self.path = path
         self.level = level
         self.when = when
         self.interval = interval
-        try:
-            os.mkdir(self.path, 0o777)
-            logger = logging.getLogger('Bb_rest_helper')
-            logger.propagate = False
-            logger.setLevel(self.level)
-            handler = TimedRotatingFileHandler(f'{self.path}/Bb_rest_helper_log',
-                                               when=self.when,
-                                               interval=self.interval,
-                                               backupCount=5)
-            formatter = logging.Formatter(
-                '%(asctime)-15s %(name)-22s %(funcName)-15s %(levelname)-8s %(message)s')
-            handler.setFormatter(formatter)
-            logger.addHandler(handler)
+        logger = logging.getLogger('Bb_rest_helper')
+        logger.propagate = False
+        logger.setLevel(self.level)
+        rate_limit_log.interval = rate_limit_interval
+        config = (os.path.abspath(self.path), self.when, self.interval, queued)
+        if _log_setup.get('config') == config:
+            return
+        _stop_logging()
+        created = not os.path.isdir(self.path)
+        os.makedirs(self.path, 0o777, exist_ok=True)
+        file_handler = TimedRotatingFileHandler(f'{self.path}/Bb_rest_helper_log',
+                                                when=self.when,
+                                                interval=self.interval,
+                                                backupCount=5)
+        formatter = logging.Formatter(
+            '%(asctime)-15s %(name)-22s %(funcName)-15s %(levelname)-8s %(message)s')
+        file_handler.setFormatter(formatter)
+        handler = file_handler
+        if queued:
+            records = queue.SimpleQueue()
+            handler = QueueHandler(records)
+            _log_setup['listener'] = QueueListener(records, file_handler)
+            _log_setup['listener'].start()
+        _log_setup.update(config=config, handler=handler, file_handler=file_handler)
+        logger.addHandler(handler)
+        if created:
             logger.info('Logs folder created')
-            logger.info('Logging has been set up')
-        except FileExistsError:
-            logger = logging.getLogger('Bb_rest_helper')
-            logger.propagate = False
-            logger.setLevel(self.level)
-            handler = TimedRotatingFileHandler(f'{self.path}/Bb_rest_helper_log',
-                                               when=self.when,
-                                               interval=self.interval,
-                                               backupCount=5)
-            formatter = logging.Formatter(
-                '%(asctime)-15s %(name)-22s %(funcName)-15s %(levelname)-8s %(message)s')
-            handler.setFormatter(formatter)
-            logger.addHandler(handler)
-            logger.info('Logging has been set up')
+        logger.info('Logging has been set up')
+
+    # Removes the handler set by set_logging, writing the records still queued.
+    def stop_logging(self):
+        _stop_logging()
 
     # Prints the response from any of the above methods in a prettified format
     # to the console.
@@ -465,17 +3998,21 @@ class Bb_Utils():
             logger.warning("No data to print.")
 
     # Checks if a given Learn course exists in the server. Takes the external course id as an argument
-    def check_course_id(self,url:str, token: str, external_course_id: str):
-        self.url = url
-        self.token = token
-        self.external_course_id = external_course_id
-        self.reqs = Bb_Requests()
-        self.endpoint_courses = "/learn/api/public/v3/courses"
-        self.params = {
-            "externalId": self.external_course_id,
+    # Optionally takes an Id_Resolver of courses, that answers from its index.
+    # Uses local variables only, so threads can share a Bb_Utils.
+    def check_course_id(self,url:str, token: str, external_course_id: str, resolver: Id_Resolver = None):
+        if resolver is not None:
+            if resolver.lookup(external_course_id):
+                logger.info('The course has been found in the server.')
+                return True
+            logger.warning('The course could not be found, please check that the provided course id is the external id')
+            return False
+        endpoint_courses = "/learn/api/public/v3/courses"
+        params = {
+            "externalId": external_course_id,
             "fields": "id"
         }
-        data = self.reqs.Bb_GET(self.url, self.endpoint_courses, self.token, self.params)
+        data = self._get_reqs().Bb_GET(url, endpoint_courses, token, params)
         print(data)
         if data:
             logger.info('The course has been found in the server.')
@@ -493,6 +4030,7 @@ class Bb_Utils():
     # DD/MM/YYYY HH:MM:SS
     # optional arguments for date delimiter (default "/") and hour delimiter (default ":")
     # can be provided. The outcome of the method is YYYY-MM-DDTHH:MM:SS:000Z
+    # Bad dates raise a ValueError. To convert a whole column use time_format_column.
     def time_format(
             self,
             dt: str,
@@ -501,50 +4039,63 @@ class Bb_Utils():
         self.dt = dt
         self.date_delimiter = date_delimiter
         self.hour_delimiter = hour_delimiter
-        if len(self.dt) < 11:
-            split_date = dt.split(self.date_delimiter)
-            date_formatted = datetime.datetime(int(split_date[2]), int(split_date[1]), int(
-                split_date[0])).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
-            return date_formatted
-        elif len(self.dt) > 11 and len(self.dt) < 17:
-            split_date = self.dt.split(self.date_delimiter)
-            split_year = split_date[2].split()
-            split_hour = split_year[1].split(self.hour_delimiter)
-            date_formatted = datetime.datetime(int(split_year[0]), int(split_date[1]), int(split_date[0]), int(
-                split_hour[0]), int(split_hour[1])).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
-            return date_formatted
-        else:
-            split_date = self.dt.split(self.date_delimiter)
-            split_year = split_date[2].split()
-            split_hour = split_year[1].split(self.hour_delimiter)
-            date_formatted = datetime.datetime(int(split_year[0]), int(split_date[1]), int(split_date[0]), int(
-                split_hour[0]), int(split_hour[1]), int(split_hour[2])).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
-            return date_formatted
+        date_formatted = self._date_converter(
+            self.date_delimiter, self.hour_delimiter).convert(self.dt)
+        if date_formatted is None:
+            raise ValueError(f'{dt} is not a valid DD/MM/YYYY [HH:MM[:SS]] date')
+        return date_formatted
+
+    # Converts a column of dates (a list, an iterator or a NumPy array) in the same
+    # formats as time_format. Returns the converted column, with None in the rows
+    # that are not valid dates, and the list of the indices of those rows (see
+    # Date_Converter).
+    def time_format_column(
+            self,
+            dates,
+            date_delimiter: str = "/",
+            hour_delimiter: str = ":"):
+        converted, bad_rows = self._date_converter(
+            date_delimiter, hour_delimiter).convert_column(dates)
+        if bad_rows:
+            logger.warning(f'{len(bad_rows)} dates could not be converted, first at row {bad_rows[0]}')
+        return converted, bad_rows
+
+    # Returns the Date_Converter for some delimiters, kept between calls.
+    def _date_converter(self, date_delimiter: str, hour_delimiter: str):
+        key = (date_delimiter, hour_delimiter)
+        if key not in self.date_converters:
+            self.date_converters[key] = Date_Converter(date_delimiter, hour_delimiter)
+        return self.date_converters[key]
 
     # This method is used to get the external id of a learn course as an argument and return
     # another field in the get response (usually the course id). We found it is a common operation,
     # particularly when getting a list of
-    # courses in a CSV
+    # courses in a CSV. Optionally takes an Id_Resolver of courses, that answers from its
+    # index when final_id is one of the fields it keeps (id, externalId, courseId, uuid).
+    # Uses local variables only, so threads can share a Bb_Utils.
     def learn_convert_external_id(
             self,
             url: str,
             token: str,
             external_id: str,
-            final_id: str = "id"):
-        self.url = url
-        self.token = token
-        self.external_id = external_id
-        self.final_id = final_id
-        self.reqs = Bb_Requests()
-        self.endpoint_courses = '/learn/api/public/v3/courses'
-        self.params = {
-            "externalId": self.external_id,
-            "fields": self.final_id
+            final_id: str = "id",
+            resolver: Id_Resolver = None):
+        if resolver is not None and final_id in resolver.fields:
+            record = resolver.lookup(external_id)
+            if record is not None:
+                logger.info("Course externalId converted to course Id")
+                return record[final_id]
+            logger.warning("The course could not be found")
+            return None
+        endpoint_courses = '/learn/api/public/v3/courses'
+        params = {
+            "externalId": external_id,
+            "fields": final_id
         }
-        self.data = self.reqs.Bb_GET(self.url,self.endpoint_courses,self.token, self.params)
-        if len(self.data) == 1:
+        data = self._get_reqs().Bb_GET(url, endpoint_courses, token, params)
+        if data and len(data) == 1:
             logger.info("Course externalId converted to course Id")
-            return self.data[0][self.final_id]
+            return data[0][final_id]
         else:
             logger.warning( "Several results have been found, please use a more specific Id")
 
@@ -561,7 +4112,8 @@ class Bb_Utils():
         self.url = self.conf.get_url()
         self.key = self.conf.get_key()
         self.secret = self.conf.get_secret()
-        self.auth = Auth_Helper(self.url, self.key, self.secret)
+        self.auth = Auth_Helper(
+            self.url, self.key, self.secret, self._get_reqs().session)
         if self.platform == "Learn":
             self.token = self.auth.learn_auth()
             data = {
@@ -601,6 +4153,40 @@ class Bb_Utils():
         except FileNotFoundError:
             logger.error("File not found")
     
+    # Streaming version of read_csv. Yields the rows of the file one by one as they
+    # are read, or lists of chunk_size rows if chunk_size is given, so memory use
+    # does not depend on the size of the file. types optionally maps column names to
+    # a function used to convert its values (i.e. {'score': float}), values that can
+    # not be converted are kept as read and a warning is logged.
+    def iter_csv(self, path, delimiter=',', chunk_size: int = None, types: dict = None):
+        try:
+            csvfile = open(path, 'r', newline='')
+        except FileNotFoundError:
+            logger.error("File not found")
+            return
+        with csvfile:
+            reader = csv.DictReader(csvfile, delimiter=delimiter)
+            chunk = []
+            for row in reader:
+                if types:
+                    for column, convert in types.items():
+                        try:
+                            row[column] = convert(row[column])
+                        except (KeyError, TypeError, ValueError):
+                            logger.warning(
+                                f'Line {reader.line_num}: {column} could not be converted')
+                if chunk_size is None:
+                    yield row
+                    continue
+                chunk.append(row)
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = []
+            if chunk:
+                yield chunk
+
+    # Writes a row (dict) to a csv file, writing the header first if the file does not exist.
+    # Opens the file for every row, use Csv_Writer to write many rows.
     def write_csv(self,path, headers, data, delimiter=','):
         self.path = path
         self.headers= headers
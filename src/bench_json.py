@@ -0,0 +1,107 @@
+# bench_json
+# Microbenchmark of the JSON codecs available to Bb_rest_helper. It parses and
+# serializes Learn result pages with every installed codec (json, ujson, orjson)
+# and prints the pages per second of each one.
+# The pages are the json files given as arguments (i.e. responses saved from a
+# Bb_GET to /learn/api/public/v2/courses/{courseId}/gradebook/columns), or a
+# synthetic page of gradebook grades and one of users otherwise.
+# Usage: python bench_json.py [page.json ...] [--repeat 200]
+
+import argparse
+import time
+
+from Bb_rest_helper import Json_Codec
+
+
+# Builds a synthetic gradebook grades page with the given number of records.
+def grades_page(records: int = 100):
+    return {
+        'results': [{
+            'userId': f'_{1000 + i}_1',
+            'columnId': '_55_1',
+            'status': 'Graded',
+            'displayGrade': {'scaleType': 'Score', 'score': 85.0 + i % 15, 'text': 'B'},
+            'text': str(85.0 + i % 15),
+            'score': 85.0 + i % 15,
+            'overridden': '2021-03-18T10:23:55.000Z',
+            'notes': 'Grade imported from the SIS',
+            'feedback': 'Good work, review question 3. ' * 3,
+            'exempt': False,
+            'corrupt': False,
+            'gradeNotationId': '_3_1',
+            'changeIndex': 118 + i
+        } for i in range(records)],
+        'paging': {'nextPage': '/learn/api/public/v2/courses/_5_1/gradebook/columns/_55_1/users?offset=100'}
+    }
+
+
+# Builds a synthetic users page with the given number of records.
+def users_page(records: int = 100):
+    return {
+        'results': [{
+            'id': f'_{1000 + i}_1',
+            'uuid': f'5e2f31c7{i:024x}',
+            'externalId': f'student{i:05d}',
+            'dataSourceId': '_2_1',
+            'userName': f'student{i:05d}',
+            'studentId': f'{20190000 + i}',
+            'educationLevel': 'Freshman',
+            'gender': 'Unknown',
+            'created': '2019-09-02T08:15:21.093Z',
+            'modified': '2021-02-11T12:01:44.512Z',
+            'lastLogin': '2021-03-18T09:12:02.004Z',
+            'institutionRoleIds': ['STUDENT'],
+            'systemRoleIds': ['User'],
+            'availability': {'available': 'Yes'},
+            'name': {'given': 'Jane', 'family': f'Student {i}', 'title': 'Ms'},
+            'contact': {'email': f'student{i:05d}@example.edu'},
+            'locale': {'id': 'en_GB', 'calendar': 'Gregorian', 'firstDayOfWeek': 'Monday'}
+        } for i in range(records)],
+        'paging': {'nextPage': '/learn/api/public/v1/users?offset=100'}
+    }
+
+
+# Returns the pages per second of parse and serialize for a codec and a page.
+def bench(codec: Json_Codec, body: bytes, repeat: int):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        data = codec.loads(body)
+    loads = repeat / (time.perf_counter() - start)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        codec.dumps(data)
+    dumps = repeat / (time.perf_counter() - start)
+    return loads, dumps
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the JSON codecs on Learn pages.')
+    parser.add_argument('pages', nargs='*', help='json files with recorded result pages')
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    fixtures = {}
+    for path in args.pages:
+        with open(path, 'rb') as f:
+            fixtures[path] = f.read()
+    if not fixtures:
+        fixtures['grades (synthetic)'] = Json_Codec('json').dumps(grades_page())
+        fixtures['users (synthetic)'] = Json_Codec('json').dumps(users_page())
+
+    codecs = []
+    for name in ('json', 'ujson', 'orjson'):
+        try:
+            codecs.append(Json_Codec(name))
+        except ImportError:
+            print(f'{name} is not installed, skipped')
+
+    for fixture, body in fixtures.items():
+        print(f'\n{fixture}, {len(body)} bytes')
+        print(f'{"codec":<8}{"loads/s":>12}{"dumps/s":>12}')
+        for codec in codecs:
+            loads, dumps = bench(codec, body, args.repeat)
+            print(f'{codec.name:<8}{loads:>12.0f}{dumps:>12.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+# benchmark
+# Throughput benchmark of Bb_rest_helper against a Mock_Learn_Server, so changes
+# can be measured without calling a real Learn server. The mock server runs in a
+# separate process, with the latency, page size, error rate and rate limit given
+# on the command line, and every scenario reports:
+#  - calls/s: HTTP requests completed per second.
+#  - p50 and p99: latency of those requests, in milliseconds.
+#  - peak MiB: peak memory allocated by Python during the scenario, measured in
+#    an extra run with tracemalloc (so it does not slow the timed runs).
+# Scenarios:
+#  - auth: sequential Auth_Helper.learn_auth calls, each one getting a new token.
+#  - get: Bb_GET of a whole collection, one page after the other.
+#  - get_prefetch: the same with prefetch, pages read concurrently.
+#  - get_records: Bb_GET_records of two fields of the collection.
+#  - get_async: AsyncBb_Requests.Bb_GET (only when httpx is installed).
+#  - batch: Bb_Batch of POST requests on a thread pool.
+# Results can be saved with --save and compared to a saved run with --baseline,
+# the exit status is 1 when a scenario got slower by more than --tolerance.
+# Usage: python benchmark.py --latency 0.005 --records 5000 --save baseline.json
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import sys
+import time
+import tracemalloc
+
+from Bb_rest_helper import (AsyncBb_Requests, Auth_Helper, Bb_Batch, Bb_Requests,
+                            Metrics_Collector, Retry_Policy, httpx)
+from mock_learn_server import Mock_Learn_Server
+
+COLLECTION = '/learn/api/public/v1/users'
+
+
+# Runs the mock server in this process until it is terminated, sending its url
+# through the queue.
+def serve(options: dict, queue):
+    server = Mock_Learn_Server(**options)
+    queue.put(server.start())
+    while True:
+        time.sleep(3600)
+
+
+def scenario_auth(url: str, args, metrics):
+    auth = Auth_Helper(url, 'key', 'secret', metrics=metrics)
+    for _ in range(args.calls):
+        auth.learn_auth(force=True)
+
+
+def scenario_get(url: str, args, metrics):
+    with Bb_Requests(metrics=metrics, retry_policy=Retry_Policy()) as reqs:
+        reqs.Bb_GET(url, COLLECTION, 'token', {'limit': args.page_size})
+
+
+def scenario_get_prefetch(url: str, args, metrics):
+    with Bb_Requests(metrics=metrics, retry_policy=Retry_Policy(),
+                     pool_maxsize=args.workers) as reqs:
+        reqs.Bb_GET(url, COLLECTION, 'token', {'limit': args.page_size}, prefetch=args.workers)
+
+
+def scenario_get_records(url: str, args, metrics):
+    with Bb_Requests(metrics=metrics, retry_policy=Retry_Policy()) as reqs:
+        reqs.Bb_GET_records(url, COLLECTION, 'token', ['id', 'externalId'], {'limit': args.page_size})
+
+
+def scenario_get_async(url: str, args, metrics):
+    async def get():
+        async with AsyncBb_Requests(metrics=metrics, retry_policy=Retry_Policy()) as reqs:
+            await reqs.Bb_GET(url, COLLECTION, 'token', {'limit': args.page_size})
+    asyncio.run(get())
+
+
+def scenario_batch(url: str, args, metrics):
+    jobs = (('POST', '/learn/api/public/v1/courses', {'externalId': f'bench{i}', 'name': f'Bench {i}'})
+            for i in range(args.calls))
+    with Bb_Requests(metrics=metrics, retry_policy=Retry_Policy(retry_post=True),
+                     pool_maxsize=args.workers) as reqs:
+        for _ in Bb_Batch(reqs, url, 'token', max_workers=args.workers).run(jobs):
+            pass
+
+
+SCENARIOS = {
+    'auth': scenario_auth,
+    'get': scenario_get,
+    'get_prefetch': scenario_get_prefetch,
+    'get_records': scenario_get_records,
+    'get_async': scenario_get_async,
+    'batch': scenario_batch
+}
+
+
+# Returns the value at a percentile of a list of samples.
+def percentile(samples: list, p: int):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+# Runs a scenario repeat times, then once more to measure its peak memory.
+def run_scenario(name: str, url: str, args):
+    latencies = []
+    metrics = Metrics_Collector(
+        callback=lambda event: latencies.append(event['total']) if event['event'] == 'request' else None)
+    started = time.perf_counter()
+    for _ in range(args.repeat):
+        SCENARIOS[name](url, args, metrics)
+    elapsed = time.perf_counter() - started
+    tracemalloc.start()
+    SCENARIOS[name](url, args, Metrics_Collector())
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        'calls': len(latencies),
+        'calls_per_second': len(latencies) / elapsed,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'peak_mib': peak / 2 ** 20
+    }
+
+
+# Returns the scenarios that got slower than the baseline by more than tolerance.
+def regressions(results: dict, baseline: dict, tolerance: float):
+    slower = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]
+        if result['calls_per_second'] < before['calls_per_second'] * (1 - tolerance):
+            slower.append(f'{name}: calls/s {before["calls_per_second"]:.0f} -> {result["calls_per_second"]:.0f}')
+        if result['p99_ms'] > before['p99_ms'] * (1 + tolerance):
+            slower.append(f'{name}: p99 {before["p99_ms"]:.1f}ms -> {result["p99_ms"]:.1f}ms')
+        if result['peak_mib'] > before['peak_mib'] * (1 + tolerance):
+            slower.append(f'{name}: peak {before["peak_mib"]:.1f}MiB -> {result["peak_mib"]:.1f}MiB')
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark Bb_rest_helper against a mock Learn server.')
+    parser.add_argument('scenarios', nargs='*', help=f'scenarios to run: {", ".join(SCENARIOS)} (all by default)')
+    parser.add_argument('--records', type=int, default=5000, help='records of the collection read')
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--calls', type=int, default=500, help='calls of the auth and batch scenarios')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--latency', type=float, default=0.0, help='server latency in seconds')
+    parser.add_argument('--latency-jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--rate-limit', type=int, default=10 ** 9)
+    parser.add_argument('--save', help='saves the results to a json file')
+    parser.add_argument('--baseline', help='json file of a previous run to compare to')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+    for name in args.scenarios:
+        if name not in SCENARIOS:
+            parser.error(f'unknown scenario {name}')
+    if not args.scenarios:
+        args.scenarios = list(SCENARIOS)
+
+    options = {
+        'records': args.records,
+        'page_size': args.page_size,
+        'latency': args.latency,
+        'latency_jitter': args.latency_jitter,
+        'error_rate': args.error_rate,
+        'rate_limit': args.rate_limit
+    }
+    queue = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve, args=(options, queue), daemon=True)
+    server.start()
+    url = queue.get(timeout=30)
+
+    results = {}
+    try:
+        print(f'{"scenario":<14}{"calls":>8}{"calls/s":>10}{"p50 ms":>9}{"p99 ms":>9}{"peak MiB":>10}')
+        for name in args.scenarios:
+            if name == 'get_async' and httpx is None:
+                print(f'{name:<14} skipped, httpx is not installed')
+                continue
+            result = results[name] = run_scenario(name, url, args)
+            print(f'{name:<14}{result["calls"]:>8}{result["calls_per_second"]:>10.0f}'
+                  f'{result["p50_ms"]:>9.2f}{result["p99_ms"]:>9.2f}{result["peak_mib"]:>10.2f}')
+    finally:
+        server.terminate()
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'options': options, 'results': results}, f, indent=4)
+    if args.baseline:
+        with open(args.baseline) as f:
+            slower = regressions(results, json.load(f)['results'], args.tolerance)
+        for line in slower:
+            print(f'Regression, {line}')
+        if slower:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
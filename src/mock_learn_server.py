@@ -0,0 +1,626 @@
+# mock_learn_server
+# A local stand-in for the Blackboard Learn REST API, to test and benchmark the
+# helper without touching a real server. It runs on a ThreadingHTTPServer and
+# keeps its data in memory:
+#  - POST .../oauth2/token returns a bearer token valid for token_expires seconds.
+#  - GET of a collection (any path not ending with an id) returns its records in
+#    pages of page_size records (or the limit parameter, if smaller), with
+#    paging.nextPage, the offset, fields, sort, modified and modifiedCompare
+#    parameters and the externalId, courseId and userName filters like Learn.
+#    The first time a collection is read, it is filled with records generated
+#    records. With supports_modified=False the modified filter is rejected with a
+#    400, like the endpoints that do not support it.
+#  - GET, PATCH, PUT and DELETE of a record by id (_12_1, externalId:x, uuid:x...).
+#  - GET responses carry an ETag, a request with a matching If-None-Match gets a
+#    304 without body.
+#  - POST to a collection creates a record, POST .../uploads stores a file.
+#  - A SIS snapshot flat file integration at flat_file_endpoint: POST
+#    {feed}/{operation} takes a pipe delimited feed (gzip encoded or not) and
+#    returns its reference code, GET dataSetStatus/{reference code} its status as
+#    XML. person and course feeds are applied to the users and courses collections
+#    once processed, feed_delay seconds after they are sent.
+#  - Course content trees: .../courses/{courseId}/contents lists content_fanout
+#    contents and .../contents/{contentId}/children the children of one, down to
+#    content_depth levels. All the contents of a level but the last one are
+#    folders with children, the last one is a document.
+#  - Gradebooks: .../courses/{courseId}/users lists records memberships (every
+#    tenth one an Instructor), .../gradebook/columns grade_columns columns and
+#    .../gradebook/columns/{columnId}/users the grades of a column, with a score
+#    for every member but one in seven.
+# latency (plus a random latency_jitter) delays every response, error_rate is the
+# fraction of requests answered with a 503 and rate_limit the number of requests
+# allowed every rate_window seconds, reported in the X-Rate-Limit-* headers and
+# answered with a 429 and Retry-After once exhausted. With check_tokens, requests
+# without a valid token get a 401. stats holds the count of requests by method
+# and status, connections opened, bytes uploaded and the most requests handled at
+# once (max_in_flight).
+# Usage, in a script or test:
+#     with Mock_Learn_Server(records=1000, latency=0.02) as server:
+#         reqs.Bb_GET(server.url, '/learn/api/public/v3/courses', token)
+# or from the command line: python mock_learn_server.py --port 8000 --latency 0.02
+
+import argparse
+import collections
+import datetime
+import gzip
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+BASE_TIME = datetime.datetime(2021, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+# Returns a Learn formatted timestamp.
+def learn_time(moment: datetime.datetime):
+    return moment.strftime('%Y-%m-%dT%H:%M:%S.') + f'{moment.microsecond // 1000:03d}Z'
+
+
+# Generates record i of a collection, shaped after the last segment of its path.
+def make_record(collection: str, i: int):
+    kind = collection.rstrip('/').rsplit('/', 1)[-1]
+    record = {
+        'id': f'_{i + 1}_1',
+        'uuid': uuid.UUID(int=i + 1).hex,
+        'externalId': f'{kind}{i + 1:06d}',
+        'dataSourceId': '_2_1',
+        'created': learn_time(BASE_TIME + datetime.timedelta(seconds=i)),
+        'modified': learn_time(BASE_TIME + datetime.timedelta(seconds=i))
+    }
+    if kind == 'users':
+        record.update({
+            'userName': f'user{i + 1:06d}',
+            'studentId': f'{20210000 + i}',
+            'availability': {'available': 'Yes'},
+            'name': {'given': 'Mock', 'family': f'User {i + 1}'},
+            'contact': {'email': f'user{i + 1:06d}@example.edu'}
+        })
+    elif kind == 'courses':
+        record.update({
+            'courseId': f'COURSE{i + 1:06d}',
+            'name': f'Mock course {i + 1}',
+            'organization': False,
+            'ultraStatus': 'Classic',
+            'availability': {'available': 'Yes', 'duration': {'type': 'Continuous'}}
+        })
+    else:
+        record.update({'name': f'Mock {kind} {i + 1}'})
+    return record
+
+
+# Returns a copy of a record with only the given fields, like the Learn fields
+# parameter. Nested fields are given with a dot.
+def project(record: dict, fields: list):
+    projected = {}
+    for field in fields:
+        source, target = record, projected
+        path = field.split('.')
+        for key in path[:-1]:
+            source = source.get(key) if isinstance(source, dict) else None
+            target = target.setdefault(key, {})
+        if isinstance(source, dict) and path[-1] in source:
+            target[path[-1]] = source[path[-1]]
+    return projected
+
+
+# Mock_Learn_Handler
+# Handles the requests of a Mock_Learn_Server. Responses are written in a single
+# buffered write, so clients are not slowed down by delayed acknowledgments.
+
+
+class Mock_Learn_Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        self.server.mock.count('connections')
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def do_PATCH(self):
+        self.handle_request('PATCH')
+
+    def do_PUT(self):
+        self.handle_request('PUT')
+
+    def do_DELETE(self):
+        self.handle_request('DELETE')
+
+    # Reads the request body, sent with a Content-Length or in chunks.
+    def read_body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                if size == 0:
+                    while self.rfile.readline() not in (b'\r\n', b'\n', b''):
+                        pass
+                    return b''.join(chunks)
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def handle_request(self, method: str):
+        body = self.read_body()
+        status, data, headers = self.server.mock.respond(
+            method, self.path, self.headers, body)
+        if isinstance(data, str):
+            content = data.encode('utf-8')
+            content_type = 'application/xml' if data.startswith('<') else 'text/plain'
+        else:
+            content = json.dumps(data).encode('utf-8') if data is not None else b''
+            content_type = 'application/json'
+        self.send_response(status)
+        if content:
+            self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+
+class Mock_HTTP_Server(ThreadingHTTPServer):
+
+    daemon_threads = True
+    request_queue_size = 128
+
+
+# Mock_Learn_Server
+# The server and its data. start() serves in a background thread and returns the
+# base url (also in the url attribute), stop() shuts it down; it can be used as a
+# context manager. port 0 picks a free port.
+
+
+class Mock_Learn_Server():
+
+    token_endpoint = '/learn/api/public/v1/oauth2/token'
+    uploads_endpoint = '/learn/api/public/v1/uploads'
+    flat_file_endpoint = '/webapps/bb-data-integration-flatfile-mock/endpoint'
+    # Collection and record fields the person and course feeds are applied to.
+    feed_collections = {
+        'person': ('/learn/api/public/v1/users', 'external_person_key', {
+            'user_id': 'userName', 'firstname': 'given', 'lastname': 'family', 'email': 'email'}),
+        'course': ('/learn/api/public/v3/courses', 'external_course_key', {
+            'course_id': 'courseId', 'course_name': 'name', 'description': 'description'})
+    }
+
+    def __init__(
+            self,
+            port: int = 0,
+            host: str = '127.0.0.1',
+            records: int = 1000,
+            page_size: int = 100,
+            latency: float = 0.0,
+            latency_jitter: float = 0.0,
+            error_rate: float = 0.0,
+            rate_limit: int = 100000,
+            rate_window: float = 86400,
+            token_expires: int = 3600,
+            check_tokens: bool = False,
+            supports_modified: bool = True,
+            feed_delay: float = 0.0,
+            content_fanout: int = 3,
+            content_depth: int = 3,
+            grade_columns: int = 10,
+            seed: int = None):
+        self.port = port
+        self.host = host
+        self.records = records
+        self.page_size = page_size
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.token_expires = token_expires
+        self.check_tokens = check_tokens
+        self.supports_modified = supports_modified
+        self.feed_delay = feed_delay
+        self.data_sets = {}
+        self.content_fanout = content_fanout
+        self.content_depth = content_depth
+        self.content_levels = {}
+        self.content_counts = collections.Counter()
+        self.grade_columns = grade_columns
+        self.in_flight = 0
+        self.random = random.Random(seed)
+        self.collections = {}
+        self.tokens = {}
+        self.stats = collections.Counter()
+        self.window_start = time.monotonic()
+        self.window_used = 0
+        self._lock = threading.Lock()
+        self.httpd = None
+        self.url = None
+
+    def start(self):
+        self.httpd = Mock_HTTP_Server((self.host, self.port), Mock_Learn_Handler)
+        self.httpd.mock = self
+        self.port = self.httpd.server_port
+        self.url = f'http://{self.host}:{self.port}'
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self.url
+
+    def stop(self):
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def count(self, counter: str, value: int = 1):
+        with self._lock:
+            self.stats[counter] += value
+
+    # Returns the records of a collection, generating them on first use.
+    def collection(self, path: str):
+        with self._lock:
+            if path not in self.collections:
+                if path.endswith('/contents') or path.endswith('/children'):
+                    self.collections[path] = self.contents(path)
+                elif re.search(r'/gradebook/columns(/[^/]+/users)?$', path):
+                    self.collections[path] = self.gradebook(path)
+                elif re.search(r'/courses/[^/]+/users$', path):
+                    self.collections[path] = self.memberships(path)
+                else:
+                    self.collections[path] = [make_record(path, i) for i in range(self.records)]
+            return self.collections[path]
+
+    # Generates the contents of a course content tree level: the top level for a
+    # contents path, the children of a folder for a children path. Ids are unique
+    # in the course, the level of each content is kept in content_levels. Called
+    # with the lock held.
+    def contents(self, path: str):
+        course_path, _, rest = path.partition('/contents')
+        parent = rest.split('/')[1] if rest else None
+        level = 0 if parent is None else self.content_levels.get((course_path, parent), self.content_depth) + 1
+        if level >= self.content_depth:
+            return []
+        contents = []
+        for i in range(self.content_fanout):
+            self.content_counts[course_path] += 1
+            number = self.content_counts[course_path]
+            folder = i < self.content_fanout - 1 and level < self.content_depth - 1
+            content = {
+                'id': f'_{number}_1',
+                'title': f'{"Folder" if folder else "Document"} {number}',
+                'position': i,
+                'hasChildren': folder,
+                'availability': {'available': 'Yes'},
+                'contentHandler': {'id': 'resource/x-bb-folder' if folder else 'resource/x-bb-document'},
+                'created': learn_time(BASE_TIME),
+                'modified': learn_time(BASE_TIME)
+            }
+            if parent is not None:
+                content['parentId'] = parent
+            self.content_levels[(course_path, content['id'])] = level
+            contents.append(content)
+        return contents
+
+    # Returns the index of the record of a collection with the given id, or None.
+    def find(self, records: list, record_id: str):
+        key, _, value = record_id.partition(':')
+        if not value:
+            key, value = 'id', record_id
+        for i, record in enumerate(records):
+            if str(record.get(key)) == value:
+                return i
+        return None
+
+    # Returns the seconds to the end of the rate limit window and the requests left,
+    # taking one for the current request. remaining is -1 when none was left.
+    def take_rate_limit(self):
+        with self._lock:
+            now = time.monotonic()
+            if now - self.window_start >= self.rate_window:
+                self.window_start = now
+                self.window_used = 0
+            reset = max(1, int(self.window_start + self.rate_window - now + 0.999))
+            if self.window_used >= self.rate_limit:
+                return reset, -1
+            self.window_used += 1
+            return reset, self.rate_limit - self.window_used
+
+    # Returns the status, the json data and the extra headers of the response.
+    def respond(self, method: str, target: str, headers, body: bytes):
+        delay = self.latency + (self.random.uniform(0, self.latency_jitter) if self.latency_jitter else 0)
+        with self._lock:
+            self.in_flight += 1
+            self.stats['max_in_flight'] = max(self.stats['max_in_flight'], self.in_flight)
+        try:
+            if delay:
+                time.sleep(delay)
+            status, data, extra = self._respond(method, target, headers, body)
+            if method == 'GET' and status == 200 and not isinstance(data, str):
+                status, data, extra = self.revalidate(headers, data, extra)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+        self.count(f'{method} {status}')
+        self.count('requests')
+        return status, data, extra
+
+    # Adds an ETag to a GET response, and answers a 304 without data when it
+    # matches the If-None-Match header of the request.
+    def revalidate(self, headers, data, extra: dict):
+        etag = '"' + hashlib.sha1(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest() + '"'
+        extra = dict(extra, ETag=etag)
+        if headers.get('If-None-Match') == etag:
+            return 304, None, extra
+        return 200, data, extra
+
+    def _respond(self, method: str, target: str, headers, body: bytes):
+        reset, remaining = self.take_rate_limit()
+        extra = {
+            'X-Rate-Limit-Limit': str(self.rate_limit),
+            'X-Rate-Limit-Remaining': str(max(remaining, 0)),
+            'X-Rate-Limit-Reset': str(reset)
+        }
+        if remaining < 0:
+            extra['Retry-After'] = str(reset)
+            return 429, {'status': 429, 'message': 'API rate limit exceeded'}, extra
+        if self.error_rate and self.random.random() < self.error_rate:
+            return 503, {'status': 503, 'message': 'Service unavailable'}, extra
+
+        url = urlsplit(target)
+        path = url.path.rstrip('/')
+        params = dict(parse_qsl(url.query))
+        if path == self.token_endpoint and method == 'POST':
+            return self.issue_token(headers) + (extra,)
+        if path.startswith(self.flat_file_endpoint + '/'):
+            return self.flat_file(method, path[len(self.flat_file_endpoint) + 1:], headers, body) + (extra,)
+        if self.check_tokens and not self.valid_token(headers):
+            return 401, {'status': 401, 'message': 'Bearer token is invalid'}, extra
+        if path == self.uploads_endpoint and method == 'POST':
+            self.count('uploads')
+            self.count('uploaded_bytes', len(body))
+            return 201, {'id': f'_upload_{self.stats["uploads"]}'}, extra
+
+        parent, _, last = path.rpartition('/')
+        if last.startswith('_') or ':' in last:
+            return self.record(method, parent, last, body) + (extra,)
+        if method == 'GET':
+            return self.page(path, params) + (extra,)
+        if method == 'POST':
+            return self.create(path, body) + (extra,)
+        return 405, {'status': 405, 'message': f'{method} not allowed on a collection'}, extra
+
+    # Receives a feed file, or returns the status of a data set.
+    def flat_file(self, method: str, path: str, headers, body: bytes):
+        if not headers.get('Authorization', '').startswith('Basic '):
+            return 401, 'Unauthorized'
+        parts = path.split('/')
+        if method == 'GET' and len(parts) == 2 and parts[0] == 'dataSetStatus':
+            return self.data_set_status(parts[1])
+        if method != 'POST' or len(parts) != 2:
+            return 404, 'Not Found'
+        if headers.get('Content-Encoding', '').lower() == 'gzip':
+            body = gzip.decompress(body)
+        lines = body.decode('utf-8').splitlines()
+        if not lines:
+            return 400, 'Error: Feed File is empty'
+        header = lines[0].split('|')
+        rows = [dict(zip(header, line.split('|'))) for line in lines[1:] if line.count('|') == len(header) - 1]
+        reference = uuid.uuid4().hex
+        with self._lock:
+            self.data_sets[reference] = {
+                'feed': parts[0], 'operation': parts[1], 'rows': rows,
+                'errors': len(lines) - 1 - len(rows), 'sent': time.monotonic(), 'applied': False}
+        self.count('feed_files')
+        self.count('feed_rows', len(lines) - 1)
+        return 200, (f'Success: Feed File Uploaded. Use the reference code {reference} '
+                     'to track these records in the logs.')
+
+    def data_set_status(self, reference: str):
+        with self._lock:
+            data_set = self.data_sets.get(reference)
+        if data_set is None:
+            return 404, 'Data set not found'
+        total = len(data_set['rows']) + data_set['errors']
+        processed = time.monotonic() >= data_set['sent'] + self.feed_delay
+        if processed and not data_set['applied']:
+            self.apply_feed(data_set)
+        return 200, (
+            '<dataSetStatus>'
+            f'<dataSetUid>{reference}</dataSetUid>'
+            f'<completedCount>{len(data_set["rows"]) if processed else 0}</completedCount>'
+            f'<errorCount>{data_set["errors"] if processed else 0}</errorCount>'
+            f'<lastEntryDate>{learn_time(datetime.datetime.now(datetime.timezone.utc))}</lastEntryDate>'
+            f'<queuedCount>{0 if processed else total}</queuedCount>'
+            '<warningCount>0</warningCount>'
+            '</dataSetStatus>')
+
+    # Applies the rows of a person or course data set to its collection.
+    def apply_feed(self, data_set: dict):
+        data_set['applied'] = True
+        if data_set['feed'] not in self.feed_collections:
+            return
+        path, key, fields = self.feed_collections[data_set['feed']]
+        records = self.collection(path)
+        with self._lock:
+            index = {record.get('externalId'): i for i, record in enumerate(records)}
+            for row in data_set['rows']:
+                external_id = row.get(key)
+                if data_set['operation'] == 'delete':
+                    if external_id in index:
+                        records[index.pop(external_id)] = None
+                    continue
+                record = records[index[external_id]] if external_id in index else {
+                    'id': f'_{len(records) + 1}_1', 'externalId': external_id}
+                for column, field in fields.items():
+                    if row.get(column):
+                        if field in ('given', 'family'):
+                            record.setdefault('name', {})[field] = row[column]
+                        elif field == 'email':
+                            record.setdefault('contact', {})[field] = row[column]
+                        else:
+                            record[field] = row[column]
+                record['modified'] = learn_time(datetime.datetime.now(datetime.timezone.utc))
+                if external_id not in index:
+                    index[external_id] = len(records)
+                    records.append(record)
+            records[:] = [record for record in records if record is not None]
+
+    # Returns the memberships of a course, users _1_1 to _{records}_1.
+    def memberships(self, path: str):
+        course = path.rsplit('/', 2)[-2]
+        return [{
+            'id': f'_{i + 1}_1',
+            'userId': f'_{i + 1}_1',
+            'courseId': course,
+            'courseRoleId': 'Instructor' if i % 10 == 9 else 'Student',
+            'availability': {'available': 'Yes'},
+            'created': learn_time(BASE_TIME + datetime.timedelta(seconds=i))
+        } for i in range(self.records)]
+
+    # Returns the gradebook columns of a course, or the grades of a column.
+    def gradebook(self, path: str):
+        if path.endswith('/columns'):
+            return [{
+                'id': f'_{j + 1}_1',
+                'name': f'Assignment {j + 1}',
+                'score': {'possible': 100.0},
+                'availability': {'available': 'Yes'},
+                'grading': {'type': 'Attempts', 'scoringModel': 'Last'}
+            } for j in range(self.grade_columns)]
+        column = path.rsplit('/', 2)[-2]
+        j = int(column.strip('_').split('_')[0]) - 1
+        return [{
+            'userId': f'_{i + 1}_1',
+            'columnId': column,
+            'status': 'Graded',
+            'score': float((i * 7 + j * 13) % 101),
+            'text': str(float((i * 7 + j * 13) % 101)),
+            'exempt': False
+        } for i in range(self.records) if (i + j) % 7]
+
+    def issue_token(self, headers):
+        if not headers.get('Authorization', '').startswith('Basic '):
+            return 401, {'error': 'invalid_client', 'error_description': 'Client credentials are missing'}
+        token = uuid.uuid4().hex
+        with self._lock:
+            self.tokens[token] = time.monotonic() + self.token_expires
+        return 200, {'access_token': token, 'token_type': 'bearer', 'expires_in': self.token_expires}
+
+    def valid_token(self, headers):
+        token = headers.get('Authorization', '')[len('Bearer '):]
+        with self._lock:
+            return self.tokens.get(token, 0) > time.monotonic()
+
+    # Returns a page of a collection.
+    def page(self, path: str, params: dict):
+        records = self.collection(path)
+        for key in ('externalId', 'courseId', 'userName'):
+            # Learn matches these filters partially.
+            if key in params:
+                records = [r for r in records if params[key] in str(r.get(key, ''))]
+        if 'modified' in params:
+            if not self.supports_modified:
+                return 400, {'status': 400, 'message': 'Unrecognized query parameter: modified'}
+            if params.get('modifiedCompare', 'greaterOrEqual') == 'lessThan':
+                records = [r for r in records if r.get('modified', '') < params['modified']]
+            else:
+                records = [r for r in records if r.get('modified', '') >= params['modified']]
+        if params.get('sort'):
+            field, _, order = params['sort'].partition('(')
+            records = sorted(records, key=lambda r: str(r.get(field, '')), reverse=order.startswith('desc'))
+        offset = int(params.get('offset', 0))
+        limit = min(int(params.get('limit', self.page_size)), self.page_size)
+        results = records[offset:offset + limit]
+        if params.get('fields'):
+            fields = params['fields'].split(',')
+            results = [project(record, fields) for record in results]
+        data = {'results': results}
+        if offset + limit < len(records):
+            data['paging'] = {'nextPage': f'{path}?{urlencode(dict(params, offset=offset + limit))}'}
+        return 200, data
+
+    def create(self, path: str, body: bytes):
+        payload = json.loads(body) if body else {}
+        records = self.collection(path)
+        with self._lock:
+            record = dict(payload, id=f'_{len(records) + 1}_1', uuid=uuid.uuid4().hex,
+                          created=learn_time(datetime.datetime.now(datetime.timezone.utc)))
+            record['modified'] = record['created']
+            records.append(record)
+        return 201, record
+
+    # Reads, updates or deletes a record of a collection.
+    def record(self, method: str, path: str, record_id: str, body: bytes):
+        records = self.collection(path)
+        with self._lock:
+            index = self.find(records, record_id)
+            if index is None:
+                return 404, {'status': 404, 'message': f'Record {record_id} not found'}
+            if method == 'GET':
+                return 200, records[index]
+            if method == 'DELETE':
+                del records[index]
+                return 204, None
+            if method in ('PATCH', 'PUT'):
+                payload = json.loads(body) if body else {}
+                record = records[index] if method == 'PATCH' else {'id': records[index]['id']}
+                record.update(payload)
+                record['modified'] = learn_time(datetime.datetime.now(datetime.timezone.utc))
+                records[index] = record
+                return 200, record
+        return 405, {'status': 405, 'message': f'{method} not allowed on a record'}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local mock of the Blackboard Learn REST API.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--records', type=int, default=1000)
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--latency-jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--rate-limit', type=int, default=100000)
+    parser.add_argument('--rate-window', type=float, default=86400)
+    parser.add_argument('--token-expires', type=int, default=3600)
+    parser.add_argument('--check-tokens', action='store_true')
+    parser.add_argument('--no-modified-filter', action='store_true')
+    parser.add_argument('--feed-delay', type=float, default=0.0)
+    parser.add_argument('--content-fanout', type=int, default=3)
+    parser.add_argument('--content-depth', type=int, default=3)
+    parser.add_argument('--grade-columns', type=int, default=10)
+    args = parser.parse_args()
+    server = Mock_Learn_Server(
+        args.port, args.host, args.records, args.page_size, args.latency,
+        args.latency_jitter, args.error_rate, args.rate_limit, args.rate_window,
+        args.token_expires, args.check_tokens, not args.no_modified_filter, args.feed_delay,
+        args.content_fanout, args.content_depth, args.grade_columns)
+    print(f'Mock Learn server on {server.start()}')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
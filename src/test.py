@@ -5,17 +5,23 @@
 
 import datetime
 import glob
+import json
 import logging
 import os
 import os.path
 import shutil
+import tempfile
+import threading
 import time
 import unittest
+import asyncio
 import csv
 
+import requests
 import vcr
 
-from Bb_rest_helper import Auth_Helper, Bb_Requests, Bb_Utils, Get_Config
+from Bb_rest_helper import AsyncAuth_Helper, AsyncBb_Requests, Auth_Helper, Bb_Batch, Bb_Records, Bb_Requests, Bb_Session, Bb_Utils, Checkpoint_Store, Content_Crawler, Csv_Writer, Date_Converter, Delta_Sync, Flat_File_Feed, Get_Config, Gradebook_Matrix, Id_Resolver, Json_Codec, Metrics_Collector, Multipart_Encoder, Rate_Limiter, Response_Cache, Retry_Policy, Single_Flight, Tenant_Registry, Token_Manager, httpx
+from mock_learn_server import Mock_Learn_Server
 
 
 class Tests_Bb_rest_helper(unittest.TestCase):
@@ -289,5 +295,744 @@ class Tests_Bb_rest_helper(unittest.TestCase):
         assert self.data,self.data2 in self.read_data  
 
 
+
+# Tests that do not need credentials or recorded cassettes.
+class Tests_Bb_rest_helper_offline(unittest.TestCase):
+
+    # Tests for Bb_Session() class
+    def test_session_pool_size(self):
+        self.session = Bb_Session(pool_connections=2, pool_maxsize=20)
+        self.adapter = self.session.session.get_adapter('https://example.com')
+        self.assertEqual(self.adapter._pool_maxsize, 20)
+        self.session.close()
+
+    def test_session_context_manager(self):
+        with Bb_Session() as self.session:
+            self.assertFalse(self.session.closed)
+        assert self.session.closed
+
+    def test_requests_shared_session(self):
+        self.session = Bb_Session()
+        with Bb_Requests(self.session) as self.reqs:
+            self.assertIs(self.reqs.session, self.session)
+        # A shared session is not closed by the Bb_Requests that borrowed it
+        self.assertFalse(self.session.closed)
+        self.session.close()
+
+
+    # Tests for Rate_Limiter() class
+    def test_rate_limiter_full_speed(self):
+        self.limiter = Rate_Limiter()
+        self.limiter.update({'X-Rate-Limit-Limit': '1000',
+                             'X-Rate-Limit-Remaining': '900',
+                             'X-Rate-Limit-Reset': '60'})
+        self.budget = self.limiter.budget()
+        self.assertEqual(self.budget['remaining'], 900)
+        self.assertIsNone(self.budget['rate'])
+
+    def test_rate_limiter_throttled(self):
+        self.limiter = Rate_Limiter(throttle_below=0.2, reserve=10)
+        self.limiter.update({'X-Rate-Limit-Limit': '1000',
+                             'X-Rate-Limit-Remaining': '110',
+                             'X-Rate-Limit-Reset': '100'})
+        # 100 usable calls over 100 seconds
+        self.assertAlmostEqual(self.limiter.budget()['rate'], 1, places=1)
+
+    def test_rate_limiter_retry_after(self):
+        self.limiter = Rate_Limiter()
+        self.limiter.update({'Retry-After': '30'}, 429)
+        assert self.limiter.budget()['paused_for'] > 29
+
+
+    # Tests for Retry_Policy() class
+    def test_retry_backoff(self):
+        self.policy = Retry_Policy(backoff_factor=1, max_backoff=5, jitter=False)
+        self.assertEqual([self.policy.backoff(n) for n in range(1, 5)], [1, 2, 4, 5])
+
+    def test_retry_no_post(self):
+        self.policy = Retry_Policy()
+        self.assertFalse(self.policy.can_retry('POST'))
+        assert self.policy.can_retry('GET')
+        assert Retry_Policy(retry_post=True).can_retry('POST')
+
+    def test_retry_call(self):
+        self.policy = Retry_Policy(backoff_factor=0)
+        self.responses = [requests.Response(), requests.Response()]
+        self.responses[0].status_code = 503
+        self.responses[1].status_code = 200
+        self.r = self.policy.call('GET', lambda: self.responses.pop(0))
+        self.assertEqual(self.r.status_code, 200)
+        self.assertEqual(self.policy.stats()['retries'], 1)
+
+
+    # Tests for Response_Cache() class
+    def test_cache_ttl_for(self):
+        self.cache = Response_Cache(default_ttl=60, ttls={
+            '/learn/api/public/v1': 10, '/learn/api/public/v1/terms': 3600})
+        self.assertEqual(self.cache.ttl_for('/learn/api/public/v1/terms/_1_1'), 3600)
+        self.assertEqual(self.cache.ttl_for('/learn/api/public/v1/users'), 10)
+        self.assertEqual(self.cache.ttl_for('/learn/api/public/v3/courses'), 60)
+
+    def test_cache_store_and_invalidate(self):
+        self.cache = Response_Cache()
+        self.response = requests.Response()
+        self.response.status_code = 200
+        self.response._content = b'{"results": []}'
+        self.key = self.cache.key('https://learn/learn/api/public/v3/courses', {'limit': 1})
+        self.cache.store(self.key, '/learn/api/public/v3/courses', self.response)
+        assert self.cache.is_fresh(self.cache.get(self.key))
+        self.cache.invalidate('/learn/api/public/v3/courses/_1_1')
+        self.assertIsNone(self.cache.get(self.key))
+
+
+
+    def test_cache_revalidated_with_etag(self):
+        self.endpoint = '/learn/api/public/v1/users'
+        self.cache = Response_Cache(default_ttl=0)
+        with Mock_Learn_Server(records=20) as self.server, Bb_Requests(cache=self.cache) as self.reqs:
+            self.first = self.reqs.Bb_GET(self.server.url, self.endpoint, 'token')
+            self.second = self.reqs.Bb_GET(self.server.url, self.endpoint, 'token')
+        self.assertEqual(self.second, self.first)
+        self.assertEqual(len(self.second), 20)
+        self.assertEqual((self.server.stats['GET 200'], self.server.stats['GET 304']), (1, 1))
+        self.assertEqual(self.cache.stats()['revalidated'], 1)
+
+
+    def test_cache_on_disk_with_eviction(self):
+        self.endpoint = '/learn/api/public/v1/users'
+        with Mock_Learn_Server(records=5) as self.server, Bb_Requests() as self.reqs, \
+                tempfile.TemporaryDirectory() as folder:
+            self.path = os.path.join(folder, 'cache.db')
+            self.reqs.cache = Response_Cache(self.path, max_entries=1, max_disk_entries=2)
+            for limit in (5, 10, 15):
+                self.reqs.Bb_GET(self.server.url, self.endpoint, 'token', {'limit': limit})
+                time.sleep(0.01)
+            self.assertEqual(self.reqs.cache.stats()['evictions'], 2 + 1)
+            self.reqs.cache.close()
+            self.reqs.cache = Response_Cache(self.path)
+            self.requests = self.server.stats['requests']
+            self.assertEqual(len(self.reqs.Bb_GET(self.server.url, self.endpoint, 'token', {'limit': 15})), 5)
+            self.reqs.Bb_GET(self.server.url, self.endpoint, 'token', {'limit': 10})
+            self.assertEqual(self.server.stats['requests'], self.requests)
+            self.reqs.Bb_GET(self.server.url, self.endpoint, 'token', {'limit': 5})
+            self.assertEqual(self.server.stats['requests'], self.requests + 1)
+            self.reqs.cache.close()
+
+
+    def test_cache_invalidated_by_writes(self):
+        self.endpoint = '/learn/api/public/v3/courses'
+        self.cache = Response_Cache()
+        with Mock_Learn_Server(records=5) as self.server, Bb_Requests(cache=self.cache) as self.reqs:
+            self.writes = [
+                lambda: self.reqs.Bb_POST(self.server.url, self.endpoint, 'token', {'externalId': 'new'}),
+                lambda: self.reqs.Bb_PATCH(self.server.url, f'{self.endpoint}/_1_1', 'token', {'name': 'Patched'}),
+                lambda: self.reqs.Bb_DELETE(self.server.url, f'{self.endpoint}/_2_1', 'token')]
+            self.assertEqual(len(self.reqs.Bb_GET(self.server.url, self.endpoint, 'token')), 5)
+            for self.expected, write in zip((6, 6, 5), self.writes):
+                self.reqs.Bb_GET(self.server.url, self.endpoint, 'token')
+                self.gets = self.server.stats['GET 200']
+                write()
+                self.courses = self.reqs.Bb_GET(self.server.url, self.endpoint, 'token')
+                self.assertEqual(self.server.stats['GET 200'], self.gets + 1)
+                self.assertEqual(len(self.courses), self.expected)
+            self.assertEqual(self.courses[0]['name'], 'Patched')
+        self.assertEqual(self.cache.stats()['invalidations'], 3)
+
+    # Tests for Csv_Writer() class and Bb_Utils.iter_csv()
+    def test_csv_stream_round_trip(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'test_stream.csv')
+        self.headers = ['id', 'score']
+        with Csv_Writer(self.path, self.headers, flush_rows=10) as self.writer:
+            self.writer.writerows({'id': str(n), 'score': n / 2} for n in range(25))
+        with Csv_Writer(self.path, self.headers) as self.writer:
+            self.writer.writerow({'id': '25', 'score': 12.5})
+        self.chunks = list(Bb_Utils().iter_csv(self.path, chunk_size=10, types={'score': float}))
+        self.assertEqual([len(c) for c in self.chunks], [10, 10, 6])
+        self.assertEqual(self.chunks[2][-1], {'id': '25', 'score': 12.5})
+        shutil.rmtree(os.path.dirname(self.path))
+
+
+    # Tests for Checkpoint_Store() class
+    def test_checkpoint_resume(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'checkpoint.db')
+        with Checkpoint_Store(self.path, 'test', batch_size=2) as self.store:
+            self.store.mark_done('row1', '_1_1')
+            self.store.mark_failed('row2', 'Not found')
+            self.store.set_cursor('users', '/learn/api/public/v1/users?offset=200')
+        with Checkpoint_Store(self.path, 'test') as self.store:
+            assert self.store.is_done('row1')
+            self.assertFalse(self.store.is_done('row2'))
+            self.assertEqual(self.store.response_id('row1'), '_1_1')
+            self.assertEqual(self.store.get_cursor('users'), '/learn/api/public/v1/users?offset=200')
+        shutil.rmtree(os.path.dirname(self.path))
+
+
+    # Tests for Metrics_Collector() class
+    def test_metrics_template(self):
+        self.metrics = Metrics_Collector()
+        self.assertEqual(
+            self.metrics.template('https://learn/learn/api/public/v1/courses/_12_1/users/externalId:abc?limit=1'),
+            '/learn/api/public/v1/courses/{id}/users/{id}')
+
+    def test_metrics_prometheus(self):
+        self.events = []
+        self.metrics = Metrics_Collector(callback=self.events.append)
+        self.metrics.record_request('GET', 'https://learn/learn/api/public/v1/terms/_1_1', 200, 0.25, 0.1, 512)
+        self.metrics.record_pages('https://learn/learn/api/public/v1/terms', 3)
+        self.text = self.metrics.to_prometheus()
+        assert 'bb_requests_total{method="GET",endpoint="/learn/api/public/v1/terms/{id}",status="200"} 1' in self.text
+        self.assertEqual(len(self.events), 2)
+
+    def test_json_codec_round_trip(self):
+        self.page = {'results': [{'id': '_1_1', 'name': 'Café'}], 'paging': {}}
+        for name in ('json', Json_Codec().name):
+            self.codec = Json_Codec(name)
+            self.body = self.codec.dumps(self.page)
+            assert isinstance(self.body, bytes)
+            self.assertEqual(self.codec.loads(self.body), self.page)
+            self.assertRaises(ValueError, self.codec.loads, b'{"results": [')
+
+
+    def test_records_projection(self):
+        self.page = [{'id': '_1_1', 'externalId': 'a', 'name': {'given': 'Ana'}, 'uuid': 'x'},
+                     {'id': '_2_1', 'name': {'family': 'Li'}}]
+        for columns in (False, True):
+            self.records = Bb_Records(['id', 'externalId', 'name.given'], columns)
+            self.records.extend(self.page)
+            self.assertEqual(len(self.records), 2)
+            self.assertEqual(self.records[0].name_given, 'Ana')
+            self.assertEqual(self.records.column('externalId'), ['a', None])
+            self.assertEqual(
+                self.records.to_dicts()[0], {'id': '_1_1', 'externalId': 'a', 'name': {'given': 'Ana'}})
+
+
+    def test_mock_server_pagination(self):
+        with Mock_Learn_Server(records=250, page_size=100) as self.server:
+            self.token = Auth_Helper(self.server.url, 'key', 'secret').learn_auth()
+            with Bb_Requests() as self.reqs:
+                self.users = self.reqs.Bb_GET(self.server.url, '/learn/api/public/v1/users', self.token)
+                self.assertEqual(len(self.users), 250)
+                self.users = self.reqs.Bb_GET(
+                    self.server.url, '/learn/api/public/v1/users', self.token, {'limit': 50}, prefetch=4)
+                self.assertEqual(len(self.users), 250)
+            self.assertEqual(self.server.stats['GET 200'], 3 + 5)
+
+
+
+    def test_learn_auth_refreshes_expired_token(self):
+        with Mock_Learn_Server(token_expires=3600) as self.server:
+            with Auth_Helper(self.server.url, 'key', 'secret') as self.auth:
+                self.token = self.auth.learn_auth()
+                self.assertEqual(self.auth.learn_auth(), self.token)
+            self.assertEqual(self.server.stats['POST 200'], 1)
+        with Mock_Learn_Server(token_expires=1) as self.server:
+            with Auth_Helper(self.server.url, 'key', 'secret') as self.auth:
+                self.token = self.auth.learn_auth()
+                self.assertNotEqual(self.auth.learn_auth(), self.token)
+            self.assertEqual(self.server.stats['POST 200'], 2)
+
+
+    def test_token_manager_background_refresh(self):
+        with Mock_Learn_Server(token_expires=2) as self.server, \
+                Auth_Helper(self.server.url, 'key', 'secret') as self.auth:
+            self.manager = Token_Manager(self.auth, skew=1)
+            self.token = self.manager.get_token()
+            time.sleep(1.5)
+            self.assertEqual(self.manager.refreshes, 2)
+            self.assertNotEqual(self.manager.get_token(), self.token)
+            self.manager.close()
+            self.manager._timer.join(1)
+            self.assertFalse(self.manager._timer.is_alive())
+            time.sleep(1.5)
+            self.assertEqual(self.manager.refreshes, 2)
+            self.assertEqual(self.server.stats['POST 200'], 2)
+
+
+    def test_token_manager_shared_refresh(self):
+        self.tokens = []
+        with Mock_Learn_Server(latency=0.05) as self.server, \
+                Auth_Helper(self.server.url, 'key', 'secret') as self.auth, \
+                Token_Manager(self.auth, background=False) as self.manager:
+            self.threads = [threading.Thread(target=lambda: self.tokens.append(self.manager.get_token()))
+                            for _ in range(10)]
+            for thread in self.threads:
+                thread.start()
+            for thread in self.threads:
+                thread.join()
+        self.assertEqual(len(set(self.tokens)), 1)
+        self.assertIsNotNone(self.tokens[0])
+        self.assertEqual(self.server.stats['POST 200'], 1)
+
+
+    def test_auth_helper_closes_own_session(self):
+        with Mock_Learn_Server() as self.server, Bb_Session() as self.shared:
+            with Auth_Helper(self.server.url, 'key', 'secret') as self.auth:
+                self.assertIsNotNone(self.auth.learn_auth())
+            self.assertTrue(self.auth.session.closed)
+            with Auth_Helper(self.server.url, 'key', 'secret', self.shared) as self.auth:
+                self.auth.learn_auth()
+            self.assertFalse(self.shared.closed)
+
+
+    def test_pager_lazy_and_resumed(self):
+        self.endpoint = '/learn/api/public/v1/users'
+        with Mock_Learn_Server(records=250) as self.server, Bb_Requests() as self.reqs, \
+                tempfile.TemporaryDirectory() as folder:
+            self.pager = self.reqs.Bb_GET_iter(self.server.url, self.endpoint, 'token', {'limit': 50})
+            self.read = []
+            for record in self.pager:
+                self.read.append(record['id'])
+                if len(self.read) == 60:
+                    break
+            self.assertEqual(self.server.stats['GET 200'], 2)
+            self.assertFalse(self.pager.finished)
+            self.resumed = [record['id'] for record in self.reqs.Bb_GET_iter(
+                self.server.url, self.endpoint, 'token', cursor=self.pager.cursor)]
+            self.assertEqual(self.read[:50] + self.resumed, [f'_{i + 1}_1' for i in range(250)])
+            with Checkpoint_Store(os.path.join(folder, 'pager.db'), 'users') as self.store:
+                for self.count, record in enumerate(self.reqs.Bb_GET_iter(
+                        self.server.url, self.endpoint, 'token', {'limit': 50}, checkpoint=self.store), 1):
+                    if self.count == 120:
+                        break
+            with Checkpoint_Store(os.path.join(folder, 'pager.db'), 'users') as self.store:
+                self.pager = self.reqs.Bb_GET_iter(
+                    self.server.url, self.endpoint, 'token', {'limit': 50}, checkpoint=self.store)
+                self.assertEqual(next(iter(self.pager))['id'], '_101_1')
+
+
+    def test_prefetch_matches_sequential(self):
+        self.endpoint = '/learn/api/public/v1/courses/_1_1/users'
+        with Mock_Learn_Server(records=250, page_size=100) as self.server, Bb_Requests() as self.reqs:
+            for self.params in ({}, {'fields': 'courseRoleId'}, {'fields': 'userId,courseRoleId', 'limit': 30},
+                                {'limit': 1000}):
+                self.sequential = self.reqs.Bb_GET(self.server.url, self.endpoint, 'token', self.params)
+                self.prefetched = self.reqs.Bb_GET(self.server.url, self.endpoint, 'token', self.params, prefetch=4)
+                self.assertEqual(len(self.sequential), 250)
+                self.assertEqual(self.prefetched, self.sequential)
+
+    def test_get_connection_error(self):
+        with Mock_Learn_Server() as self.server:
+            self.url = self.server.url
+        with Bb_Requests(retry_policy=Retry_Policy(max_attempts=2, backoff_factor=0.001)) as self.reqs:
+            self.assertIsNone(self.reqs.Bb_GET(self.url, '/learn/api/public/v1/users', 'token'))
+
+
+    def test_rate_limited_requests_pause(self):
+        self.endpoint = '/learn/api/public/v1/users'
+        with Mock_Learn_Server(records=1, rate_limit=10, rate_window=1) as self.server:
+            with Bb_Requests() as self.reqs:
+                for _ in range(10):
+                    self.reqs.Bb_GET(self.server.url, self.endpoint, 'token')
+            self.limiter = Rate_Limiter()
+            with Bb_Requests(rate_limiter=self.limiter,
+                             retry_policy=Retry_Policy(max_attempts=5, backoff_factor=0.01)) as self.reqs:
+                self.started = time.monotonic()
+                self.results = [self.reqs.Bb_GET(self.server.url, self.endpoint, 'token') for _ in range(25)]
+                self.elapsed = time.monotonic() - self.started
+        self.assertEqual([len(result) for result in self.results], [1] * 25)
+        self.assertGreaterEqual(self.server.stats['GET 429'], 1)
+        self.assertGreater(self.limiter.budget()['throttled_time'], 0)
+        self.assertGreater(self.elapsed, 1)
+
+
+    def test_mock_server_errors_retried(self):
+        with Mock_Learn_Server(records=500, error_rate=0.3, seed=1) as self.server:
+            with Bb_Requests(retry_policy=Retry_Policy(max_attempts=10, backoff_factor=0.001)) as self.reqs:
+                self.courses = self.reqs.Bb_GET(self.server.url, '/learn/api/public/v3/courses', 'token')
+            self.assertEqual(len(self.courses), 500)
+            assert self.server.stats['GET 503'] > 0
+
+
+    def test_id_resolver(self):
+        self.endpoint = '/learn/api/public/v3/courses'
+        with Mock_Learn_Server(records=120) as self.server, Bb_Requests() as self.reqs:
+            self.resolver = Id_Resolver(self.reqs, self.server.url, 'token', 'courses', page_size=50)
+            self.assertEqual(self.resolver.build(), 120)
+            self.assertEqual(self.server.stats['GET 200'], 3)
+            self.assertEqual(self.resolver.resolve('courses000007'), '_7_1')
+            self.assertEqual(self.resolver.resolve('COURSE000008', 'courseId'), '_8_1')
+            self.assertEqual(self.resolver.hits, 2)
+            self.assertEqual(self.server.stats['GET 200'], 3)
+            self.created = self.reqs.Bb_POST(self.server.url, self.endpoint, 'token', {'externalId': 'new', 'courseId': 'NEW'})
+            self.assertEqual(self.resolver.resolve('new'), self.created['id'])
+            self.assertIsNone(self.resolver.lookup('missing'))
+            self.assertEqual(self.resolver.misses, 2)
+            self.reqs.Bb_PATCH(self.server.url, f'{self.endpoint}/_9_1', 'token', {'courseId': 'RENAMED'})
+            self.assertLess(self.resolver.refresh(), 5)
+            self.assertEqual(self.resolver.resolve('RENAMED', 'courseId'), '_9_1')
+            self.assertIsNone(self.resolver.index['courseId'].get('COURSE000009'))
+            self.requests = self.server.stats['requests']
+            self.utils = Bb_Utils(self.reqs)
+            self.assertTrue(self.utils.check_course_id(self.server.url, 'token', 'courses000010', self.resolver))
+            self.assertEqual(self.utils.learn_convert_external_id(
+                self.server.url, 'token', 'courses000010', 'courseId', self.resolver), 'COURSE000010')
+            self.assertEqual(self.server.stats['requests'], self.requests)
+
+
+    def test_batch_order_and_errors(self):
+        self.endpoint = '/learn/api/public/v1/users'
+        self.jobs = [('GET', f'{self.endpoint}/_{i + 1}_1', None) for i in range(20)]
+        self.jobs[7] = ('PATCH', f'{self.endpoint}/_9999_1', {'userName': 'missing'})
+        with Mock_Learn_Server(records=20, latency_jitter=0.02, seed=5) as self.server, \
+                Bb_Requests(pool_maxsize=8) as self.reqs:
+            self.batch = Bb_Batch(self.reqs, self.server.url, 'token', max_workers=8)
+            self.results = list(self.batch.run(self.jobs))
+        self.assertEqual([result['index'] for result in self.results], list(range(20)))
+        self.assertEqual(self.results[3]['data']['id'], '_4_1')
+        self.assertEqual(self.results[7]['status'], 404)
+        self.assertIsNotNone(self.results[7]['error'])
+        self.assertEqual((self.batch.succeeded, self.batch.failed), (19, 1))
+
+
+    def test_batch_backpressure(self):
+        self.read = 0
+        self.ahead = []
+
+        def jobs():
+            for i in range(50):
+                self.read += 1
+                yield ('POST', '/learn/api/public/v1/courses', {'externalId': f'course{i}'})
+        with Mock_Learn_Server(latency=0.002) as self.server, Bb_Requests(pool_maxsize=4) as self.reqs:
+            self.batch = Bb_Batch(self.reqs, self.server.url, 'token', max_workers=4, max_pending=6)
+            for done, result in enumerate(self.batch.run(jobs()), 1):
+                self.ahead.append(self.read - done)
+        self.assertEqual(done, 50)
+        self.assertLessEqual(max(self.ahead), 6)
+
+
+    def test_batch_checkpoint_skips_done_jobs(self):
+        self.jobs = [('POST', '/learn/api/public/v1/courses', {'externalId': f'course{i}'}) for i in range(5)]
+        with Mock_Learn_Server(records=0) as self.server, Bb_Requests() as self.reqs, \
+                tempfile.TemporaryDirectory() as folder:
+            with Checkpoint_Store(os.path.join(folder, 'batch.db'), 'courses') as self.store:
+                self.results = list(Bb_Batch(self.reqs, self.server.url, 'token', checkpoint=self.store).run(self.jobs[:3]))
+            self.assertEqual(self.server.stats['POST 201'], 3)
+            with Checkpoint_Store(os.path.join(folder, 'batch.db'), 'courses') as self.store:
+                self.batch = Bb_Batch(self.reqs, self.server.url, 'token', checkpoint=self.store)
+                self.resumed = list(self.batch.run(self.jobs))
+            self.assertEqual([result['skipped'] for result in self.resumed], [True] * 3 + [False] * 2)
+            self.assertEqual([result['data'] for result in self.resumed[:3]],
+                             [result['data']['id'] for result in self.results])
+            self.assertEqual(self.batch.skipped, 3)
+            self.assertEqual(self.server.stats['POST 201'], 5)
+
+
+    def test_upload_streamed_and_retried(self):
+        self.progress = []
+        with tempfile.NamedTemporaryFile(suffix='.bin', delete=False) as f:
+            f.write(os.urandom(300000))
+        try:
+            with Multipart_Encoder(f.name, chunk_size=1000) as self.body:
+                self.chunks = list(self.body)
+                self.assertEqual(len(b''.join(self.chunks)), len(self.body))
+                assert max(len(c) for c in self.chunks) <= 1000
+            with Mock_Learn_Server(error_rate=0.5, seed=3) as self.server:
+                with Bb_Requests(retry_policy=Retry_Policy(max_attempts=10, backoff_factor=0.001)) as self.reqs:
+                    self.ids = self.reqs.Bb_POST_files(
+                        self.server.url, 'token', [f.name, f.name], max_workers=2,
+                        callback=lambda *args: self.progress.append(args))
+                self.assertEqual(len([i for i in self.ids if i]), 2)
+                self.assertEqual(self.server.stats['uploaded_bytes'], 2 * len(self.body))
+            self.assertEqual(self.progress[-1][1], self.progress[-1][2])
+        finally:
+            os.remove(f.name)
+
+
+    @unittest.skipIf(httpx is None, 'httpx is not installed')
+    def test_async_get_matches_sync(self):
+        self.endpoint = '/learn/api/public/v1/users'
+
+        async def get():
+            async with AsyncBb_Requests() as reqs:
+                return await reqs.Bb_GET(self.server.url, self.endpoint, 'token', {'limit': 40})
+        with Mock_Learn_Server(records=250) as self.server, Bb_Requests() as self.reqs:
+            self.expected = self.reqs.Bb_GET(self.server.url, self.endpoint, 'token', {'limit': 40})
+            self.users = asyncio.run(get())
+        self.assertEqual(len(self.users), 250)
+        self.assertEqual(self.users, self.expected)
+
+
+    @unittest.skipIf(httpx is None, 'httpx is not installed')
+    def test_async_auth_shared_token(self):
+        async def get_all():
+            async with AsyncAuth_Helper(self.server.url, 'key', 'secret') as auth, \
+                    AsyncBb_Requests() as reqs:
+                return await asyncio.gather(*[
+                    reqs.Bb_GET(self.server.url, '/learn/api/public/v1/users', auth) for _ in range(20)])
+        with Mock_Learn_Server(records=10, latency=0.01, check_tokens=True) as self.server:
+            self.results = asyncio.run(get_all())
+        self.assertEqual([len(result) for result in self.results], [10] * 20)
+        self.assertEqual(self.server.stats['POST 200'], 1)
+        self.assertEqual(self.server.stats['GET 401'], 0)
+
+
+    @unittest.skipIf(httpx is None, 'httpx is not installed')
+    def test_async_write_statuses(self):
+        self.endpoint = '/learn/api/public/v3/courses'
+
+        async def write():
+            async with AsyncBb_Requests() as reqs:
+                url = self.server.url
+                created = await reqs.Bb_POST(url, self.endpoint, 'token', {'externalId': 'new'})
+                patched = await reqs.Bb_PATCH(url, f'{self.endpoint}/{created["id"]}', 'token', {'name': 'Patched'})
+                missing = await reqs.Bb_PATCH(url, f'{self.endpoint}/_999_1', 'token', {'name': 'Missing'})
+                replaced = await reqs.Bb_PUT(url, f'{self.endpoint}/_1_1', 'token', {'name': 'Replaced'})
+                await reqs.Bb_DELETE(url, f'{self.endpoint}/{created["id"]}', 'token')
+                await reqs.Bb_DELETE(url, f'{self.endpoint}/{created["id"]}', 'token')
+                return created, patched, missing, replaced
+        with Mock_Learn_Server(records=2) as self.server:
+            self.created, self.patched, self.missing, self.replaced = asyncio.run(write())
+        self.assertEqual(self.created['externalId'], 'new')
+        self.assertEqual(self.patched['name'], 'Patched')
+        self.assertIsNone(self.missing)
+        self.assertEqual(self.replaced, {'id': '_1_1', 'name': 'Replaced', 'modified': self.replaced['modified']})
+        self.assertEqual(self.server.stats['PATCH 404'], 1)
+        self.assertEqual((self.server.stats['DELETE 204'], self.server.stats['DELETE 404']), (1, 1))
+
+
+    @unittest.skipIf(httpx is None, 'httpx is not installed')
+    def test_async_upload_with_metrics(self):
+        self.metrics = Metrics_Collector()
+        with tempfile.NamedTemporaryFile(suffix='.bin', delete=False) as f:
+            f.write(os.urandom(50000))
+
+        async def upload():
+            async with AsyncBb_Requests(metrics=self.metrics) as reqs:
+                return await reqs.Bb_POST_file(self.server.url, 'token', f.name)
+        try:
+            with Mock_Learn_Server() as self.server:
+                self.upload_id = asyncio.run(upload())
+            self.assertEqual(self.upload_id, '_upload_1')
+            self.endpoint = self.metrics.snapshot()['endpoints'][0]
+            self.assertEqual(self.endpoint['count'], 1)
+            self.assertGreater(self.endpoint['bytes_out'], 50000)
+        finally:
+            os.remove(f.name)
+
+
+    def test_single_flight_shares_result(self):
+        self.flight = Single_Flight()
+        self.started = threading.Event()
+        self.calls = []
+        self.results = []
+
+        def slow():
+            self.calls.append(1)
+            self.started.set()
+            time.sleep(0.2)
+            return {'results': [1, 2]}
+
+        def caller():
+            self.results.append(self.flight.do('key', slow))
+
+        self.threads = [threading.Thread(target=caller)]
+        self.threads[0].start()
+        self.started.wait()
+        self.threads += [threading.Thread(target=caller) for _ in range(4)]
+        for thread in self.threads[1:]:
+            thread.start()
+        for thread in self.threads:
+            thread.join()
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(self.flight.shared, 4)
+        self.assertEqual(len({id(result) for result in self.results}), 5)
+
+
+    def test_coalesced_get(self):
+        self.endpoint = '/learn/api/public/v1/users'
+        self.results = []
+        with Mock_Learn_Server(records=250, latency=0.05) as self.server, \
+                Bb_Requests(coalesce=True, pool_maxsize=8) as self.reqs:
+            self.barrier = threading.Barrier(8)
+
+            def get():
+                self.barrier.wait()
+                self.results.append(self.reqs.Bb_GET(self.server.url, self.endpoint, 'token'))
+            self.threads = [threading.Thread(target=get) for _ in range(8)]
+            for thread in self.threads:
+                thread.start()
+            for thread in self.threads:
+                thread.join()
+            self.assertEqual(self.server.stats['GET 200'], 3)
+            self.assertEqual(self.reqs.single_flight.shared, 7)
+            self.assertEqual([len(result) for result in self.results], [250] * 8)
+            self.results[0][0]['userName'] = 'changed'
+            self.assertEqual([result[0]['userName'] for result in self.results[1:]], ['user000001'] * 7)
+
+
+    def test_utils_shared_by_threads(self):
+        self.converted = {}
+        with Mock_Learn_Server(records=30, latency=0.01) as self.server, Bb_Requests(pool_maxsize=8) as self.reqs:
+            self.utils = Bb_Utils(self.reqs)
+
+            def convert(i):
+                self.converted[i] = self.utils.learn_convert_external_id(
+                    self.server.url, 'token', f'courses{i:06d}', 'courseId')
+            self.threads = [threading.Thread(target=convert, args=(i,)) for i in range(1, 21)]
+            for thread in self.threads:
+                thread.start()
+            for thread in self.threads:
+                thread.join()
+        self.assertEqual(self.converted, {i: f'COURSE{i:06d}' for i in range(1, 21)})
+
+
+    def test_tenant_registry_fair_run(self):
+        with Mock_Learn_Server(records=50, latency=0.2) as self.slow, \
+                Mock_Learn_Server(records=50) as self.fast:
+            with tempfile.TemporaryDirectory() as folder:
+                with open(os.path.join(folder, 'tenants.json'), 'w') as f:
+                    json.dump({'slow': {'url': self.slow.url, 'key': 'k', 'secret': 's'},
+                               'fast': {'url': self.fast.url, 'key': 'k', 'secret': 's'}}, f)
+                self.registry = Tenant_Registry(folder)
+            self.assertEqual(sorted(self.registry.names()), ['fast', 'slow'])
+
+            def job(tenant):
+                return len(tenant.reqs.Bb_GET(tenant.url, '/learn/api/public/v1/users', tenant.token))
+
+            self.order = [r['tenant'] for r in self.registry.run(
+                {'slow': [job] * 4, 'fast': [job] * 4}, max_workers=2, max_per_tenant=1)]
+            self.registry.close()
+            self.assertEqual(self.order[:4], ['fast'] * 4)
+            self.assertEqual(self.fast.stats['POST 200'], 1)
+            with self.assertRaises(ValueError):
+                self.registry.run({'fast': [job]}, max_per_tenant=0)
+
+
+    def test_delta_sync(self):
+        self.endpoint = '/learn/api/public/v1/users'
+        for supports_modified in (True, False):
+            with Mock_Learn_Server(records=300, supports_modified=supports_modified) as self.server, \
+                    tempfile.TemporaryDirectory() as folder:
+                with Bb_Requests() as self.reqs, \
+                        Delta_Sync(self.reqs, self.server.url, 'token', os.path.join(folder, 'sync.db')) as self.sync:
+                    self.assertEqual(self.sync.sync(self.endpoint)['added'], 300)
+                    self.reqs.Bb_PATCH(self.server.url, f'{self.endpoint}/_5_1', 'token', {'userName': 'changed'})
+                    self.reqs.Bb_DELETE(self.server.url, f'{self.endpoint}/_7_1', 'token')
+                    self.counts = self.sync.sync(self.endpoint)
+                    self.assertEqual(self.counts['updated'], 1)
+                    self.assertEqual(self.counts['full'], not supports_modified)
+                    self.assertEqual(self.counts['deleted'], 0 if supports_modified else 1)
+                    self.assertEqual(self.sync.get(self.endpoint, '_5_1')['userName'], 'changed')
+
+
+    def test_date_converter_column(self):
+        self.converter = Date_Converter(use_numpy=False)
+        self.converted, self.bad_rows = self.converter.convert_column(
+            iter(['02/02/2021', '02/02/2021 23:45', 'x', '02/02/2021 23:45:24', '31/02/2021', None, '02/02/2021']))
+        self.assertEqual(self.converted[:2], ['2021-02-02T00:00:00.000Z', '2021-02-02T23:45:00.000Z'])
+        self.assertEqual(self.converted[3], '2021-02-02T23:45:24.000Z')
+        self.assertEqual(self.bad_rows, [2, 4, 5])
+
+
+    def test_set_logging_queued_idempotent(self):
+        self.utils = Bb_Utils()
+        self.logger = logging.getLogger('Bb_rest_helper')
+        self.handlers = list(self.logger.handlers)
+        with tempfile.TemporaryDirectory() as folder:
+            for _ in range(3):
+                self.utils.set_logging(folder, queued=True, rate_limit_interval=60)
+            self.assertEqual(len(self.logger.handlers), len(self.handlers) + 1)
+            with Bb_Requests() as self.reqs:
+                for _ in range(100):
+                    self.reqs._log_rate_limit(requests.Response())
+            self.utils.stop_logging()
+            self.assertEqual(self.logger.handlers, self.handlers)
+            with open(os.path.join(folder, 'Bb_rest_helper_log')) as f:
+                self.lines = f.read().splitlines()
+            self.assertEqual(len([line for line in self.lines if 'API limit' in line]), 1)
+
+
+    def test_queued_logging_formats_on_caller(self):
+        self.logger = logging.getLogger('Bb_rest_helper')
+        self.utils = Bb_Utils()
+        with tempfile.TemporaryDirectory() as folder:
+            self.utils.set_logging(folder, logging.INFO, queued=True)
+            self.payload = {'state': 'sent'}
+            self.logger.info('Payload %s', self.payload)
+            self.payload['state'] = 'changed'
+            self.utils.stop_logging()
+            with open(os.path.join(folder, 'Bb_rest_helper_log')) as f:
+                self.text = f.read()
+        self.assertIn("Payload {'state': 'sent'}", self.text)
+
+
+    def test_flat_file_feed(self):
+        self.users = [{
+            'externalId': f'sis{i}', 'userName': f'user{i}', 'password': 'secret',
+            'name': {'given': 'Jane', 'family': f'Student {i}'}, 'availability': {'available': 'Yes'}
+        } for i in range(25)]
+        self.users.append({'externalId': 'bad|id', 'userName': 'bad'})
+        with Mock_Learn_Server(records=0, feed_delay=0.2) as self.server, Bb_Requests() as self.reqs:
+            self.feed = Flat_File_Feed(self.server.url + Mock_Learn_Server.flat_file_endpoint, 'user', 'password',
+                                       'person', reqs=self.reqs, batch_size=10, compress=True)
+            self.references = self.feed.submit(iter(self.users))
+            self.assertEqual(len(self.references), 3)
+            self.assertEqual(self.feed.bad_rows, [25])
+            self.assertEqual(self.feed.status(self.references[0])['queuedCount'], 10)
+            self.statuses = self.feed.wait(self.references, poll_interval=0.05, timeout=10)
+            self.assertEqual(sum(status['completedCount'] for status in self.statuses.values()), 25)
+            self.created = self.reqs.Bb_GET(self.server.url, '/learn/api/public/v1/users', 'token')
+            self.assertEqual(self.created[24]['name']['family'], 'Student 24')
+
+
+
+    def test_flat_file_feed_resolves_learn_ids(self):
+        self.memberships = [{'courseId': '_3_1', 'userId': '_5_1', 'courseRoleId': 'Student', 'dataSourceId': '_2_1'},
+                            {'courseId': 'externalId:C1', 'userId': 'sis1', 'courseRoleId': 'Instructor'}]
+        with Mock_Learn_Server(records=10) as self.server, Bb_Requests() as self.reqs:
+            self.url = self.server.url + Mock_Learn_Server.flat_file_endpoint
+            self.feed = Flat_File_Feed(
+                self.url, 'user', 'password', 'membership', reqs=self.reqs,
+                courses=Id_Resolver(self.reqs, self.server.url, 'token', 'courses'),
+                users=Id_Resolver(self.reqs, self.server.url, 'token', 'users'))
+            self.rows = list(self.feed.files(self.memberships))
+            self.assertEqual(self.rows, [[
+                'external_course_key|external_person_key|role|data_source_key',
+                'courses000003|users000005|student|dataSources000002',
+                'C1|sis1|instructor|']])
+            self.feed = Flat_File_Feed(self.url, 'user', 'password', 'membership', reqs=self.reqs)
+            with self.assertRaises(ValueError):
+                list(self.feed.files(self.memberships))
+
+
+    def test_content_crawler(self):
+        with Mock_Learn_Server(latency=0.005, content_fanout=3, content_depth=3) as self.server, \
+                Bb_Requests(pool_maxsize=4) as self.reqs:
+            self.crawler = Content_Crawler(self.reqs, self.server.url, 'token', max_in_flight=4, max_courses=2)
+            self.nodes = list(self.crawler.crawl(['_1_1', '_2_1', '_3_1']))
+            self.assertEqual(len(self.nodes), 3 * 21)
+            self.assertLessEqual(self.server.stats['max_in_flight'], 4)
+            self.seen = set()
+            for node in self.nodes:
+                if node['parent'] is not None:
+                    self.assertIn((node['course'], node['parent']), self.seen)
+                self.seen.add((node['course'], node['content']['id']))
+            self.crawler = Content_Crawler(self.reqs, self.server.url, 'token', max_depth=1,
+                                           handlers=['resource/x-bb-document'])
+            self.nodes = list(self.crawler.crawl(['_4_1']))
+            self.assertEqual(self.crawler.listings, 3)
+            self.assertEqual([node['depth'] for node in self.nodes], [0, 1, 1])
+
+
+
+    def test_gradebook_matrix(self):
+        with Mock_Learn_Server(records=250, grade_columns=4) as self.server, Bb_Requests() as self.reqs, \
+                tempfile.TemporaryDirectory() as folder:
+            self.matrix = Gradebook_Matrix(
+                self.reqs, self.server.url, 'token', '_1_1', roles=['Student'], max_workers=4, use_numpy=False).fetch()
+            self.assertEqual(len(self.matrix.user_ids), 225)
+            self.assertEqual(self.matrix.column_ids, ['_1_1', '_2_1', '_3_1', '_4_1'])
+            self.assertEqual(self.matrix.errors, [])
+            self.assertEqual(self.matrix.grade('_2_1', '_3_1'), float((1 * 7 + 2 * 13) % 101))
+            self.assertNotEqual(self.matrix.grade('_1_1', '_1_1'), self.matrix.grade('_1_1', '_1_1'))
+            self.assertGreater(self.matrix.unknown_grades, 0)
+            self.matrix.write_csv(os.path.join(folder, 'grades.csv'))
+            with open(os.path.join(folder, 'grades.csv'), newline='') as f:
+                self.rows = list(csv.reader(f))
+            self.assertEqual(self.rows[0], ['userId', 'Assignment 1', 'Assignment 2', 'Assignment 3', 'Assignment 4'])
+            self.assertEqual(self.rows[1][:3], ['_1_1', '', '13.0'])
+            self.assertEqual(len(self.rows), 226)
+
+
 if __name__ == '__main__':
     unittest.main()